@@ -0,0 +1,57 @@
+"""
+Cost of packing and parsing the callback data of the catalog buttons: aiogram's CallbackData with the
+eight fields AllCategoriesCallback used to have, against the compact encoding, both when the tapped button's
+state is still in the CallbackStateTable and when it has to be decoded from the base64 payload.
+
+    python benchmarks/callback_data.py
+"""
+import environment
+
+environment.prepare()
+
+from aiogram.filters.callback_data import CallbackData
+
+from handlers.user.all_categories import AllCategoriesCallback
+from utils.compact_callback import CallbackStateTable
+
+
+class LegacyAllCategoriesCallback(CallbackData, prefix="all_categories"):
+    level: int
+    category_id: int
+    subcategory_id: int
+    price: float
+    total_price: float
+    quantity: int
+    confirmation: bool
+    page: int
+
+
+def main():
+    repeat = 20000
+    legacy = LegacyAllCategoriesCallback(level=3, category_id=12, subcategory_id=345, price=19.99,
+                                         total_price=199.9, quantity=10, confirmation=False, page=0)
+    compact = AllCategoriesCallback(level=3, category_id=12, subcategory_id=345, quantity=10, confirmation=False,
+                                    cursor="a345")
+    legacy_data = legacy.pack()
+    compact_data = compact.pack()
+    results = [
+        ("aiogram pack", environment.measure(legacy.pack, repeat), len(legacy_data)),
+        ("aiogram unpack", environment.measure(lambda: LegacyAllCategoriesCallback.unpack(legacy_data), repeat),
+         len(legacy_data)),
+        ("compact pack", environment.measure(compact.pack, repeat), len(compact_data)),
+        ("compact unpack, state table hit",
+         environment.measure(lambda: AllCategoriesCallback.unpack(compact_data), repeat), len(compact_data))
+    ]
+    # Without room in the table every unpack decodes the payload, like a button sent before a restart.
+    CallbackStateTable.max_entries = 0
+    evicted_data = compact.pack()
+    results.append(("compact unpack, decoded",
+                    environment.measure(lambda: AllCategoriesCallback.unpack(evicted_data), repeat),
+                    len(evicted_data)))
+    print(f"{'operation':<34}{'us/call':>10}{'bytes':>8}")
+    for operation, seconds, size in results:
+        print(f"{operation:<34}{seconds * 1e6:>10.2f}{size:>8}")
+
+
+if __name__ == "__main__":
+    main()
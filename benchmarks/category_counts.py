@@ -0,0 +1,119 @@
+"""
+Time to build the "All categories" page with the stock of every category at 10k, 100k and 1M items:
+a count query per category on the page (the N+1 queries create_category_buttons used to make)
+against the single grouped query of CategoryService.get_all_with_items_count,
+and against the in-memory catalog snapshot the user handlers read, once loaded.
+
+    python benchmarks/category_counts.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import asyncio
+import time
+
+import environment
+
+environment.prepare()
+
+from sqlalchemy import select, func, text
+
+import config
+from db import create_db_and_tables, get_db_session, session_execute, session_commit
+from models.category import Category
+from models.item import Item
+from models.subcategory import Subcategory
+from services.category import CategoryService
+from utils.catalog_snapshot import CatalogCache
+from utils.keyset_pagination import PageCursor
+
+categories_count = 50
+subcategories_per_category = 4
+
+
+async def seed_catalog():
+    async with get_db_session() as session:
+        await session_execute(text("INSERT INTO photos (id, sha256, size) VALUES (1, 'sha256', 0)"), session)
+        for category_id in range(1, categories_count + 1):
+            await session_execute(text(f"INSERT INTO categories (id, name, description, image_id, is_hidden) "
+                                       f"VALUES ({category_id}, 'category {category_id:03}', 'description', 1, 0)"),
+                                  session)
+            for number in range(subcategories_per_category):
+                subcategory_id = (category_id - 1) * subcategories_per_category + number + 1
+                await session_execute(text(f"INSERT INTO subcategories (id, name, price, is_hidden, "
+                                           f"category_id, image_id) VALUES ({subcategory_id}, "
+                                           f"'subcategory {subcategory_id}', 1.0, 0, {category_id}, 1)"), session)
+        await session_commit(session)
+
+
+async def add_items(first: int, last: int):
+    # Items are spread over all subcategories, every third one is sold.
+    subcategories_count = categories_count * subcategories_per_category
+    async with get_db_session() as session:
+        await session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT {first} UNION ALL SELECT i + 1 FROM n "
+                                   f"WHERE i < {last}) "
+                                   f"INSERT INTO items (subcategory_id, private_data, is_sold, is_new) "
+                                   f"SELECT i % {subcategories_count} + 1, 'data ' || i, i % 3 = 0, 0 FROM n"),
+                              session)
+        await session_commit(session)
+
+
+async def count_per_category() -> list[tuple[Category, int]]:
+    async with get_db_session() as session:
+        categories = await session_execute(select(Category).where(Category.is_hidden == False)
+                                           .order_by(Category.name).limit(config.PAGE_ENTRIES), session)
+        categories = categories.scalars().all()
+    page = []
+    for category in categories:
+        async with get_db_session() as session:
+            items = (select(Item.id)
+                     .join(Subcategory, Item.subcategory_id == Subcategory.id)
+                     .join(Category, Subcategory.category_id == Category.id)
+                     .where(Item.is_sold == 0, Category.id == category.id))
+            items_count = await session_execute(select(func.count()).select_from(items.subquery()), session)
+            page.append((category, items_count.scalar()))
+    return page
+
+
+async def load_catalog_snapshot():
+    CatalogCache.invalidate()
+    return (await CatalogCache.get()).get_categories_with_items_count(PageCursor.FIRST)
+
+
+async def read_catalog_snapshot():
+    return (await CatalogCache.get()).get_categories_with_items_count(PageCursor.FIRST)
+
+
+async def measure(call, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+async def run(sizes: list[int]):
+    await create_db_and_tables()
+    await seed_catalog()
+    print(f"{'items':>9}  {'query per category ms':>22}{'grouped query ms':>18}{'snapshot load ms':>18}"
+          f"{'snapshot read ms':>18}")
+    items_count = 0
+    for size in sorted(sizes):
+        await add_items(items_count + 1, size)
+        items_count = size
+        timings = [await measure(count_per_category),
+                   await measure(lambda: CategoryService.get_all_with_items_count(PageCursor.FIRST)),
+                   await measure(load_catalog_snapshot),
+                   await measure(read_catalog_snapshot, repeat=100)]
+        print(f"{size:>9}  {timings[0] * 1000:>22.2f}{timings[1] * 1000:>18.2f}{timings[2] * 1000:>18.2f}"
+              f"{timings[3] * 1000:>18.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.sizes))
+
+
+if __name__ == "__main__":
+    main()
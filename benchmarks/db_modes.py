@@ -0,0 +1,116 @@
+"""
+Update latency under concurrent load for the three database modes: unencrypted (aiosqlite),
+encrypted-blocking (DB_ENCRYPTION_OFFLOAD=false) and encrypted-offloaded (sqlcipher on the database threads).
+Every simulated update loads the user and its language the way the middlewares and handlers do,
+waits for a simulated Telegram API call and every tenth update writes to the user's row.
+The event loop lag is the longest delay of a 1ms ticker, it shows how long queries blocked other updates.
+Encrypted modes need sqlcipher3.
+
+    python benchmarks/db_modes.py [--updates 2000] [--users 1000] [--api-latency 0.005]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+modes = {
+    "unencrypted": {"DB_ENCRYPTION": "false"},
+    "encrypted-blocking": {"DB_ENCRYPTION": "true", "DB_ENCRYPTION_OFFLOAD": "false"},
+    "encrypted-offloaded": {"DB_ENCRYPTION": "true", "DB_ENCRYPTION_OFFLOAD": "true"}
+}
+
+
+async def run_load(updates: int, users: int, api_latency: float) -> dict:
+    from sqlalchemy import text
+    import config
+    from db import create_db_and_tables, db_session_scope, get_db_session, session_execute, session_commit
+    from services.user import UserService
+
+    await create_db_and_tables()
+    async with get_db_session() as session:
+        await session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {users}) "
+                                   f"INSERT INTO users (telegram_id, telegram_username, ltc_address, seed, balance) "
+                                   f"SELECT i, 'user' || i, 'address' || i, 'seed' || i, 0 FROM n"), session)
+        await session_commit(session)
+
+    async def process_update(number: int) -> float:
+        started_at = time.perf_counter()
+        telegram_id = random.randint(1, users)
+        async with db_session_scope():
+            await UserService.get_language(telegram_id)
+            await UserService.get_by_tgid(telegram_id)
+            await UserService.can_refresh_balance(telegram_id)
+            await asyncio.sleep(api_latency)
+            if number % 10 == 0:
+                await UserService.create_last_balance_refresh_data(telegram_id)
+        return time.perf_counter() - started_at
+
+    max_lag = 0.0
+    is_running = True
+
+    async def tick():
+        nonlocal max_lag
+        while is_running:
+            started_at = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - started_at - 0.001)
+
+    # The update queue runs UPDATE_WORKERS updates at a time.
+    workers = asyncio.Semaphore(config.UPDATE_WORKERS)
+
+    async def process_queued_update(number: int) -> float:
+        async with workers:
+            return await process_update(number)
+
+    ticker = asyncio.create_task(tick())
+    started_at = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*[process_queued_update(number) for number in range(updates)]))
+    elapsed = time.perf_counter() - started_at
+    is_running = False
+    await ticker
+    return {
+        "updates_per_second": updates / elapsed,
+        "latency_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "max_loop_lag_ms": max_lag * 1000
+    }
+
+
+def run_mode(mode: str, arguments: argparse.Namespace) -> dict:
+    # The database mode is read when db.py is imported, every mode runs in a process of its own.
+    command = [sys.executable, __file__, "--mode", mode, "--updates", str(arguments.updates),
+               "--users", str(arguments.users), "--api-latency", str(arguments.api_latency)]
+    completed = subprocess.run(command, capture_output=True, text=True, env=os.environ.copy())
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=modes)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    arguments = parser.parse_args()
+    if arguments.mode is not None:
+        import environment
+        environment.prepare(**modes[arguments.mode])
+        print(json.dumps(asyncio.run(run_load(arguments.updates, arguments.users, arguments.api_latency))))
+        return
+    print(f"{'mode':<22}{'updates/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'loop lag ms':>14}")
+    for mode in modes:
+        result = run_mode(mode, arguments)
+        if "error" in result:
+            print(f"{mode:<22}{result['error']}")
+            continue
+        print(f"{mode:<22}{result['updates_per_second']:>12.0f}{result['latency_p50_ms']:>10.1f}"
+              f"{result['latency_p95_ms']:>10.1f}{result['max_loop_lag_ms']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
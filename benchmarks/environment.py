@@ -0,0 +1,55 @@
+"""
+Lets a benchmark import the bot's modules without a Telegram token or an ngrok tunnel.
+Call prepare() before importing any module of the bot, it chdirs into a fresh folder that holds
+the benchmark's database, so the bot's own data folder is never touched.
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+repository_folder = Path(__file__).resolve().parent.parent
+
+default_environment = {
+    "WEBHOOK_PATH": "/webhook",
+    "WEBAPP_HOST": "localhost",
+    "WEBAPP_PORT": "5000",
+    "TOKEN": "123456:benchmark",
+    "ADMIN_ID_LIST": "1",
+    "SUPPORT_LINK": "https://t.me/support",
+    "DB_NAME": "benchmark.db",
+    "DB_PASS": "benchmark",
+    "PAGE_ENTRIES": "8",
+    "BOT_LANGUAGE": "en",
+    "CURRENCY": "USD"
+}
+
+
+def prepare(**environment: str) -> Path:
+    for name, value in default_environment.items():
+        os.environ.setdefault(name, value)
+    os.environ.update(environment)
+    # config.py opens a tunnel on import, the benchmarks never receive webhooks.
+    ngrok_executor = types.ModuleType("ngrok_executor")
+    ngrok_executor.start_ngrok = lambda: "https://localhost"
+    sys.modules["ngrok_executor"] = ngrok_executor
+    sys.path.insert(0, str(repository_folder))
+    working_folder = Path(tempfile.mkdtemp(prefix="benchmark_"))
+    (working_folder / "l10n").symlink_to(repository_folder / "l10n")
+    os.chdir(working_folder)
+    return working_folder
+
+
+def measure(function, repeat: int) -> float:
+    """
+    Seconds per call of function, best of 5 runs of repeat calls.
+    """
+    timings = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        timings.append((time.perf_counter() - started_at) / repeat)
+    return min(timings)
@@ -0,0 +1,50 @@
+"""
+Per-call cost of a localization lookup: reading and parsing l10n/<lang>.json on every call, as get_text used to,
+against the cached catalog of Localizator.get_text, including its periodic mtime check for hot reloads.
+Also shows the cost of the texts of one category screen, which takes dozens of lookups.
+
+    python benchmarks/localization.py
+"""
+import json
+
+import environment
+
+environment.prepare()
+
+import config
+from utils.localizator import Localizator, BotEntity
+
+# Lookups of one "All categories" page with pagination and the quantity selection.
+screen_lookups = ([(BotEntity.USER, "all_categories")] * 2 + [(BotEntity.COMMON, "back_button")] * 4 +
+                  [(BotEntity.USER, "subcategory_button")] * 8 + [(BotEntity.USER, "select_quantity")] +
+                  [(BotEntity.COMMON, f"{config.CURRENCY.value.lower()}_symbol")] * 10)
+
+
+def get_text_from_file(entity: BotEntity, key: str) -> str:
+    with open(f"./l10n/{config.BOT_LANGUAGE}.json", "r", encoding="UTF-8") as f:
+        if entity == BotEntity.ADMIN:
+            return json.loads(f.read())["admin"][key]
+        elif entity == BotEntity.USER:
+            return json.loads(f.read())["user"][key]
+        else:
+            return json.loads(f.read())["common"][key]
+
+
+def main():
+    results = [
+        ("parse file per call", environment.measure(lambda: get_text_from_file(BotEntity.USER, "all_categories"),
+                                                    2000)),
+        ("cached catalog", environment.measure(lambda: Localizator.get_text(BotEntity.USER, "all_categories"),
+                                               200000)),
+        (f"screen of {len(screen_lookups)} lookups, parse file per call",
+         environment.measure(lambda: [get_text_from_file(entity, key) for entity, key in screen_lookups], 100)),
+        (f"screen of {len(screen_lookups)} lookups, cached catalog",
+         environment.measure(lambda: [Localizator.get_text(entity, key) for entity, key in screen_lookups], 10000))
+    ]
+    print(f"{'lookup':<48}{'us/call':>10}")
+    for lookup, seconds in results:
+        print(f"{lookup:<48}{seconds * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Commits, statements and time per purchase: the per-row writes purchases used to make (one UPDATE per sold item
+and one committed INSERT per BuyItem row) against CheckoutService.checkout, which marks the items sold with
+one UPDATE and links them with one multi-row INSERT in a single transaction.
+
+    python benchmarks/purchase_commits.py [--purchases 20]
+"""
+import argparse
+import asyncio
+import time
+
+import environment
+
+environment.prepare()
+
+from sqlalchemy import event, text, update, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import db
+from db import create_db_and_tables, get_db_session, session_execute, session_commit, db_session_stats
+from models.buy import Buy
+from models.buyItem import BuyItem
+from models.item import Item
+from services.checkout import CheckoutService, CheckoutStatus
+
+quantities = [1, 10, 100]
+
+
+async def seed(items: int, users: int):
+    async with get_db_session() as session:
+        await session_execute(text("INSERT INTO photos (id, sha256, size) VALUES (1, 'sha256', 0)"), session)
+        await session_execute(text("INSERT INTO categories (id, name, description, image_id) "
+                                   "VALUES (1, 'category', 'description', 1)"), session)
+        await session_execute(text("INSERT INTO subcategories (id, name, price, category_id, image_id) "
+                                   "VALUES (1, 'subcategory', 1.0, 1, 1)"), session)
+        await session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {items}) "
+                                   f"INSERT INTO items (subcategory_id, private_data, is_sold, is_new) "
+                                   f"SELECT 1, 'data ' || i, 0, 1 FROM n"), session)
+        await session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {users}) "
+                                   f"INSERT INTO users (id, telegram_id, ltc_address, seed, top_up_amount, balance) "
+                                   f"SELECT i, i, 'address' || i, 'seed' || i, {items}, {items} FROM n"), session)
+        await session_commit(session)
+
+
+async def buy_per_row(telegram_id: int, quantity: int):
+    # The writes of a purchase before batching, each BuyItem row was inserted and committed on its own.
+    async with get_db_session() as session:
+        items = await session_execute(select(Item).where(Item.subcategory_id == 1, Item.is_sold == False)
+                                      .limit(quantity), session)
+        items = items.scalars().all()
+        buy = Buy(buyer_id=telegram_id, quantity=quantity, total_price=float(quantity))
+        session.add(buy)
+        await session_commit(session)
+    async with get_db_session() as session:
+        for item in items:
+            await session_execute(update(Item).where(Item.id == item.id).values(is_sold=1), session)
+        await session_commit(session)
+    for item in items:
+        async with get_db_session() as session:
+            session.add(BuyItem(buy_id=buy.id, item_id=item.id))
+            await session_commit(session)
+
+
+async def buy_batched(telegram_id: int, quantity: int):
+    result = await CheckoutService.checkout(telegram_id, 1, quantity)
+    assert result.status == CheckoutStatus.COMPLETED
+
+
+async def run(purchases: int):
+    await create_db_and_tables()
+    await seed(items=sum(quantities) * purchases * 2, users=purchases)
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(db.engine.sync_engine if isinstance(db.engine, AsyncEngine) else db.engine,
+                 "before_cursor_execute", count_statement)
+    print(f"{'quantity':>8}  {'writes':<10}{'commits':>9}{'statements':>12}{'ms':>9}")
+    for quantity in quantities:
+        for name, buy in (("per-row", buy_per_row), ("batched", buy_batched)):
+            commits_before, statements_before = db_session_stats.commits, statements
+            started_at = time.perf_counter()
+            for telegram_id in range(1, purchases + 1):
+                await buy(telegram_id, quantity)
+            elapsed = (time.perf_counter() - started_at) / purchases
+            print(f"{quantity:>8}  {name:<10}{(db_session_stats.commits - commits_before) / purchases:>9.0f}"
+                  f"{(statements - statements_before) / purchases:>12.0f}{elapsed * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--purchases", type=int, default=20)
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.purchases))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,17 @@ import config
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
 
 from config import TOKEN, WEBHOOK_URL, ADMIN_ID_LIST
 from db import create_db_and_tables
+from middlewares.db_session import DBSessionMiddleware
+from middlewares.localization import LocalizationMiddleware
+from middlewares.update_deduplication import UpdateDeduplicationMiddleware
+from services.balance import BalanceService
+from services.user import UserService
+from utils.update_queue import UpdateQueue, QueuedRequestHandler
 
 bot = Bot(TOKEN, parse_mode=ParseMode.HTML)
 dp = Dispatcher(storage=MemoryStorage())
@@ -16,6 +22,8 @@ dp = Dispatcher(storage=MemoryStorage())
 
 async def on_startup(bot: Bot):
     await create_db_and_tables()
+    await UserService.load_known_users()
+    BalanceService.start_reconciliation()
     await bot.set_webhook(WEBHOOK_URL)
     for admin in ADMIN_ID_LIST:
         try:
@@ -36,10 +44,18 @@ async def on_shutdown(dp):
 
 def main() -> None:
     dp.startup.register(on_startup)
+    deduplication_middleware = UpdateDeduplicationMiddleware()
+    dp.update.outer_middleware(deduplication_middleware)
+    dp.update.outer_middleware(DBSessionMiddleware())
+    dp.update.outer_middleware(LocalizationMiddleware())
     app = web.Application()
-    webhook_requests_handler = SimpleRequestHandler(
+    update_queue = UpdateQueue(config.UPDATE_WORKERS, config.UPDATE_QUEUE_SIZE)
+    update_queue.setup(app, config.METRICS_HOST, config.METRICS_PORT, config.METRICS_PATH)
+    update_queue.add_metrics_source("deduplication", deduplication_middleware.get_metrics)
+    webhook_requests_handler = QueuedRequestHandler(
         dispatcher=dp,
-        bot=bot
+        bot=bot,
+        update_queue=update_queue
     )
     webhook_requests_handler.register(app, path=config.WEBHOOK_PATH)
     setup_application(app, dp, bot=bot)
@@ -15,10 +15,30 @@ ADMIN_ID_LIST = os.environ.get("ADMIN_ID_LIST").split(',')
 ADMIN_ID_LIST = [int(admin_id) for admin_id in ADMIN_ID_LIST]
 SUPPORT_LINK = os.environ.get("SUPPORT_LINK")
 DB_ENCRYPTION = os.environ.get("DB_ENCRYPTION", False) == 'true'
+DB_ENCRYPTION_OFFLOAD = os.environ.get("DB_ENCRYPTION_OFFLOAD", "true") == 'true'
 DB_NAME = os.environ.get("DB_NAME")
 DB_PASS = os.environ.get("DB_PASS")
+DB_ECHO = os.environ.get("DB_ECHO", False) == 'true'
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 268435456))
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -65536))
+DB_TEMP_STORE = os.environ.get("DB_TEMP_STORE", "MEMORY")
+DB_MAINTENANCE_INTERVAL = int(os.environ.get("DB_MAINTENANCE_INTERVAL", 3600))
+BALANCE_RECONCILIATION_INTERVAL = int(os.environ.get("BALANCE_RECONCILIATION_INTERVAL", 3600))
 PAGE_ENTRIES = int(os.environ.get("PAGE_ENTRIES"))
+PHOTO_MAX_DIMENSION = int(os.environ.get("PHOTO_MAX_DIMENSION", 1280))
+PHOTO_JPEG_QUALITY = int(os.environ.get("PHOTO_JPEG_QUALITY", 85))
+RESERVATION_TTL = int(os.environ.get("RESERVATION_TTL", 300))
+ORDER_MESSAGES_LIMIT = int(os.environ.get("ORDER_MESSAGES_LIMIT", 5))
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", 8))
+DB_ENCRYPTION_THREADS = int(os.environ.get("DB_ENCRYPTION_THREADS", UPDATE_WORKERS + 8))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 1000))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9090))
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")
 BOT_LANGUAGE = os.environ.get("BOT_LANGUAGE")
 MULTIBOT = os.environ.get("MULTIBOT", False) == 'true'
+KNOWN_USERS_BLOOM = os.environ.get("KNOWN_USERS_BLOOM", False) == 'true'
 CURRENCY = Currency.from_string(os.environ.get("CURRENCY"))
 GETGEOAPI_KEY = os.environ.get("GETGEOAPI_KEY")
\ No newline at end of file
@@ -1,14 +1,22 @@
+import asyncio
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import partial
 from pathlib import Path
-from typing import Union
+from typing import Any, Hashable, Union
 
-from sqlalchemy import event, Engine, text, create_engine
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import event, text, create_engine, inspect, CursorResult, Connection, QueuePool, TextClause
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
+from sqlalchemy.orm import sessionmaker, Session, ORMExecuteState
 
 import config
 from config import DB_NAME
 from models.base import Base
+from utils.photo_store import PhotoStore
 
 if config.DB_ENCRYPTION:
     # Installing sqlcipher3 on windows has some difficulties,
@@ -26,17 +34,32 @@ from models.category import Category
 from models.subcategory import Subcategory
 from models.deposit import Deposit
 from models.photo import Photo
+from models.photoFileId import PhotoFileId
+from models.balanceLedger import BalanceLedgerEntry
 
 url = ""
 engine = None
 session_maker = None
+db_maintenance_task = None
+# sqlcipher has no asyncio driver. Unless DB_ENCRYPTION_OFFLOAD is disabled, every call on a synchronous
+# Session runs on these threads, so the event loop keeps serving other updates while a query runs.
+db_executor = None
 if config.DB_ENCRYPTION:
     url += f"sqlite+pysqlcipher://:{config.DB_PASS}@/data/{DB_NAME}"
-    engine = create_engine(url, echo=True, module=sqlcipher)
+    # The dialect defaults to one connection per thread, which every session running on that thread would share,
+    # so their transactions would interleave on it. The QueuePool gives each session a connection of its own,
+    # which may move between the database threads but is only used by one of them at a time.
+    engine = create_engine(url, echo=config.DB_ECHO, module=sqlcipher, poolclass=QueuePool,
+                           pool_size=config.DB_ENCRYPTION_THREADS, max_overflow=-1,
+                           connect_args={"check_same_thread": False})
     session_maker = sessionmaker(engine, expire_on_commit=False)
+    if config.DB_ENCRYPTION_OFFLOAD:
+        # A session waiting for SQLite's write lock occupies its thread, with more threads than updates
+        # processed in parallel the session holding the lock always finds a thread to commit on.
+        db_executor = ThreadPoolExecutor(max_workers=config.DB_ENCRYPTION_THREADS, thread_name_prefix="sqlcipher")
 else:
     url += f"sqlite+aiosqlite:///data/{DB_NAME}"
-    engine = create_async_engine(url, echo=True)
+    engine = create_async_engine(url, echo=config.DB_ECHO)
     session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 data_folder = Path("data")
@@ -44,78 +67,450 @@ if data_folder.exists() is False:
     data_folder.mkdir()
 
 
+async def run_sync_db(function, *args, **kwargs):
+    """
+    Runs a blocking call on a synchronous Session/Engine, on a database thread if offloading is enabled.
+    """
+    if db_executor is None:
+        return function(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(function, *args, **kwargs))
+
+
+def execute_buffered(session: Session, stmt):
+    # Rows are fetched on the database thread, the connection must not be used by two threads at once.
+    query_result = session.execute(stmt)
+    if isinstance(query_result, CursorResult) and not query_result.returns_rows:
+        return query_result
+    return query_result.freeze()()
+
+
+class DBSessionScope:
+    """
+    One session shared by every get_db_session() call made while processing a single update.
+    The session is opened lazily, updates that never touch the database cost nothing.
+    With WAL its reads share one read transaction, so everything the update renders comes from one snapshot,
+    see begin_read_snapshot().
+    Only the task processing the update uses it, tasks spawned by the update inherit the scope
+    through their context but get sessions of their own, a session must not be used concurrently.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.requests = 0
+        self.commits = 0
+        self.owner = asyncio.current_task()
+        # Objects services loaded during the update, keyed by (model, lookup key), see get_scope_identity_map().
+        self.identity_map: dict[tuple[type, Hashable], Any] = {}
+
+
+class DBSessionStats:
+    def __init__(self):
+        self.scopes = 0
+        self.sessions_opened = 0
+        self.session_requests = 0
+        self.commits = 0
+
+
+db_session_scope_var: ContextVar[Union[DBSessionScope, None]] = ContextVar("db_session_scope", default=None)
+db_session_stats = DBSessionStats()
+immediate_transaction_lock: Union[asyncio.Lock, None] = None
+
+
+async def close_db_session(session: Union[AsyncSession, Session]):
+    if isinstance(session, AsyncSession):
+        await session.close()
+    else:
+        await run_sync_db(session.close)
+
+
+@asynccontextmanager
+async def db_session_scope() -> DBSessionScope:
+    scope = DBSessionScope()
+    token = db_session_scope_var.set(scope)
+    db_session_stats.scopes += 1
+    try:
+        yield scope
+    finally:
+        db_session_scope_var.reset(token)
+        if scope.session is not None:
+            await close_db_session(scope.session)
+
+
+def get_owned_scope() -> Union[DBSessionScope, None]:
+    scope = db_session_scope_var.get()
+    if scope is None or scope.owner is not asyncio.current_task():
+        return None
+    return scope
+
+
+async def end_db_transaction(session: Union[AsyncSession, Session], commit: bool):
+    if isinstance(session, AsyncSession):
+        await (session.commit() if commit else session.rollback())
+    else:
+        await run_sync_db(session.commit if commit else session.rollback)
+
+
 @asynccontextmanager
 async def get_db_session() -> Union[AsyncSession, Session]:
-    session = None
+    db_session_stats.session_requests += 1
+    scope = get_owned_scope()
+    if scope is not None:
+        scope.requests += 1
+        if scope.session is None:
+            scope.session = session_maker(info={UPDATE_SCOPE: True})
+            db_session_stats.sessions_opened += 1
+        try:
+            yield scope.session
+        except BaseException:
+            # Loaded objects are expired by the rollback, services must load them again.
+            scope.identity_map.clear()
+            await end_db_transaction(scope.session, commit=False)
+            raise
+        # The session outlives the service call. A read snapshot stays open until the update is processed,
+        # any other transaction must not: an UPDATE keeps SQLite's write lock until the transaction ends,
+        # the handler's Telegram API calls would hold it up. Services commit their writes themselves.
+        if scope.session.info.get(READ_SNAPSHOT) is not True:
+            await end_db_transaction(scope.session, commit=True)
+        return
+    session = session_maker()
+    db_session_stats.sessions_opened += 1
     try:
-        if config.DB_ENCRYPTION:
-            with session_maker() as sync_session:
-                session = sync_session
-                yield session
-        else:
-            async with session_maker() as async_session:
-                session = async_session
-                yield session
+        yield session
     finally:
-        if isinstance(session, AsyncSession):
-            await session.close()
-        elif isinstance(session, Session):
-            session.close()
+        await close_db_session(session)
+
+
+UPDATE_SCOPE = "update_scope"
+READ_SNAPSHOT = "read_snapshot"
+
+
+@event.listens_for(Session, "after_begin")
+def begin_read_snapshot(session: Session, transaction, connection: Connection):
+    """
+    pysqlite only opens a transaction before INSERT/UPDATE/DELETE, on its own every SELECT of a session would
+    read the latest data. The update's session opens a read transaction instead, its SELECTs share a snapshot.
+    Only with WAL: in the other journal modes an open read transaction blocks the commits of other writers.
+    """
+    if session.info.get(UPDATE_SCOPE) and config.DB_JOURNAL_MODE.upper() == "WAL":
+        connection.exec_driver_sql("BEGIN")
+        session.info[READ_SNAPSHOT] = True
+
+
+def end_read_snapshot(session: Session):
+    # SQLite can not turn a read transaction into a write transaction once another connection committed
+    # after its first read (SQLITE_BUSY_SNAPSHOT), writes start a transaction of their own.
+    if session.info.pop(READ_SNAPSHOT, False):
+        session.connection().exec_driver_sql("COMMIT")
+
+
+@event.listens_for(Session, "do_orm_execute")
+def end_read_snapshot_before_write(orm_execute_state: ORMExecuteState):
+    statement = orm_execute_state.statement
+    if getattr(statement, "is_dml", False) or (isinstance(statement, TextClause) and
+                                               statement.text.lstrip()[:7].upper() in ("INSERT ", "UPDATE ",
+                                                                                       "DELETE ", "REPLACE")):
+        end_read_snapshot(orm_execute_state.session)
+
+
+@event.listens_for(Session, "before_flush")
+def end_read_snapshot_before_flush(session: Session, flush_context, instances):
+    end_read_snapshot(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def forget_read_snapshot(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop(READ_SNAPSHOT, None)
+
+
+async def end_scope_read_snapshot():
+    """
+    Ends the read transaction of the update's session, its next read sees the latest data.
+    """
+    scope = get_owned_scope()
+    if scope is not None and scope.session is not None and scope.session.info.get(READ_SNAPSHOT):
+        await end_db_transaction(scope.session, commit=True)
+
+
+def get_scope_identity_map() -> Union[dict[tuple[type, Hashable], Any], None]:
+    """
+    The identity map of the current update, None outside of an update and in tasks spawned by it.
+    Writes made with run_in_immediate_transaction clear it, as they bypass the update's session.
+    """
+    scope = get_owned_scope()
+    if scope is None:
+        return None
+    return scope.identity_map
 
 
 async def session_execute(stmt, session: Union[AsyncSession, Session]):
     if isinstance(session, AsyncSession):
         query_result = await session.execute(stmt)
         return query_result
-    else:
+    elif db_executor is None:
         query_result = session.execute(stmt)
         return query_result
+    else:
+        query_result = await run_sync_db(execute_buffered, session, stmt)
+        return query_result
 
 
 async def session_refresh(session: Union[AsyncSession, Session], instance: object) -> None:
     if isinstance(session, AsyncSession):
         await session.refresh(instance)
     else:
-        session.refresh(instance)
+        await run_sync_db(session.refresh, instance)
+
+
+def count_commit():
+    # Every commit is an fsync of the WAL (or the journal), the stats show how many an update costs.
+    # Called after the commit succeeded.
+    db_session_stats.commits += 1
+    scope = db_session_scope_var.get()
+    if scope is not None:
+        scope.commits += 1
 
 
 async def session_commit(session: Union[AsyncSession, Session]) -> None:
     if isinstance(session, AsyncSession):
         await session.commit()
     else:
-        session.commit()
+        await run_sync_db(session.commit)
+    count_commit()
+
+
+async def run_in_immediate_transaction(function, *args):
+    """
+    Calls function(session, *args) with a new synchronous Session inside one BEGIN IMMEDIATE transaction,
+    which takes the write lock before the first read. Commits when the function returns, rolls back if it raises.
+    The session checks out a connection of its own, the transaction never mixes with transactions
+    of the update's session. With sqlcipher the function runs as a single call on a database thread.
+    Transactions of this process queue on a lock instead of polling SQLite's busy handler for the write lock.
+    """
+
+    def run_transaction(session: Session):
+        session.execute(text("BEGIN IMMEDIATE"))
+        try:
+            result = function(session, *args)
+            session.commit()
+            return result
+        except BaseException:
+            session.rollback()
+            raise
+
+    global immediate_transaction_lock
+    if immediate_transaction_lock is None:
+        # Created on first use, on Python 3.9 a lock binds to the event loop current at its creation.
+        immediate_transaction_lock = asyncio.Lock()
+    # Reads of the update after the write must see it. In rollback journal modes the update's read lock
+    # would also keep this transaction from committing.
+    await end_scope_read_snapshot()
+    async with immediate_transaction_lock:
+        session = session_maker()
+        db_session_stats.sessions_opened += 1
+        try:
+            if isinstance(session, AsyncSession):
+                result = await session.run_sync(run_transaction)
+            else:
+                result = await run_sync_db(run_transaction, session)
+            # Only reached when the commit went through, rolled back transactions are not counted.
+            count_commit()
+            return result
+        finally:
+            await close_db_session(session)
+            identity_map = get_scope_identity_map()
+            if identity_map is not None:
+                identity_map.clear()
+
 
+sqlite_pragmas = {
+    "foreign_keys": "ON",
+    "journal_mode": config.DB_JOURNAL_MODE,
+    "synchronous": config.DB_SYNCHRONOUS,
+    "mmap_size": config.DB_MMAP_SIZE,
+    "cache_size": config.DB_CACHE_SIZE,
+    "temp_store": config.DB_TEMP_STORE
+}
 
-@event.listens_for(Engine, "connect")
+
+# Registered on the engine instance rather than the Engine class, so with sqlcipher
+# it runs after the dialect has sent "PRAGMA key" and the database is readable.
+@event.listens_for(engine.sync_engine if isinstance(engine, AsyncEngine) else engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
     cursor.close()
 
 
-async def check_all_tables_exist(session: Union[AsyncSession, Session]):
-    for table in Base.metadata.tables.values():
-        sql_query = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table.name}';"
-        if isinstance(session, AsyncSession):
-            result = await session.execute(text(sql_query))
-            if result.scalar() is None:
-                return False
+async def log_sqlite_pragmas():
+    async with get_db_session() as session:
+        effective_pragmas = []
+        for pragma in sqlite_pragmas:
+            value = await session_execute(text(f"PRAGMA {pragma}"), session)
+            effective_pragmas.append(f"{pragma}={value.scalar()}")
+        logging.info(f"SQLite PRAGMAs: {', '.join(effective_pragmas)}")
+
+
+async def run_db_maintenance():
+    """
+    Lets SQLite refresh its query planner statistics and folds the WAL back into the database file,
+    so the WAL does not keep growing while readers are active.
+    """
+    while True:
+        await asyncio.sleep(config.DB_MAINTENANCE_INTERVAL)
+        try:
+            async with get_db_session() as session:
+                await session_execute(text("PRAGMA optimize"), session)
+                if config.DB_JOURNAL_MODE.upper() == "WAL":
+                    await session_execute(text("PRAGMA wal_checkpoint(PASSIVE)"), session)
+        except Exception as e:
+            logging.error(f"Database maintenance failed: {e}")
+
+
+def add_users_language_column(connection: Connection):
+    # Databases created before per-user languages lack users.language, SQLite can add a nullable column in place.
+    columns = connection.execute(text("PRAGMA table_info(users)"))
+    if "language" not in [column.name for column in columns]:
+        connection.execute(text("ALTER TABLE users ADD COLUMN language VARCHAR"))
+
+
+def add_hot_path_indexes(connection: Connection):
+    # Mirrors the indexes declared on the models, which create_all only adds to new tables.
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_items_unsold_subcategory_id "
+                            "ON items (subcategory_id) WHERE is_sold = 0"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_buys_buyer_id ON buys (buyer_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_buys_is_refunded ON buys (is_refunded)"))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS "ix_buyItem_buy_id" ON "buyItem" (buy_id)'))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_deposits_user_id ON deposits (user_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_users_registered_at ON users (registered_at)"))
+    connection.execute(text("ANALYZE"))
+
+
+def move_photos_to_store(connection: Connection):
+    # Photos used to be LargeBinary blobs in photos.data, they are moved one at a time into the PhotoStore.
+    columns = [column.name for column in connection.execute(text("PRAGMA table_info(photos)"))]
+    if "sha256" not in columns:
+        connection.execute(text("ALTER TABLE photos ADD COLUMN sha256 VARCHAR"))
+    if "size" not in columns:
+        connection.execute(text("ALTER TABLE photos ADD COLUMN size INTEGER"))
+    if "data" in columns:
+        # Files the migration adds to the store are removed again if its transaction is rolled back,
+        # the photos rows pointing at them are.
+        added_paths = []
+        event.listen(connection, "rollback", lambda *args: remove_photo_files(added_paths))
+        photo_ids = connection.execute(text("SELECT id FROM photos WHERE sha256 IS NULL")).scalars().all()
+        for photo_id in photo_ids:
+            data = connection.execute(text("SELECT data FROM photos WHERE id = :id"), {"id": photo_id}).scalar()
+            photo_path = PhotoStore.get_path(hashlib.sha256(data).hexdigest())
+            if photo_path.exists() is False:
+                added_paths.append(photo_path)
+            sha256, size = PhotoStore.add_stream(io.BytesIO(data))
+            connection.execute(text("UPDATE photos SET sha256 = :sha256, size = :size WHERE id = :id"),
+                               {"sha256": sha256, "size": size, "id": photo_id})
+        sqlite_version = connection.execute(text("SELECT sqlite_version()")).scalar()
+        if tuple(int(part) for part in sqlite_version.split(".")[:2]) >= (3, 35):
+            connection.execute(text("ALTER TABLE photos DROP COLUMN data"))
         else:
-            result = session.execute(text(sql_query))
-            if result.scalar() is None:
-                return False
-    return True
+            rebuild_photos_table(connection)
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_photos_sha256 ON photos (sha256)"))
+
+
+def remove_photo_files(paths: list[Path]):
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def rebuild_photos_table(connection: Connection):
+    """
+    Drops photos.data on SQLite before 3.35, which has no ALTER TABLE DROP COLUMN, by copying the table
+    without it. With foreign keys enforced, dropping the old table would delete the photo_file_ids
+    referencing it, see upgrade_database().
+    """
+    if connection.execute(text("PRAGMA foreign_keys")).scalar() != 0:
+        raise RuntimeError("The photos table can only be rebuilt with foreign keys disabled")
+    connection.execute(text("CREATE TABLE photos_without_data (id INTEGER NOT NULL PRIMARY KEY, "
+                            "sha256 VARCHAR NOT NULL, size INTEGER NOT NULL)"))
+    connection.execute(text("INSERT INTO photos_without_data (id, sha256, size) SELECT id, sha256, size FROM photos"))
+    connection.execute(text("DROP TABLE photos"))
+    connection.execute(text("ALTER TABLE photos_without_data RENAME TO photos"))
+
+
+def add_balance_ledger(connection: Connection):
+    # The balance_ledger table is created by create_all, users get the materialized balance column
+    # and an opening entry carrying their balance so far.
+    columns = connection.execute(text("PRAGMA table_info(users)"))
+    if "balance" not in [column.name for column in columns]:
+        connection.execute(text("ALTER TABLE users ADD COLUMN balance FLOAT NOT NULL DEFAULT 0"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_balance_ledger_user_id_id ON balance_ledger (user_id, id)"))
+    users_without_ledger = "NOT EXISTS (SELECT 1 FROM balance_ledger WHERE balance_ledger.user_id = users.id)"
+    connection.execute(text(f"UPDATE users SET balance = coalesce(top_up_amount, 0) - coalesce(consume_records, 0) "
+                            f"WHERE {users_without_ledger}"))
+    connection.execute(text(f"INSERT INTO balance_ledger (user_id, change, amount, created_at) "
+                            f"SELECT id, 'opening', balance, CURRENT_TIMESTAMP FROM users "
+                            f"WHERE {users_without_ledger}"))
+
+
+"""
+Schema changes for databases created by older versions, applied in order.
+The database's PRAGMA user_version holds the number of migrations already applied.
+Append new migrations to the end of the list, never reorder or remove them.
+Every migration must be safe to re-run, SQLite does not roll back all DDL statements reliably.
+"""
+migrations = [
+    add_users_language_column,
+    add_hot_path_indexes,
+    move_photos_to_store,
+    add_balance_ledger
+]
+
+
+def upgrade_schema(connection: Connection):
+    schema_version = connection.execute(text("PRAGMA user_version")).scalar()
+    is_new_database = inspect(connection).has_table(User.__tablename__) is False
+    # Creates only the missing tables, existing tables and their data are left alone.
+    Base.metadata.create_all(connection)
+    if is_new_database:
+        # Fresh tables already match the models.
+        schema_version = len(migrations)
+        connection.execute(text(f"PRAGMA user_version = {schema_version}"))
+    for version in range(schema_version, len(migrations)):
+        migration = migrations[version]
+        logging.info(f"Applying database migration {version + 1}: {migration.__name__}")
+        migration(connection)
+        connection.execute(text(f"PRAGMA user_version = {version + 1}"))
+
+
+def upgrade_database(connection: Connection):
+    """
+    Runs upgrade_schema in one transaction, with foreign keys disabled as SQLite's procedure for rebuilding
+    a table requires. The PRAGMA has no effect inside a transaction, it is changed before and after it.
+    """
+    connection.execute(text("PRAGMA foreign_keys = OFF"))
+    connection.commit()
+    try:
+        with connection.begin():
+            upgrade_schema(connection)
+            violations = connection.execute(text("PRAGMA foreign_key_check")).all()
+            if violations:
+                raise RuntimeError(f"Database migrations left rows with broken foreign keys: {violations}")
+    finally:
+        connection.execute(text(f"PRAGMA foreign_keys = {sqlite_pragmas['foreign_keys']}"))
+        connection.commit()
+
+
+def upgrade_database_sync():
+    with engine.connect() as connection:
+        upgrade_database(connection)
 
 
 async def create_db_and_tables():
-    async with get_db_session() as session:
-        if await check_all_tables_exist(session):
-            pass
-        else:
-            if isinstance(session, AsyncSession):
-                async with engine.begin() as conn:
-                    await conn.run_sync(Base.metadata.drop_all)
-                    await conn.run_sync(Base.metadata.create_all)
-            else:
-                Base.metadata.drop_all(bind=engine)
-                Base.metadata.create_all(bind=engine)
+    if isinstance(engine, AsyncEngine):
+        async with engine.connect() as connection:
+            await connection.run_sync(upgrade_database)
+    else:
+        await run_sync_db(upgrade_database_sync)
+    await log_sqlite_pragmas()
+    global db_maintenance_task
+    if db_maintenance_task is None:
+        db_maintenance_task = asyncio.create_task(run_db_maintenance())
@@ -5,7 +5,6 @@ from typing import Union
 from aiogram import types, Router, F
 from aiogram.exceptions import TelegramForbiddenError
 from aiogram.filters import StateFilter
-from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery
@@ -21,7 +20,10 @@ from services.item import ItemService
 from services.photo import PhotoService
 from services.subcategory import SubcategoryService
 from services.user import UserService
-from utils.custom_filters import AdminIdFilter
+from middlewares.localization import LocalizationMiddleware
+from utils.compact_callback import CompactCallbackData
+from utils.custom_filters import AdminIdFilter, LocalizedTextFilter
+from utils.keyset_pagination import KeysetPage, PageCursor
 from utils.localizator import Localizator, BotEntity
 from utils.new_items_manager import NewItemsManager
 from utils.notification_manager import NotificationManager
@@ -29,18 +31,21 @@ from utils.other_sql import OtherSQLQuery
 from utils.tags_remover import HTMLTagsRemover
 
 
-class AdminCallback(CallbackData, prefix="admin"):
+class AdminCallback(CompactCallbackData, prefix="admin"):
     level: int
     action: str
     args_to_action: Union[str, int]
-    page: int
+    cursor: str
 
 
 admin_router = Router()
+# Admin keyboards are partly built at import time, keep the whole admin panel in the default language.
+admin_router.message.outer_middleware(LocalizationMiddleware(config.BOT_LANGUAGE))
+admin_router.callback_query.outer_middleware(LocalizationMiddleware(config.BOT_LANGUAGE))
 
 
-def create_admin_callback(level: int, action: str = "", args_to_action: str = "", page: int = 0):
-    return AdminCallback(level=level, action=action, args_to_action=args_to_action, page=page).pack()
+def create_admin_callback(level: int, action: str = "", args_to_action: str = "", cursor: str = PageCursor.FIRST):
+    return AdminCallback(level=level, action=action, args_to_action=args_to_action, cursor=cursor).pack()
 
 
 class AdminConstants:
@@ -61,7 +66,7 @@ class AdminConstants:
                                           callback_data=new_callback.pack())
 
 
-@admin_router.message(F.text == Localizator.get_text(BotEntity.ADMIN, "menu"), AdminIdFilter())
+@admin_router.message(LocalizedTextFilter(BotEntity.ADMIN, "menu"), AdminIdFilter())
 async def admin_command_handler(message: types.message, state: FSMContext):
     await admin(message, state)
 
@@ -217,31 +222,27 @@ async def hide_entity(callback: CallbackQuery):
     unpacked_callback = AdminCallback.unpack(callback.data)
     entity = unpacked_callback.args_to_action
     if entity == "category":
-        delete_category_builder = await create_entity_buttons(
-            CategoryService.get_to_hide(unpacked_callback.page), entity, 10)
-        delete_category_builder = await add_pagination_buttons(delete_category_builder, callback.data,
-                                                               CategoryService.get_maximum_page_to_delete(),
-                                                               AdminCallback.unpack,
-                                                               AdminConstants.back_to_main_button)
+        categories = await CategoryService.get_all_with_items_count(unpacked_callback.cursor)
+        delete_category_builder = create_category_buttons(categories, entity, 10)
+        delete_category_builder = add_pagination_buttons(delete_category_builder, callback.data, categories,
+                                                         AdminCallback.unpack,
+                                                         AdminConstants.back_to_main_button)
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.ADMIN, "delete_category"),
                                          reply_markup=delete_category_builder.as_markup())
     else:
-        delete_subcategory_builder = await create_entity_buttons(
-            SubcategoryService.get_to_delete(unpacked_callback.page),
-            entity, 10)
-        delete_subcategory_builder = await add_pagination_buttons(delete_subcategory_builder, callback.data,
-                                                                  SubcategoryService.get_maximum_page_to_delete(),
-                                                                  AdminCallback.unpack,
-                                                                  AdminConstants.back_to_main_button)
+        subcategories = await SubcategoryService.get_to_delete(unpacked_callback.cursor)
+        delete_subcategory_builder = create_entity_buttons(subcategories, entity, 10)
+        delete_subcategory_builder = add_pagination_buttons(delete_subcategory_builder, callback.data, subcategories,
+                                                            AdminCallback.unpack,
+                                                            AdminConstants.back_to_main_button)
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.ADMIN, "delete_subcategory"),
                                          reply_markup=delete_subcategory_builder.as_markup())
 
 
-async def create_entity_buttons(get_all_entities_function, entity_name, level):
+def create_entity_buttons(entities: KeysetPage, entity_name, level):
     # hide - 10, pick - 7, edit-26
-    entities = await get_all_entities_function
     cb_builder = InlineKeyboardBuilder()
-    for entity in entities:
+    for entity in entities.entries:
         cb_builder.row(types.InlineKeyboardButton(text=entity.name,
                                                   callback_data=create_admin_callback(level=level,
                                                                                       action=entity_name,
@@ -249,6 +250,16 @@ async def create_entity_buttons(get_all_entities_function, entity_name, level):
     return cb_builder
 
 
+def create_category_buttons(categories: KeysetPage, entity_name: str, level: int):
+    cb_builder = InlineKeyboardBuilder()
+    for category, items_count in categories.entries:
+        cb_builder.row(types.InlineKeyboardButton(text=f"{category.name} ({items_count})",
+                                                  callback_data=create_admin_callback(level=level,
+                                                                                      action=entity_name,
+                                                                                      args_to_action=category.id)))
+    return cb_builder
+
+
 async def delete_confirmation(callback: CallbackQuery):
     unpacked_callback = AdminCallback.unpack(callback.data)
     entity = unpacked_callback.action
@@ -360,10 +371,9 @@ async def balance_management(message: types.message, state: FSMContext):
         await message.answer(text=msg)
 
 
-async def make_refund_markup(page):
+async def make_refund_markup(not_refunded_buy_ids: KeysetPage):
     refund_builder = InlineKeyboardBuilder()
-    not_refunded_buy_ids = await BuyService.get_not_refunded_buy_ids(page)
-    refund_data = await OtherSQLQuery.get_refund_data(not_refunded_buy_ids)
+    refund_data = await OtherSQLQuery.get_refund_data(not_refunded_buy_ids.entries)
     for buy in refund_data:
         if buy.telegram_username:
             refund_buy_button = types.InlineKeyboardButton(
@@ -392,10 +402,10 @@ async def make_refund_markup(page):
 
 async def send_refund_menu(callback: CallbackQuery):
     unpacked_callback = AdminCallback.unpack(callback.data)
-    refund_builder = await make_refund_markup(unpacked_callback.page)
-    refund_builder = await add_pagination_buttons(refund_builder, callback.data,
-                                                  BuyService.get_max_refund_pages(),
-                                                  AdminCallback.unpack, AdminConstants.back_to_main_button)
+    not_refunded_buy_ids = await BuyService.get_not_refunded_buy_ids(unpacked_callback.cursor)
+    refund_builder = await make_refund_markup(not_refunded_buy_ids)
+    refund_builder = add_pagination_buttons(refund_builder, callback.data, not_refunded_buy_ids,
+                                            AdminCallback.unpack, AdminConstants.back_to_main_button)
     await callback.message.edit_text(text=Localizator.get_text(BotEntity.ADMIN, "refund_menu"),
                                      reply_markup=refund_builder.as_markup())
 
@@ -477,16 +487,14 @@ async def get_statistics(callback: CallbackQuery):
     statistics_keyboard_builder = InlineKeyboardBuilder()
     if unpacked_callback.action == "users":
         users, users_count = await UserService.get_new_users_by_timedelta(unpacked_callback.args_to_action,
-                                                                          unpacked_callback.page)
-        for user in users:
+                                                                          unpacked_callback.cursor)
+        for user in users.entries:
             if user.telegram_username:
                 statistics_keyboard_builder.button(text=user.telegram_username,
                                                    url=f"t.me/{user.telegram_username}")
         statistics_keyboard_builder.adjust(1)
-        statistics_keyboard_builder = await add_pagination_buttons(statistics_keyboard_builder, callback.data,
-                                                                   UserService.get_max_page_for_users_by_timedelta(
-                                                                       unpacked_callback.args_to_action),
-                                                                   AdminCallback.unpack, None)
+        statistics_keyboard_builder = add_pagination_buttons(statistics_keyboard_builder, callback.data, users,
+                                                             AdminCallback.unpack, None)
         statistics_keyboard_builder.row(
             *[AdminConstants.back_to_main_button, await AdminConstants.get_back_button(unpacked_callback)])
         await callback.message.edit_text(
@@ -538,7 +546,10 @@ async def make_refund(callback: CallbackQuery):
     is_confirmed = unpacked_callback.action == "confirm_refund"
     if is_confirmed:
         refund_data = await OtherSQLQuery.get_refund_data_single(buy_id)
-        await BuyService.refund(buy_id, refund_data)
+        if await BuyService.refund(buy_id, refund_data) is False:
+            # Already refunded by an earlier tap on the button.
+            await callback.answer()
+            return
         bot = callback.bot
         await NotificationManager.send_refund_message(refund_data, bot)
         if refund_data.telegram_username:
@@ -560,9 +571,8 @@ async def make_refund(callback: CallbackQuery):
 
 
 async def send_db_file(callback: CallbackQuery):
-    with open(f"./data/{config.DB_NAME}", "rb") as f:
-        await callback.message.bot.send_document(callback.from_user.id,
-                                                 types.BufferedInputFile(file=f.read(), filename="database.db"))
+    await callback.message.bot.send_document(callback.from_user.id,
+                                             types.FSInputFile(f"./data/{config.DB_NAME}", filename="database.db"))
     await callback.answer()
 
 
@@ -586,26 +596,21 @@ async def send_withdraw_crypto_menu(callback: CallbackQuery):
 async def add_items_menu(callback: CallbackQuery, state: FSMContext):
     unpacked_cb = AdminCallback.unpack(callback.data)
     if unpacked_cb.action == "init_picker":
-        pick_category_builder = await create_entity_buttons(CategoryService.get_all(unpacked_cb.page),
-                                                            "category",
-                                                            7)
-        pick_category_builder = await add_pagination_buttons(pick_category_builder, callback.data,
-                                                             CategoryService.get_maximum_page(),
-                                                             AdminCallback.unpack,
-                                                             AdminConstants.back_to_main_button)
+        categories = await CategoryService.get_all_with_items_count(unpacked_cb.cursor)
+        pick_category_builder = create_category_buttons(categories, "category", 7)
+        pick_category_builder = add_pagination_buttons(pick_category_builder, callback.data, categories,
+                                                       AdminCallback.unpack,
+                                                       AdminConstants.back_to_main_button)
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.ADMIN, 'pick_category'),
                                          reply_markup=pick_category_builder.as_markup())
     elif unpacked_cb.action == "category":
         category_id = unpacked_cb.args_to_action
         await state.update_data(category_id=category_id)
-        pick_subcategory_builder = await create_entity_buttons(SubcategoryService.get_by_category_id(unpacked_cb.page,
-                                                                                                     category_id),
-                                                               "subcategory",
-                                                               7)
-        pick_subcategory_builder = await add_pagination_buttons(pick_subcategory_builder, callback.data,
-                                                                SubcategoryService.get_maximum_page(),
-                                                                AdminCallback.unpack,
-                                                                AdminConstants.back_to_main_button)
+        subcategories = await SubcategoryService.get_by_category_id(unpacked_cb.cursor, category_id)
+        pick_subcategory_builder = create_entity_buttons(subcategories, "subcategory", 7)
+        pick_subcategory_builder = add_pagination_buttons(pick_subcategory_builder, callback.data, subcategories,
+                                                          AdminCallback.unpack,
+                                                          AdminConstants.back_to_main_button)
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.ADMIN, "pick_subcategory"),
                                          reply_markup=pick_subcategory_builder.as_markup())
     elif unpacked_cb.action == "subcategory":
@@ -623,12 +628,11 @@ async def add_entity(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text(Localizator.get_text(BotEntity.ADMIN, "add_items_category"))
         await state.set_state(AdminStates.add_entity)
     elif entity == "subcategory" and category_id == "":
-        categories_button = await create_entity_buttons(
-            CategoryService.get_all(unpacked_cb.page), "subcategory", 24)
-        categories_buttons = await add_pagination_buttons(categories_button, callback.data,
-                                                          CategoryService.get_maximum_page_to_delete(),
-                                                          AdminCallback.unpack,
-                                                          AdminConstants.back_to_main_button)
+        categories = await CategoryService.get_all_with_items_count(unpacked_cb.cursor)
+        categories_button = create_category_buttons(categories, "subcategory", 24)
+        categories_buttons = add_pagination_buttons(categories_button, callback.data, categories,
+                                                    AdminCallback.unpack,
+                                                    AdminConstants.back_to_main_button)
         await callback.message.edit_text(Localizator.get_text(BotEntity.ADMIN, "pick_category"),
                                          reply_markup=categories_buttons.as_markup())
     elif entity == "subcategory" and category_id != "":
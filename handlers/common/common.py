@@ -1,32 +1,29 @@
 from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from utils.keyset_pagination import KeysetPage, PageCursor
 from utils.localizator import Localizator, BotEntity
 
 
-async def add_pagination_buttons(keyboard_builder: InlineKeyboardBuilder, callback_str: str, max_page_function,
-                                 callback_unpack_function, back_button) -> InlineKeyboardBuilder:
+def add_pagination_buttons(keyboard_builder: InlineKeyboardBuilder, callback_str: str, page: KeysetPage,
+                           callback_unpack_function, back_button) -> InlineKeyboardBuilder:
     unpacked_callback = callback_unpack_function(callback_str)
-    maximum_page = await max_page_function
     buttons = []
-    if unpacked_callback.page > 0:
-        back_page_callback = unpacked_callback.__copy__()
-        back_page_callback.page -= 1
-        first_page_callback = unpacked_callback.__copy__()
-        first_page_callback.page = 0
+    if page.has_previous:
+        first_page_callback = unpacked_callback.model_copy(update={"cursor": PageCursor.FIRST})
+        back_page_callback = unpacked_callback.model_copy(update={"cursor": PageCursor.before(page.first_key)})
         buttons.append(
             types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "pagination_first"),
                                        callback_data=first_page_callback.pack()))
         buttons.append(
             types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "pagination_previous"),
                                        callback_data=back_page_callback.pack()))
-    if unpacked_callback.page < maximum_page:
-        last_page_callback = unpacked_callback.__copy__()
-        last_page_callback.page = maximum_page
-        unpacked_callback.page += 1
+    if page.has_next:
+        next_page_callback = unpacked_callback.model_copy(update={"cursor": PageCursor.after(page.last_key)})
+        last_page_callback = unpacked_callback.model_copy(update={"cursor": PageCursor.LAST})
         buttons.append(
             types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "pagination_next"),
-                                       callback_data=unpacked_callback.pack()))
+                                       callback_data=next_page_callback.pack()))
         buttons.append(
             types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "pagination_last"),
                                        callback_data=last_page_callback.pack()))
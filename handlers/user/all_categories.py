@@ -1,60 +1,54 @@
 from typing import Union
 
-from aiogram import types, Router, F
-from aiogram.filters.callback_data import CallbackData
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram import types, Router
+from aiogram.types import Message, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from handlers.common.common import add_pagination_buttons
-from services.buy import BuyService
-from services.buyItem import BuyItemService
-from services.category import CategoryService
-from services.item import ItemService
-from services.subcategory import SubcategoryService
+from services.checkout import CheckoutService, CheckoutStatus
+from services.photo import PhotoService
+from services.reservation import ReservationService
 from services.user import UserService
-from utils.custom_filters import IsUserExistFilter
+from utils.catalog_snapshot import CatalogCache
+from utils.compact_callback import CompactCallbackData
+from utils.custom_filters import IsUserExistFilter, LocalizedTextFilter
+from utils.keyset_pagination import KeysetPage, PageCursor
 from utils.localizator import Localizator, BotEntity
 from utils.notification_manager import NotificationManager
+from utils.order_delivery import OrderDelivery
 
 
-class AllCategoriesCallback(CallbackData, prefix="all_categories"):
+class AllCategoriesCallback(CompactCallbackData, prefix="all_categories"):
+    # Prices are not part of the callback, handlers take them from the catalog.
     level: int
     category_id: int
     subcategory_id: int
-    price: float
     quantity: int
-    total_price: float
     confirmation: bool
-    page: int
+    cursor: str
 
 
 def create_callback_all_categories(level: int,
                                    category_id: int = -1,
                                    subcategory_id: int = -1,
-                                   price: float = 0.0,
-                                   total_price: float = 0.0,
                                    quantity: int = 1,
                                    confirmation: bool = False,
-                                   page: int = 0):
-    return AllCategoriesCallback(level=level, category_id=category_id, subcategory_id=subcategory_id, price=price,
-                                 total_price=total_price,
-                                 quantity=quantity, confirmation=confirmation, page=page).pack()
+                                   cursor: str = PageCursor.FIRST):
+    return AllCategoriesCallback(level=level, category_id=category_id, subcategory_id=subcategory_id,
+                                 quantity=quantity, confirmation=confirmation, cursor=cursor).pack()
 
 
 all_categories_router = Router()
 
 
-@all_categories_router.message(F.text == Localizator.get_text(BotEntity.USER, "all_categories"),
-                               IsUserExistFilter())
+@all_categories_router.message(LocalizedTextFilter(BotEntity.USER, "all_categories"), IsUserExistFilter())
 async def all_categories_text_message(message: types.message):
     await all_categories(message)
 
 
-async def create_category_buttons(page: int):
-    categories = await CategoryService.get_all(page)
-    if categories:
+def create_category_buttons(categories: KeysetPage):
+    if categories.entries:
         categories_builder = InlineKeyboardBuilder()
-        for category in categories:
-            items_count = await CategoryService.have_items(category.id)
+        for category, items_count in categories.entries:
             if items_count > 0:
                 categories_builder.button(text=f"✅ {category.name}",
                                           callback_data=create_callback_all_categories(level=1,
@@ -67,36 +61,42 @@ async def create_category_buttons(page: int):
         return categories_builder
 
 
-async def create_subcategory_buttons(category_id: int, page: int = 0):
+def create_subcategory_buttons(category_id: int, subcategories: KeysetPage):
     current_level = 1
-    items = await ItemService.get_unsold_subcategories_by_category(category_id, page)
     subcategories_builder = InlineKeyboardBuilder()
-    for item in items:
-        subcategory_price = await SubcategoryService.get_price_by_subcategory(item.subcategory_id)
-        available_quantity = await ItemService.get_available_quantity(item.subcategory_id)
+    for subcategory in subcategories.entries:
         subcategory_inline_button = create_callback_all_categories(level=current_level + 1,
                                                                    category_id=category_id,
-                                                                   subcategory_id=item.subcategory_id,
-                                                                   price=subcategory_price)
+                                                                   subcategory_id=subcategory.subcategory_id)
         subcategories_builder.button(
             text=Localizator.get_text(BotEntity.USER, "subcategory_button").format(
-                subcategory_name=item.subcategory.name,
-                subcategory_price=subcategory_price,
-                available_quantity=available_quantity,
+                subcategory_name=subcategory.name,
+                subcategory_price=subcategory.price,
+                available_quantity=subcategory.available_quantity,
                 currency_sym=Localizator.get_currency_symbol()),
             callback_data=subcategory_inline_button)
     subcategories_builder.adjust(1)
     return subcategories_builder
 
 
+async def show_out_of_stock(callback: CallbackQuery):
+    back_to_main_builder = InlineKeyboardBuilder()
+    back_to_main_builder.button(text=Localizator.get_text(BotEntity.USER, "all_categories"),
+                                callback_data=create_callback_all_categories(level=0))
+    await callback.message.delete()
+    await callback.message.answer(text=Localizator.get_text(BotEntity.USER, "out_of_stock"),
+                                  reply_markup=back_to_main_builder.as_markup())
+
+
 async def all_categories(message: Union[Message, CallbackQuery]):
+    catalog = await CatalogCache.get()
     if isinstance(message, Message):
-        category_inline_buttons = await create_category_buttons(0)
+        categories = catalog.get_categories_with_items_count(PageCursor.FIRST)
+        category_inline_buttons = create_category_buttons(categories)
         zero_level_callback = create_callback_all_categories(0)
         if category_inline_buttons:
-            category_inline_buttons = await add_pagination_buttons(category_inline_buttons, zero_level_callback,
-                                                                   CategoryService.get_maximum_page_to_delete(),
-                                                                   AllCategoriesCallback.unpack, None)
+            category_inline_buttons = add_pagination_buttons(category_inline_buttons, zero_level_callback,
+                                                             categories, AllCategoriesCallback.unpack, None)
             await message.answer(Localizator.get_text(BotEntity.USER, "all_categories"),
                                  reply_markup=category_inline_buttons.as_markup())
         else:
@@ -104,11 +104,11 @@ async def all_categories(message: Union[Message, CallbackQuery]):
     elif isinstance(message, CallbackQuery):
         callback = message
         unpacked_callback = AllCategoriesCallback.unpack(callback.data)
-        category_inline_buttons = await create_category_buttons(unpacked_callback.page)
+        categories = catalog.get_categories_with_items_count(unpacked_callback.cursor)
+        category_inline_buttons = create_category_buttons(categories)
         if category_inline_buttons:
-            category_inline_buttons = await add_pagination_buttons(category_inline_buttons, callback.data,
-                                                                   CategoryService.get_maximum_page_to_delete(),
-                                                                   AllCategoriesCallback.unpack, None)
+            category_inline_buttons = add_pagination_buttons(category_inline_buttons, callback.data,
+                                                             categories, AllCategoriesCallback.unpack, None)
             await callback.message.delete()
             await callback.message.answer(Localizator.get_text(BotEntity.USER, "all_categories"),
                                           reply_markup=category_inline_buttons.as_markup())
@@ -119,7 +119,10 @@ async def all_categories(message: Union[Message, CallbackQuery]):
 
 async def show_subcategories_in_category(callback: CallbackQuery):
     unpacked_callback = AllCategoriesCallback.unpack(callback.data)
-    subcategory_buttons = await create_subcategory_buttons(unpacked_callback.category_id, page=unpacked_callback.page)
+    catalog = await CatalogCache.get()
+    subcategories = catalog.get_unsold_subcategories_by_category(unpacked_callback.category_id,
+                                                                 unpacked_callback.cursor)
+    subcategory_buttons = create_subcategory_buttons(unpacked_callback.category_id, subcategories)
     back_button = types.InlineKeyboardButton(
         text=Localizator.get_text(BotEntity.USER, "back_to_all_categories"),
         callback_data=create_callback_all_categories(
@@ -128,48 +131,53 @@ async def show_subcategories_in_category(callback: CallbackQuery):
         await callback.message.edit_text(Localizator.get_text(BotEntity.USER, "no_subcategories"),
                                          reply_markup=subcategory_buttons.row(back_button).as_markup())
     else:
-        subcategory_buttons = await add_pagination_buttons(subcategory_buttons, callback.data,
-                                                           ItemService.get_maximum_page(unpacked_callback.category_id),
-                                                           AllCategoriesCallback.unpack,
-                                                           back_button)
-        category_photo = await CategoryService.get_photo(unpacked_callback.category_id)
-        category = await CategoryService.get_by_primary_key(unpacked_callback.category_id)
+        subcategory_buttons = add_pagination_buttons(subcategory_buttons, callback.data, subcategories,
+                                                     AllCategoriesCallback.unpack, back_button)
+        category = catalog.get_category(unpacked_callback.category_id)
+        if category is None:
+            # The button outlived its category.
+            await all_categories(callback)
+            return
         user = await UserService.get_by_tgid(callback.from_user.id)
-        balance = user.top_up_amount - user.consume_records
-        media = types.InputMediaPhoto(media=BufferedInputFile(category_photo.data,
-                                                              f"{category_photo.id}.jpg"),
-                                      caption=Localizator.get_text(BotEntity.USER,
-                                                                   "subcategories").format(
-                                          category_name=category.name,
-                                          description=category.description,
-                                          user_balance=balance,
-                                          currency_text=Localizator.get_currency_text()
-                                      ))
-        await callback.message.edit_media(media=media, reply_markup=subcategory_buttons.as_markup())
+        balance = user.balance
+        caption = Localizator.get_text(BotEntity.USER, "subcategories").format(
+            category_name=category.name,
+            description=category.description,
+            user_balance=balance,
+            currency_text=Localizator.get_currency_text()
+        )
+        await PhotoService.edit_message_photo(callback.message, category.image_id, caption,
+                                              subcategory_buttons.as_markup())
 
 
 async def buy_confirmation(callback: CallbackQuery):
     unpacked_callback = AllCategoriesCallback.unpack(callback.data)
-    price = unpacked_callback.price
-    total_price = unpacked_callback.price * unpacked_callback.quantity
     subcategory_id = unpacked_callback.subcategory_id
     category_id = unpacked_callback.category_id
     current_level = unpacked_callback.level
     quantity = unpacked_callback.quantity
-    description = await CategoryService.get_description(category_id)
+    catalog = await CatalogCache.get()
+    subcategory = catalog.get_subcategory(subcategory_id)
+    category = catalog.get_category(category_id)
+    # The button may outlive its subcategory or category.
+    if subcategory is None or category is None:
+        await show_out_of_stock(callback)
+        return
+    price = subcategory.price
+    total_price = price * quantity
+    # The hold pins the price shown below, buy_processing charges it or nothing.
+    if not await ReservationService.reserve(callback.from_user.id, subcategory_id, quantity, price):
+        await show_out_of_stock(callback)
+        return
     confirmation_builder = InlineKeyboardBuilder()
     confirm_button_callback = create_callback_all_categories(level=current_level + 1,
                                                              category_id=category_id,
                                                              subcategory_id=subcategory_id,
-                                                             price=price,
-                                                             total_price=total_price,
                                                              quantity=quantity,
                                                              confirmation=True)
     decline_button_callback = create_callback_all_categories(level=current_level + 1,
                                                              category_id=category_id,
                                                              subcategory_id=subcategory_id,
-                                                             price=price,
-                                                             total_price=total_price,
                                                              quantity=quantity,
                                                              confirmation=False)
     confirmation_button = types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "confirm"),
@@ -179,20 +187,17 @@ async def buy_confirmation(callback: CallbackQuery):
     back_button = types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "back_button"),
                                              callback_data=create_callback_all_categories(level=current_level - 1,
                                                                                           category_id=category_id,
-                                                                                          subcategory_id=subcategory_id,
-                                                                                          price=price))
+                                                                                          subcategory_id=subcategory_id))
     confirmation_builder.add(confirmation_button, decline_button, back_button)
     confirmation_builder.adjust(2)
-    subcategory = await SubcategoryService.get_by_primary_key(subcategory_id)
-    category = await CategoryService.get_by_primary_key(category_id)
     user = await UserService.get_by_tgid(callback.from_user.id)
-    balance = user.top_up_amount - user.consume_records
+    balance = user.balance
     await callback.message.delete()
     await callback.message.answer(
         text=Localizator.get_text(BotEntity.USER, "buy_confirmation").format(category_name=category.name,
                                                                              subcategory_name=subcategory.name,
                                                                              price=price,
-                                                                             description=description,
+                                                                             description=category.description,
                                                                              quantity=quantity,
                                                                              total_price=total_price,
                                                                              user_balance=balance,
@@ -202,54 +207,52 @@ async def buy_confirmation(callback: CallbackQuery):
 
 async def select_quantity(callback: CallbackQuery):
     unpacked_callback = AllCategoriesCallback.unpack(callback.data)
-    price = unpacked_callback.price
     subcategory_id = unpacked_callback.subcategory_id
     category_id = unpacked_callback.category_id
     current_level = unpacked_callback.level
+    # The user came back from the confirmation or picks another subcategory, a pending hold is not needed anymore.
+    ReservationService.release(callback.from_user.id)
+    catalog = await CatalogCache.get()
+    subcategory = catalog.get_subcategory(subcategory_id)
+    category = catalog.get_category(category_id)
+    if subcategory is None or category is None:
+        await show_out_of_stock(callback)
+        return
+    available_qty = catalog.get_available_quantity(subcategory_id)
     count_builder = InlineKeyboardBuilder()
-    for i in range(1, 11):
+    # Large orders are delivered as a file, so bulk quantities are offered as far as the stock goes.
+    bulk_quantities = [quantity for quantity in (25, 50, 100, 250, 500) if quantity <= available_qty]
+    for i in [*range(1, 11), *bulk_quantities]:
         count_builder.button(text=str(i), callback_data=create_callback_all_categories(level=current_level + 1,
                                                                                        category_id=category_id,
                                                                                        subcategory_id=subcategory_id,
-                                                                                       price=price,
-                                                                                       quantity=i,
-                                                                                       total_price=price * i))
+                                                                                       quantity=i))
     count_builder.adjust(3)
     back_button = types.InlineKeyboardButton(text=Localizator.get_text(BotEntity.COMMON, "back_button"),
                                              callback_data=create_callback_all_categories(level=current_level - 1,
                                                                                           category_id=category_id))
     count_builder.row(back_button)
-    subcategory = await SubcategoryService.get_by_primary_key(subcategory_id)
-    category = await CategoryService.get_by_primary_key(category_id)
-    available_qty = await ItemService.get_available_quantity(subcategory_id)
-    subcategory_photo = await SubcategoryService.get_photo(subcategory_id)
     user = await UserService.get_by_tgid(callback.from_user.id)
-    balance = user.top_up_amount - user.consume_records
-    media = types.InputMediaPhoto(media=BufferedInputFile(subcategory_photo.data,
-                                                          f"{subcategory_photo.id}.jpg"),
-                                  caption=Localizator.get_text(BotEntity.USER,
-                                                               "select_quantity").format(
-                                      category_name=category.name,
-                                      subcategory_name=subcategory.name,
-                                      description=category.description,
-                                      user_balance=balance,
-                                      currency_sym=Localizator.get_currency_symbol(),
-                                      price=subcategory.price,
-                                      quantity=available_qty
-                                  ))
-    await callback.message.edit_media(media, reply_markup=count_builder.as_markup())
+    balance = user.balance
+    caption = Localizator.get_text(BotEntity.USER, "select_quantity").format(
+        category_name=category.name,
+        subcategory_name=subcategory.name,
+        description=category.description,
+        user_balance=balance,
+        currency_sym=Localizator.get_currency_symbol(),
+        price=subcategory.price,
+        quantity=available_qty
+    )
+    await PhotoService.edit_message_photo(callback.message, subcategory.image_id, caption, count_builder.as_markup())
 
 
 async def buy_processing(callback: CallbackQuery):
     unpacked_callback = AllCategoriesCallback.unpack(callback.data)
     confirmation = unpacked_callback.confirmation
-    total_price = unpacked_callback.price * unpacked_callback.quantity
     subcategory_id = unpacked_callback.subcategory_id
     category_id = unpacked_callback.category_id
     quantity = unpacked_callback.quantity
     telegram_id = callback.from_user.id
-    is_in_stock = await ItemService.get_available_quantity(subcategory_id) >= quantity
-    is_enough_money = await UserService.is_buy_possible(telegram_id, total_price)
     back_to_main_builder = InlineKeyboardBuilder()
     back_to_main_callback = create_callback_all_categories(level=0)
     back_to_main_button = types.InlineKeyboardButton(
@@ -257,36 +260,43 @@ async def buy_processing(callback: CallbackQuery):
         callback_data=back_to_main_callback)
     back_to_main_builder.add(back_to_main_button)
     bot = callback.bot
-    if confirmation and is_in_stock and is_enough_money:
-        await callback.message.delete()
-        await UserService.update_consume_records(telegram_id, total_price)
-        sold_items = await ItemService.get_bought_items(subcategory_id, quantity)
-        user = await UserService.get_by_tgid(telegram_id)
-        new_buy_id = await BuyService.insert_new(user, quantity, total_price)
-        await BuyItemService.insert_many(sold_items, new_buy_id)
-        await ItemService.set_items_sold(sold_items)
-        await NotificationManager.new_buy(category_id, subcategory_id, quantity, total_price, user, bot)
-    elif confirmation is False:
+    if confirmation is False:
+        ReservationService.release(telegram_id)
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.COMMON, "cancelled"),
                                          reply_markup=back_to_main_builder.as_markup())
-    elif is_enough_money is False:
+        return
+    confirmed_price = ReservationService.get_confirmed_price(telegram_id, subcategory_id, quantity)
+    if confirmed_price is None:
+        # The hold expired, the price the user confirmed is unknown. The button shows the confirmation again,
+        # with the current price and a new hold.
+        expired_builder = InlineKeyboardBuilder()
+        expired_builder.button(text=Localizator.get_text(BotEntity.USER, "confirm_again"),
+                               callback_data=create_callback_all_categories(level=unpacked_callback.level - 1,
+                                                                            category_id=category_id,
+                                                                            subcategory_id=subcategory_id,
+                                                                            quantity=quantity))
+        expired_builder.add(back_to_main_button)
+        await callback.message.edit_text(text=Localizator.get_text(BotEntity.USER, "reservation_expired"),
+                                         reply_markup=expired_builder.as_markup())
+        return
+    checkout_result = await CheckoutService.checkout(telegram_id, subcategory_id, quantity, confirmed_price)
+    if checkout_result.status == CheckoutStatus.COMPLETED:
+        await OrderDelivery.deliver(callback.message, checkout_result.buy_id, back_to_main_builder.as_markup(),
+                                    edit=True)
+        user = await UserService.get_by_tgid(telegram_id)
+        await NotificationManager.new_buy(category_id, subcategory_id, quantity, checkout_result.total_price, user,
+                                          bot)
+    elif checkout_result.status == CheckoutStatus.INSUFFICIENT_FUNDS:
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.USER, "insufficient_funds"),
                                          reply_markup=back_to_main_builder.as_markup())
-    elif is_in_stock is False:
+    elif checkout_result.status == CheckoutStatus.PRICE_CHANGED:
+        await callback.message.edit_text(text=Localizator.get_text(BotEntity.USER, "price_changed"),
+                                         reply_markup=back_to_main_builder.as_markup())
+    else:
         await callback.message.edit_text(text=Localizator.get_text(BotEntity.USER, "out_of_stock"),
                                          reply_markup=back_to_main_builder.as_markup())
 
 
-async def create_message_with_bought_items(bought_data: list):
-    message = "<b>"
-    for count, item in enumerate(bought_data, start=1):
-        private_data = item.private_data
-        message += Localizator.get_text(BotEntity.USER, "purchased_item").format(count=count,
-                                                                                 private_data=private_data)
-    message += "</b>"
-    return message
-
-
 @all_categories_router.callback_query(AllCategoriesCallback.filter(), IsUserExistFilter())
 async def navigate_categories(call: CallbackQuery, callback_data: AllCategoriesCallback):
     current_level = callback_data.level
@@ -1,18 +1,19 @@
 from typing import Union
-from aiogram import types, Router, F
+from aiogram import types, Router
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import CallbackQuery, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from crypto_api.CryptoApiManager import CryptoApiManager
 from handlers.common.common import add_pagination_buttons
-from handlers.user.all_categories import create_message_with_bought_items
 from services.buy import BuyService
 from services.buyItem import BuyItemService
 from services.item import ItemService
 from services.user import UserService
-from utils.custom_filters import IsUserExistFilter
+from utils.custom_filters import IsUserExistFilter, LocalizedTextFilter
+from utils.keyset_pagination import KeysetPage, PageCursor
 from utils.localizator import Localizator, BotEntity
 from utils.notification_manager import NotificationManager
+from utils.order_delivery import OrderDelivery
 from utils.tags_remover import HTMLTagsRemover
 
 my_profile_router = Router()
@@ -22,27 +23,29 @@ class MyProfileCallback(CallbackData, prefix="my_profile"):
     level: int
     action: str
     args_for_action: Union[int, str]
-    page: int
+    cursor: str
 
 
-def create_callback_profile(level: int, action: str = "", args_for_action="", page=0):
-    return MyProfileCallback(level=level, action=action, args_for_action=args_for_action, page=page).pack()
+def create_callback_profile(level: int, action: str = "", args_for_action="", cursor: str = PageCursor.FIRST):
+    return MyProfileCallback(level=level, action=action, args_for_action=args_for_action, cursor=cursor).pack()
 
 
-@my_profile_router.message(F.text == Localizator.get_text(BotEntity.USER, "my_profile"), IsUserExistFilter())
+@my_profile_router.message(LocalizedTextFilter(BotEntity.USER, "my_profile"), IsUserExistFilter())
 async def my_profile_text_message(message: types.message):
     await my_profile(message)
 
 
 class MyProfileConstants:
-    back_to_main_menu = types.InlineKeyboardButton(
-        text=Localizator.get_text(BotEntity.USER, "back_to_my_profile"),
-        callback_data=create_callback_profile(level=0))
+    @staticmethod
+    def get_back_to_main_menu() -> types.InlineKeyboardButton:
+        return types.InlineKeyboardButton(
+            text=Localizator.get_text(BotEntity.USER, "back_to_my_profile"),
+            callback_data=create_callback_profile(level=0))
 
 
 async def get_my_profile_message(telegram_id: int):
     user = await UserService.get_by_tgid(telegram_id)
-    fiat_balance = round(user.top_up_amount - user.consume_records, 2)
+    fiat_balance = round(user.balance, 2)
     return Localizator.get_text(BotEntity.USER, "my_profile_msg").format(telegram_id=telegram_id,
                                                                          ltc_balance=user.ltc_balance,
                                                                          fiat_balance=fiat_balance,
@@ -96,10 +99,9 @@ async def top_up_balance(callback: CallbackQuery):
     await callback.answer()
 
 
-async def create_purchase_history_keyboard_builder(page: int, user_id: int):
+async def create_purchase_history_keyboard_builder(orders: KeysetPage):
     orders_markup_builder = InlineKeyboardBuilder()
-    orders = await BuyService.get_buys_by_buyer_id(user_id, page)
-    for order in orders:
+    for order in orders.entries:
         quantity = order.quantity
         total_price = order.total_price
         buy_id = order.id
@@ -115,18 +117,19 @@ async def create_purchase_history_keyboard_builder(page: int, user_id: int):
                 currency_sym=Localizator.get_currency_symbol()),
             callback_data=item_from_history_callback)
     orders_markup_builder.adjust(1)
-    return orders_markup_builder, len(orders)
+    return orders_markup_builder
 
 
 async def purchase_history(callback: CallbackQuery):
     unpacked_callback = MyProfileCallback.unpack(callback.data)
     telegram_id = callback.message.chat.id
     user = await UserService.get_by_tgid(telegram_id)
-    orders_markup_builder, orders_num = await create_purchase_history_keyboard_builder(unpacked_callback.page, user.id)
-    orders_markup_builder = await add_pagination_buttons(orders_markup_builder, callback.data,
-                                                         BuyService.get_max_page_purchase_history(user.id),
-                                                         MyProfileCallback.unpack, MyProfileConstants.back_to_main_menu)
-    if orders_num == 0:
+    orders = await BuyService.get_buys_by_buyer_id(user.id, unpacked_callback.cursor)
+    orders_markup_builder = await create_purchase_history_keyboard_builder(orders)
+    orders_markup_builder = add_pagination_buttons(orders_markup_builder, callback.data, orders,
+                                                   MyProfileCallback.unpack,
+                                                   MyProfileConstants.get_back_to_main_menu())
+    if len(orders.entries) == 0:
         await callback.message.edit_text(Localizator.get_text(BotEntity.USER, "no_purchases"),
                                          reply_markup=orders_markup_builder.as_markup())
     else:
@@ -168,13 +171,11 @@ async def refresh_balance(callback: CallbackQuery):
 
 async def get_order_from_history(callback: CallbackQuery):
     current_level = 5
-    buy_id = MyProfileCallback.unpack(callback.data).args_for_action
-    items = await ItemService.get_items_by_buy_id(buy_id)
-    message = await create_message_with_bought_items(items)
+    buy_id = int(MyProfileCallback.unpack(callback.data).args_for_action)
     back_builder = InlineKeyboardBuilder()
     back_builder.button(text=Localizator.get_text(BotEntity.COMMON, "back_button"),
                         callback_data=create_callback_profile(level=current_level - 1))
-    await callback.message.edit_text(text=message, reply_markup=back_builder.as_markup())
+    await OrderDelivery.deliver(callback.message, buy_id, back_builder.as_markup(), edit=True)
 
 
 async def top_up_by_method(callback: CallbackQuery):
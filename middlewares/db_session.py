@@ -0,0 +1,28 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from db import db_session_scope
+
+
+class DBSessionMiddleware(BaseMiddleware):
+    """
+    Opens one database session per update. Services reach it through db.get_db_session(),
+    so filters, handlers and services of one update share a session instead of opening one per call
+    and, with WAL, read from one snapshot.
+    """
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        async with db_session_scope() as scope:
+            try:
+                return await handler(event, data)
+            finally:
+                if isinstance(event, Update):
+                    logging.debug(f"Update {event.update_id}: {scope.requests} database session request(s) "
+                                  f"served by {int(scope.session is not None)} session(s), "
+                                  f"{scope.commits} commit(s)")
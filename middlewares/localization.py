@@ -0,0 +1,47 @@
+from typing import Any, Awaitable, Callable, Dict, Union
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from services.user import UserService
+from utils.localizator import Localizator
+
+
+class LocalizationMiddleware(BaseMiddleware):
+    """
+    Sets Localizator.current_language for the duration of an update.
+    With a fixed language (e.g. for the admin router) the user's preference is ignored.
+    """
+
+    def __init__(self, language: Union[str, None] = None):
+        self.language = language
+
+    @staticmethod
+    async def resolve_user_language(user: Union[User, None]) -> str:
+        if user is None:
+            return Localizator.default_language
+        language = Localizator.get_user_language(user.id)
+        if language is None:
+            language = await UserService.get_language(user.id)
+            if language is None:
+                language = Localizator.UNREGISTERED
+            Localizator.set_user_language(user.id, language)
+        if language == Localizator.UNREGISTERED:
+            # Not registered yet, answer in the language of the Telegram client.
+            return Localizator.resolve_language(user.language_code)
+        return language
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        language = self.language
+        if language is None:
+            language = await self.resolve_user_language(data.get("event_from_user"))
+        # Loads the catalog before filters run, so its button texts are in the reverse index.
+        Localizator.get_catalog(language)
+        token = Localizator.current_language.set(language)
+        try:
+            return await handler(event, data)
+        finally:
+            Localizator.current_language.reset(token)
@@ -0,0 +1,50 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """
+    Drops updates Telegram delivers again, e.g. after a webhook request timed out, so a repeated callback
+    can not run a checkout twice. Remembers the (bot id, update_id) of recent updates in a bounded table,
+    entries expire ttl seconds after the update arrived.
+    Registered as the first outer middleware, duplicates are dropped before any database work.
+    """
+    max_entries = 100000
+    ttl = 60 * 60
+
+    def __init__(self):
+        self.__seen: OrderedDict[tuple[int, int], float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def is_duplicate(self, bot_id: int, update_id: int) -> bool:
+        now = time.monotonic()
+        # Entries are in arrival order, expired ones are at the front.
+        while self.__seen and next(iter(self.__seen.values())) < now:
+            self.__seen.popitem(last=False)
+        key = (bot_id, update_id)
+        if key in self.__seen:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.__seen[key] = now + self.ttl
+        if len(self.__seen) > self.max_entries:
+            self.__seen.popitem(last=False)
+        return False
+
+    def get_metrics(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "tracked_updates": len(self.__seen)}
+
+    async def __call__(self,
+                       handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject,
+                       data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update) and self.is_duplicate(data["bot"].id, event.update_id):
+            logging.info(f"Dropped duplicate update {event.update_id}")
+            return None
+        return await handler(event, data)
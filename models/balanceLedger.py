@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, func
+
+from models.base import Base
+
+
+class BalanceLedgerEntry(Base):
+    __tablename__ = 'balance_ledger'
+    # Append-only, users.balance is the materialized sum of a user's entries.
+    # The history of a user is read in insertion order.
+    __table_args__ = (
+        Index("ix_balance_ledger_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, unique=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    # services.balance.BalanceChange value
+    change = Column(String, nullable=False)
+    # Signed change of the balance
+    amount = Column(Float, nullable=False)
+    # The buy of purchases and refunds
+    buy_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=func.now())
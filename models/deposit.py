@@ -7,7 +7,7 @@ class Deposit(Base):
     __tablename__ = 'deposits'
     id = Column(Integer, primary_key=True)
     tx_id = Column(String, nullable=False, unique=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     network = Column(String, nullable=False)
     amount = Column(BigInteger, nullable=False)
     is_withdrawn = Column(Boolean, default=False)
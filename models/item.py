@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Index, text
 from sqlalchemy.orm import relationship, backref
 
 from models.base import Base
@@ -8,6 +8,11 @@ from models.base import Base
 
 class Item(Base):
     __tablename__ = 'items'
+    # Stock lookups only ever look at unsold items, so the index leaves sold ones out.
+    # Queries must compare is_sold with a literal (Item.is_sold == False) for SQLite to pick it.
+    __table_args__ = (
+        Index("ix_items_unsold_subcategory_id", "subcategory_id", sqlite_where=text("is_sold = 0")),
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
     subcategory_id = Column(Integer, ForeignKey("subcategories.id", ondelete="CASCADE"), nullable=False)
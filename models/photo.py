@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, LargeBinary
+from sqlalchemy import Column, Integer, String
 
 from models.base import Base
 
@@ -7,4 +7,6 @@ class Photo(Base):
     __tablename__ = 'photos'
 
     id = Column(Integer, primary_key=True, unique=True)
-    data = Column(LargeBinary, nullable=False)
+    # The file itself lives in utils.photo_store.PhotoStore.
+    sha256 = Column(String, nullable=False, index=True)
+    size = Column(Integer, nullable=False)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
+
+from models.base import Base
+
+
+class PhotoFileId(Base):
+    __tablename__ = 'photo_file_ids'
+    # Telegram file_ids are only valid for the bot that received them, multibot keeps one per bot.
+    __table_args__ = (
+        UniqueConstraint("photo_id", "bot_id"),
+    )
+
+    id = Column(Integer, primary_key=True, unique=True)
+    photo_id = Column(Integer, ForeignKey("photos.id", ondelete="CASCADE"), nullable=False)
+    bot_id = Column(Integer, nullable=False)
+    file_id = Column(String, nullable=False)
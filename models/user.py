@@ -12,8 +12,11 @@ class User(Base):
     last_balance_refresh = Column(DateTime)
     top_up_amount = Column(Float, default=0.0)
     consume_records = Column(Float, default=0.0)
-    registered_at = Column(DateTime, default=func.now())
+    # top_up_amount - consume_records, kept in step with the balance_ledger by services.balance.BalanceService.
+    balance = Column(Float, nullable=False, default=0.0)
+    registered_at = Column(DateTime, default=func.now(), index=True)
     can_receive_messages = Column(Boolean, default=True)
     ltc_address = Column(String, nullable=False, unique=True)
     ltc_balance = Column(Float, default=0.0)
     seed = Column(String, nullable=False, unique=True)
+    language = Column(String, nullable=True)
@@ -14,14 +14,16 @@ from aiogram.filters import Command, CommandObject
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message
 from aiogram.utils.token import TokenValidationError, validate_token
-from aiogram.webhook.aiohttp_server import (
-    SimpleRequestHandler,
-    TokenBasedRequestHandler,
-    setup_application,
-)
+from aiogram.webhook.aiohttp_server import setup_application
 
 from db import create_db_and_tables
+from middlewares.db_session import DBSessionMiddleware
+from middlewares.localization import LocalizationMiddleware
+from middlewares.update_deduplication import UpdateDeduplicationMiddleware
+from services.balance import BalanceService
+from services.user import UserService
 from utils.custom_filters import AdminIdFilter
+from utils.update_queue import UpdateQueue, QueuedRequestHandler, QueuedTokenBasedRequestHandler
 
 main_router_multibot = Router()
 
@@ -59,6 +61,8 @@ async def command_add_bot(message: Message, command: CommandObject, bot: Bot) ->
 async def on_startup(dispatcher: Dispatcher, bot: Bot):
     await bot.set_webhook(f"{BASE_URL}{MAIN_BOT_PATH}")
     await create_db_and_tables()
+    await UserService.load_known_users()
+    BalanceService.start_reconciliation()
     for admin in config.ADMIN_ID_LIST:
         try:
             await bot.send_message(admin, 'Bot is working')
@@ -73,17 +77,30 @@ def main(main_router):
     bot = Bot(token=MAIN_BOT_TOKEN, **bot_settings)
     storage = MemoryStorage()
 
+    # Shared by both dispatchers, update ids are tracked per bot.
+    deduplication_middleware = UpdateDeduplicationMiddleware()
+
     main_dispatcher = Dispatcher(storage=storage)
+    main_dispatcher.update.outer_middleware(deduplication_middleware)
     main_dispatcher.include_router(main_router_multibot)
     main_dispatcher.startup.register(on_startup)
 
     multibot_dispatcher = Dispatcher(storage=storage)
+    multibot_dispatcher.update.outer_middleware(deduplication_middleware)
+    multibot_dispatcher.update.outer_middleware(DBSessionMiddleware())
+    multibot_dispatcher.update.outer_middleware(LocalizationMiddleware())
     multibot_dispatcher.include_router(main_router)
 
     app = web.Application()
-    SimpleRequestHandler(dispatcher=main_dispatcher, bot=bot).register(app, path=MAIN_BOT_PATH)
-    TokenBasedRequestHandler(
+    # All bots share the workers, updates are ordered per bot and chat.
+    update_queue = UpdateQueue(config.UPDATE_WORKERS, config.UPDATE_QUEUE_SIZE)
+    update_queue.setup(app, config.METRICS_HOST, config.METRICS_PORT, config.METRICS_PATH)
+    update_queue.add_metrics_source("deduplication", deduplication_middleware.get_metrics)
+    QueuedRequestHandler(dispatcher=main_dispatcher, bot=bot, update_queue=update_queue).register(app,
+                                                                                               path=MAIN_BOT_PATH)
+    QueuedTokenBasedRequestHandler(
         dispatcher=multibot_dispatcher,
+        update_queue=update_queue,
         bot_settings=bot_settings,
     ).register(app, path=OTHER_BOTS_PATH)
 
@@ -1,8 +1,8 @@
 import grequests
-from pathlib import Path
 
-from aiogram import types, F, Router
+from aiogram import types, Router
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import config
@@ -14,41 +14,66 @@ from handlers.admin.admin import admin_router
 from handlers.user.all_categories import all_categories_router
 from handlers.user.my_profile import my_profile_router
 from services.user import UserService
-from utils.custom_filters import IsUserExistFilter
+from utils.custom_filters import IsUserExistFilter, LocalizedTextFilter
 from utils.localizator import Localizator, BotEntity
 
 logging.basicConfig(level=logging.INFO)
 main_router = Router()
 
 
-@main_router.message(Command(commands=["start", "help"]))
-async def start(message: types.message):
+class LanguageCallback(CallbackData, prefix="language"):
+    language: str
+
+
+def create_start_markup(telegram_id: int) -> types.ReplyKeyboardMarkup:
     all_categories_button = types.KeyboardButton(text=Localizator.get_text(BotEntity.USER, "all_categories"))
     my_profile_button = types.KeyboardButton(text=Localizator.get_text(BotEntity.USER, "my_profile"))
     faq_button = types.KeyboardButton(text=Localizator.get_text(BotEntity.USER, "faq"))
     help_button = types.KeyboardButton(text=Localizator.get_text(BotEntity.USER, "help"))
     admin_menu_button = types.KeyboardButton(text=Localizator.get_text(BotEntity.ADMIN, "menu"))
-    user_telegram_id = message.chat.id
-    user_telegram_username = message.from_user.username
-    is_exist = await UserService.is_exist(user_telegram_id)
-    if is_exist is False:
-        await UserService.create(user_telegram_id, user_telegram_username)
-    else:
-        await UserService.update_receive_messages(user_telegram_id, True)
-        await UserService.update_username(user_telegram_id, user_telegram_username)
     keyboard = [[all_categories_button, my_profile_button], [faq_button, help_button]]
-    if user_telegram_id in config.ADMIN_ID_LIST:
+    if telegram_id in config.ADMIN_ID_LIST:
         keyboard.append([admin_menu_button])
-    start_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2, keyboard=keyboard)
-    await message.answer(Localizator.get_text(BotEntity.COMMON, "start_message"), reply_markup=start_markup)
+    return types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2, keyboard=keyboard)
 
 
-@main_router.message(F.text == Localizator.get_text(BotEntity.USER, "faq"), IsUserExistFilter())
+@main_router.message(Command(commands=["start", "help"]))
+async def start(message: types.message):
+    user_telegram_id = message.chat.id
+    user_telegram_username = message.from_user.username
+    await UserService.register(user_telegram_id, user_telegram_username,
+                               Localizator.resolve_language(message.from_user.language_code))
+    await message.answer(Localizator.get_text(BotEntity.COMMON, "start_message"),
+                         reply_markup=create_start_markup(user_telegram_id))
+
+
+@main_router.message(Command(commands=["language"]), IsUserExistFilter())
+async def choose_language(message: types.message):
+    language_builder = InlineKeyboardBuilder()
+    for language in Localizator.get_available_languages():
+        language_builder.button(text=Localizator.get_text(BotEntity.COMMON, "language_name", language),
+                                callback_data=LanguageCallback(language=language).pack())
+    language_builder.adjust(2)
+    await message.answer(Localizator.get_text(BotEntity.USER, "choose_language"),
+                         reply_markup=language_builder.as_markup())
+
+
+@main_router.callback_query(LanguageCallback.filter(), IsUserExistFilter())
+async def set_language(callback: types.CallbackQuery, callback_data: LanguageCallback):
+    language = Localizator.resolve_language(callback_data.language)
+    await UserService.update_language(callback.from_user.id, language)
+    Localizator.current_language.set(language)
+    await callback.message.delete()
+    await callback.message.answer(Localizator.get_text(BotEntity.USER, "language_changed"),
+                                  reply_markup=create_start_markup(callback.from_user.id))
+
+
+@main_router.message(LocalizedTextFilter(BotEntity.USER, "faq"), IsUserExistFilter())
 async def faq(message: types.message):
     await message.answer(Localizator.get_text(BotEntity.USER, "faq_string"))
 
 
-@main_router.message(F.text == Localizator.get_text(BotEntity.USER, "help"), IsUserExistFilter())
+@main_router.message(LocalizedTextFilter(BotEntity.USER, "help"), IsUserExistFilter())
 async def support(message: types.message):
     admin_keyboard_builder = InlineKeyboardBuilder()
 
@@ -57,14 +82,23 @@ async def support(message: types.message):
                          reply_markup=admin_keyboard_builder.as_markup())
 
 
+# Included last, it answers the callback queries no other handler matched.
+outdated_button_router = Router()
+
+
+@outdated_button_router.callback_query()
+async def outdated_button(callback: types.CallbackQuery):
+    # Buttons whose callback data no longer unpacks, like a "~<token>" state from before a restart,
+    # match no filter. Unanswered, the button would keep spinning.
+    await callback.answer(Localizator.get_text(BotEntity.COMMON, "outdated_button"), show_alert=True)
+
+
 main_router.include_router(admin_router)
 main_router.include_router(my_profile_router)
 main_router.include_router(all_categories_router)
+main_router.include_router(outdated_button_router)
 
 if __name__ == '__main__':
-    photos_folder = Path("photos")
-    if photos_folder.exists() is False:
-        photos_folder.mkdir()
     if config.MULTIBOT:
         main_multibot(main_router)
     else:
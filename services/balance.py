@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from enum import Enum
+from typing import Union
+
+from sqlalchemy import select, update, func, insert
+from sqlalchemy.orm import Session
+
+import config
+from db import session_execute, get_db_session, run_in_immediate_transaction
+from models.balanceLedger import BalanceLedgerEntry
+from models.user import User
+
+
+class BalanceChange(Enum):
+    # Balance of users registered before the ledger was introduced.
+    OPENING = "opening"
+    DEPOSIT = "deposit"
+    ADMIN_CREDIT = "admin_credit"
+    ADMIN_DEBIT = "admin_debit"
+    PURCHASE = "purchase"
+    REFUND = "refund"
+
+
+class BalanceService:
+    """
+    Every balance change appends a balance_ledger entry and moves users.balance by the same amount,
+    together with the top_up_amount or consume_records totals, in one transaction.
+    The counters are changed by "SET x = x + :delta" statements, concurrent changes can not overwrite each other.
+    """
+    # change -> (sign of the balance change, User total the amount is added to or subtracted from)
+    __effects = {
+        BalanceChange.DEPOSIT: (1, User.top_up_amount),
+        BalanceChange.ADMIN_CREDIT: (1, User.top_up_amount),
+        BalanceChange.ADMIN_DEBIT: (-1, User.consume_records),
+        BalanceChange.PURCHASE: (-1, User.consume_records),
+        BalanceChange.REFUND: (1, User.consume_records),
+    }
+    __reconciliation_task = None
+
+    @staticmethod
+    def apply(session: Session, user_id: int, change: BalanceChange, amount: float,
+              buy_id: Union[int, None] = None, require_funds: bool = False) -> bool:
+        """
+        Applies the change inside the caller's transaction. Returns False and changes nothing if the user
+        does not exist, or if require_funds is set and the balance is lower than a debited amount.
+        """
+        sign, total_column = BalanceService.__effects[change]
+        delta = sign * amount
+        # Refunds give back what a purchase consumed, every other change grows its total.
+        total_delta = -delta if change == BalanceChange.REFUND else amount
+        stmt = update(User).where(User.id == user_id)
+        if require_funds and delta < 0:
+            stmt = stmt.where(User.balance >= -delta)
+        stmt = stmt.values({User.balance: User.balance + delta,
+                            total_column: func.coalesce(total_column, 0) + total_delta})
+        if session.execute(stmt).rowcount != 1:
+            return False
+        session.execute(insert(BalanceLedgerEntry).values(user_id=user_id, change=change.value, amount=delta,
+                                                          buy_id=buy_id))
+        return True
+
+    @staticmethod
+    async def apply_by_tgid(telegram_id: int, change: BalanceChange, amount: float,
+                            require_funds: bool = False) -> bool:
+        def apply_change(session: Session) -> bool:
+            user_id = session.execute(select(User.id).where(User.telegram_id == telegram_id)).scalar()
+            if user_id is None:
+                return False
+            return BalanceService.apply(session, user_id, change, amount, require_funds=require_funds)
+
+        return await run_in_immediate_transaction(apply_change)
+
+    @staticmethod
+    async def get_history(user_id: int, limit: int = 50) -> list[BalanceLedgerEntry]:
+        async with get_db_session() as session:
+            stmt = (select(BalanceLedgerEntry)
+                    .where(BalanceLedgerEntry.user_id == user_id)
+                    .order_by(BalanceLedgerEntry.id.desc())
+                    .limit(limit))
+            entries = await session_execute(stmt, session)
+            return entries.scalars().all()
+
+    @staticmethod
+    async def reconcile() -> list[tuple[int, float, float]]:
+        """
+        (user id, users.balance, ledger sum) of the users whose materialized balance differs from their ledger.
+        """
+        async with get_db_session() as session:
+            ledger_sums = (select(BalanceLedgerEntry.user_id, func.sum(BalanceLedgerEntry.amount).label("amount"))
+                           .group_by(BalanceLedgerEntry.user_id)
+                           .subquery())
+            ledger_sum = func.coalesce(ledger_sums.c.amount, 0.0)
+            # Sums of floats drift by rounding errors, only differences above a thousandth of a cent count.
+            stmt = (select(User.id, User.balance, ledger_sum)
+                    .outerjoin(ledger_sums, ledger_sums.c.user_id == User.id)
+                    .where(func.abs(User.balance - ledger_sum) > 0.00001))
+            mismatches = await session_execute(stmt, session)
+            return [tuple(mismatch) for mismatch in mismatches.all()]
+
+    @staticmethod
+    def start_reconciliation():
+        if BalanceService.__reconciliation_task is None:
+            BalanceService.__reconciliation_task = asyncio.create_task(BalanceService.__run_reconciliation())
+
+    @staticmethod
+    async def __run_reconciliation():
+        while True:
+            try:
+                mismatches = await BalanceService.reconcile()
+                for user_id, balance, ledger_sum in mismatches:
+                    logging.error(f"Balance of user {user_id} is {balance}, its ledger sums up to {ledger_sum}")
+            except Exception as e:
+                logging.error(f"Balance reconciliation failed: {e}")
+            await asyncio.sleep(config.BALANCE_RECONCILIATION_INTERVAL)
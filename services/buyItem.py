@@ -1,22 +1,19 @@
-from sqlalchemy import select
-from db import session_execute, session_commit, get_db_session
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from db import session_execute, get_db_session
 from models.buyItem import BuyItem
-from models.item import Item
 
 
 class BuyItemService:
 
     @staticmethod
-    async def insert_many(item_collection: list[Item], buy_id: int):
-        for item in item_collection:
-            await BuyItemService.insert_new(item, buy_id)
-
-    @staticmethod
-    async def insert_new(item: Item, buy_id: int):
-        async with get_db_session() as session:
-            new_buy = BuyItem(buy_id=buy_id, item_id=item.id)
-            session.add(new_buy)
-            await session_commit(session)
+    def insert_many(session: Session, item_ids: list[int], buy_id: int):
+        """
+        Links the items to the buy with one multi-row INSERT.
+        Runs inside a db.run_in_immediate_transaction function, which commits.
+        """
+        session.execute(insert(BuyItem).values([{"buy_id": buy_id, "item_id": item_id} for item_id in item_ids]))
 
     @staticmethod
     async def get_buy_item_by_buy_id(buy_id: int) -> BuyItem:
@@ -1,11 +1,11 @@
-import math
-from sqlalchemy import select, func, update
-import config
+from sqlalchemy import select, func, update, and_
 from models.category import Category
 from models.item import Item
 from db import session_commit, session_execute, session_refresh, get_db_session
 from models.photo import Photo
 from models.subcategory import Subcategory
+from utils.catalog_snapshot import CatalogCache
+from utils.keyset_pagination import KeysetPaginator, KeysetPage
 
 
 class CategoryService:
@@ -21,6 +21,7 @@ class CategoryService:
                 new_category_obj = Category(name=category_name, description=description, image_id=image_id)
                 session.add(new_category_obj)
                 await session_commit(session)
+                CatalogCache.invalidate()
                 await session_refresh(session, new_category_obj)
                 return new_category_obj
             else:
@@ -28,6 +29,7 @@ class CategoryService:
                                                                                      image_id=image_id, is_hidden=False)
                 await session_execute(stmt, session)
                 await session_commit(session)
+                CatalogCache.invalidate()
                 await session_refresh(session, category)
                 return category
 
@@ -39,58 +41,19 @@ class CategoryService:
             return category.scalar()
 
     @staticmethod
-    async def get_to_hide(page: int = 0):
+    async def get_all_with_items_count(cursor: str) -> KeysetPage:
+        """
+        Visible categories of the page, each with its number of unsold items, in a single grouped query.
+        Rows expose .Category and .items_count.
+        """
         async with get_db_session() as session:
-            stmt = select(Category).where(Category.is_hidden == 0).distinct().limit(config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES).group_by(Category.name)
-            categories = await session_execute(stmt, session)
-            return categories.scalars().all()
-
-    @staticmethod
-    async def have_items(category_id: int) -> int:
-        async with get_db_session() as session:
-            sub_stmt = select(Item.id).join(Subcategory, Item.subcategory_id == Subcategory.id).join(Category,
-                                                                                                     Subcategory.category_id == Category.id).where(
-                Item.is_sold == 0, Category.id == category_id)
-            stmt = select(func.count()).select_from(sub_stmt)
-            category_names = await session_execute(stmt, session)
-            return category_names.scalar()
-
-    @staticmethod
-    async def get_maximum_page_to_delete() -> int:
-        async with get_db_session() as session:
-            unique_categories_subquery = (
-                select(Category.id)
-                .filter(Category.is_hidden == 0)
-                .distinct()
-            ).alias('unique_categories')
-            stmt = select(func.count()).select_from(unique_categories_subquery)
-            max_page = await session_execute(stmt, session)
-            max_page = max_page.scalar_one()
-            if max_page % config.PAGE_ENTRIES == 0:
-                return max_page / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(max_page / config.PAGE_ENTRIES)
-
-    @staticmethod
-    async def get_maximum_page() -> int:
-        async with get_db_session() as session:
-            stmt = select(func.count(Category.id)).distinct()
-            subcategories = await session_execute(stmt, session)
-            subcategories_count = subcategories.scalar_one()
-            if subcategories_count % config.PAGE_ENTRIES == 0:
-                return subcategories_count / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(subcategories_count / config.PAGE_ENTRIES)
-
-    @staticmethod
-    async def get_all(page: int):
-        async with get_db_session() as session:
-            stmt = select(Category).where(Category.is_hidden == False).limit(config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES).group_by(
-                Category.name)
-            categories = await session_execute(stmt, session)
-            return categories.scalars().all()
+            stmt = (select(Category, func.count(Item.id).label("items_count"))
+                    .outerjoin(Subcategory, Subcategory.category_id == Category.id)
+                    .outerjoin(Item, and_(Item.subcategory_id == Subcategory.id, Item.is_sold == False))
+                    .where(Category.is_hidden == False)
+                    .group_by(Category.id))
+            return await KeysetPaginator.paginate(session, stmt, (Category.name,), Category.id, cursor,
+                                                  lambda row: row.Category.id)
 
     @staticmethod
     async def get_photo(category_id: int) -> Photo:
@@ -112,6 +75,7 @@ class CategoryService:
             stmt = update(Category).where(Category.id == category_id).values(is_hidden=True)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def update(category_id: int, values_dict: dict):
@@ -119,6 +83,7 @@ class CategoryService:
             stmt = update(Category).where(Category.id == category_id).values(**values_dict)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def get_by_subcategory_id(subcategory_id: int):
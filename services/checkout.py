@@ -0,0 +1,103 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Union
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from db import run_in_immediate_transaction
+from models.buy import Buy
+from models.item import Item
+from models.subcategory import Subcategory
+from models.user import User
+from services.balance import BalanceService, BalanceChange
+from services.buyItem import BuyItemService
+from services.item import ItemService
+from services.reservation import ReservationService
+from utils.catalog_snapshot import CatalogCache
+
+
+class CheckoutStatus(Enum):
+    COMPLETED = "completed"
+    NOT_FOUND = "not_found"
+    OUT_OF_STOCK = "out_of_stock"
+    INSUFFICIENT_FUNDS = "insufficient_funds"
+    PRICE_CHANGED = "price_changed"
+
+
+@dataclass
+class CheckoutResult:
+    status: CheckoutStatus
+    total_price: float = 0.0
+    buy_id: Union[int, None] = None
+    items: list[Item] = field(default_factory=list)
+
+
+class CheckoutRejected(Exception):
+    def __init__(self, status: CheckoutStatus):
+        super().__init__(status.value)
+        self.status = status
+
+
+class CheckoutService:
+
+    @staticmethod
+    async def checkout(telegram_id: int, subcategory_id: int, quantity: int,
+                       confirmed_price: Union[float, None] = None) -> CheckoutResult:
+        """
+        Buys quantity items of the subcategory at its current price in a single transaction:
+        claims the items, debits the balance and records the Buy and BuyItem rows, or changes nothing.
+        Items reserved by the user for this purchase are claimed first, items held by others are skipped.
+        With confirmed_price the purchase is rejected if the current price differs from it.
+        """
+        reserved_item_ids = ReservationService.get_reserved_item_ids(telegram_id, subcategory_id, quantity)
+        excluded_item_ids = ReservationService.get_held_item_ids(subcategory_id).difference(reserved_item_ids)
+        try:
+            result = await run_in_immediate_transaction(CheckoutService.__checkout, telegram_id, subcategory_id,
+                                                        quantity, confirmed_price, reserved_item_ids,
+                                                        excluded_item_ids)
+        except CheckoutRejected as e:
+            return CheckoutResult(e.status)
+        finally:
+            ReservationService.release(telegram_id)
+        if result.status == CheckoutStatus.COMPLETED:
+            CatalogCache.update_stock({subcategory_id: -quantity})
+        return result
+
+    @staticmethod
+    def __checkout(session: Session, telegram_id: int, subcategory_id: int, quantity: int,
+                   confirmed_price: Union[float, None], reserved_item_ids: list[int],
+                   excluded_item_ids: set[int]) -> CheckoutResult:
+        price = session.execute(select(Subcategory.price).where(Subcategory.id == subcategory_id)).scalar()
+        user = session.execute(select(User).where(User.telegram_id == telegram_id)).scalar()
+        if price is None or user is None or quantity < 1:
+            return CheckoutResult(CheckoutStatus.NOT_FOUND)
+        total_price = price * quantity
+        if confirmed_price is not None and price != confirmed_price:
+            return CheckoutResult(CheckoutStatus.PRICE_CHANGED, total_price)
+        if user.balance < total_price:
+            return CheckoutResult(CheckoutStatus.INSUFFICIENT_FUNDS, total_price)
+        items = []
+        if reserved_item_ids:
+            items = session.execute(select(Item).where(Item.id.in_(reserved_item_ids),
+                                                       Item.is_sold == False)).scalars().all()
+        if len(items) < quantity:
+            # No hold, or it was lost on a restart, fall back to the free stock.
+            items = session.execute(ReservationService.select_free_items(Item, subcategory_id, quantity,
+                                                                         excluded_item_ids)).scalars().all()
+            items = ReservationService.pick_free_items(items, excluded_item_ids, quantity, lambda item: item.id)
+        if len(items) < quantity:
+            return CheckoutResult(CheckoutStatus.OUT_OF_STOCK, total_price)
+        # BEGIN IMMEDIATE already excludes other writers, the guarded updates keep the invariants
+        # even if a write slipped in between the reads above and this point.
+        item_ids = [item.id for item in items]
+        if ItemService.set_items_sold(session, item_ids) != quantity:
+            raise CheckoutRejected(CheckoutStatus.OUT_OF_STOCK)
+        buy = Buy(buyer_id=user.id, quantity=quantity, total_price=total_price)
+        session.add(buy)
+        session.flush()
+        if not BalanceService.apply(session, user.id, BalanceChange.PURCHASE, total_price, buy.id,
+                                    require_funds=True):
+            raise CheckoutRejected(CheckoutStatus.INSUFFICIENT_FUNDS)
+        BuyItemService.insert_many(session, item_ids, buy.id)
+        return CheckoutResult(CheckoutStatus.COMPLETED, total_price, buy.id, list(items))
@@ -1,10 +1,13 @@
-import math
-from sqlalchemy import select, func, update, distinct, delete
-import config
+from collections import Counter
+from typing import AsyncIterator
+from sqlalchemy import select, func, update, delete
+from sqlalchemy.orm import Session
 from db import session_execute, session_commit, get_db_session, session_refresh
 from models.buyItem import BuyItem
 from models.item import Item
 from models.subcategory import Subcategory
+from utils.catalog_snapshot import CatalogCache
+from utils.keyset_pagination import KeysetPaginator, KeysetPage
 
 
 class ItemService:
@@ -17,64 +20,65 @@ class ItemService:
             return item.scalar()
 
     @staticmethod
-    async def get_available_quantity(subcategory_id: int) -> int:
-        async with get_db_session() as session:
-            stmt = select(func.count(Item.id)).where(Item.subcategory_id == subcategory_id,
-                                                     Item.is_sold == 0)
-            available_quantity = await session_execute(stmt, session)
-            return available_quantity.scalar()
-
-    @staticmethod
-    async def get_bought_items(subcategory_id: int, quantity: int):
-        async with get_db_session() as session:
-            stmt = select(Item).where(Item.subcategory_id == subcategory_id,
-                                      Item.is_sold == 0).limit(quantity)
-            result = await session_execute(stmt, session)
-            bought_items = result.scalars().all()
-            return list(bought_items)
-
-    @staticmethod
-    async def set_items_sold(sold_items: list[Item]):
-        async with get_db_session() as session:
-            for item in sold_items:
-                stmt = update(Item).where(Item.id == item.id).values(is_sold=1)
-                await session_execute(stmt, session)
-            await session_commit(session)
+    def set_items_sold(session: Session, item_ids: list[int]) -> int:
+        """
+        Marks the items sold with one UPDATE ... WHERE id IN (...), returns how many were still unsold.
+        Runs inside a db.run_in_immediate_transaction function, which commits; the caller updates the CatalogCache.
+        """
+        sold = session.execute(update(Item)
+                               .where(Item.id.in_(item_ids), Item.is_sold == False)
+                               .values(is_sold=True))
+        return sold.rowcount
 
     @staticmethod
-    async def get_items_by_buy_id(buy_id: int) -> list:
+    async def get_bought_data_size(buy_id: int) -> tuple[int, int]:
+        """
+        (number of items, total length of their private_data) of the buy.
+        """
         async with get_db_session() as session:
-            stmt = (
-                select(Item)
-                .join(BuyItem, BuyItem.item_id == Item.id)
-                .where(BuyItem.buy_id == buy_id)
-            )
-            result = await session_execute(stmt, session)
-            items = result.scalars().all()
-            return items
+            stmt = (select(func.count(Item.id), func.coalesce(func.sum(func.length(Item.private_data)), 0))
+                    .join(BuyItem, BuyItem.item_id == Item.id)
+                    .where(BuyItem.buy_id == buy_id))
+            size = await session_execute(stmt, session)
+            return tuple(size.one())
 
     @staticmethod
-    async def get_unsold_subcategories_by_category(category_id: int, page) -> \
-            list[Item]:
-        async with get_db_session() as session:
-            stmt = select(Item).join(Subcategory, Subcategory.id == Item.subcategory_id).where(
-                Subcategory.category_id == category_id, Item.is_sold == 0).group_by(Subcategory.name).limit(
-                config.PAGE_ENTRIES).offset(config.PAGE_ENTRIES * page)
-            subcategories = await session_execute(stmt, session)
-            return subcategories.scalars().all()
+    async def iterate_bought_data(buy_id: int, batch_size: int = 500) -> AsyncIterator[str]:
+        """
+        private_data of the buy's items in item order, fetched in batches so large orders are never loaded at once.
+        """
+        last_item_id = 0
+        while True:
+            async with get_db_session() as session:
+                stmt = (select(Item.id, Item.private_data)
+                        .join(BuyItem, BuyItem.item_id == Item.id)
+                        .where(BuyItem.buy_id == buy_id, Item.id > last_item_id)
+                        .order_by(Item.id)
+                        .limit(batch_size))
+                rows = await session_execute(stmt, session)
+                rows = rows.all()
+            for row in rows:
+                yield row.private_data
+            if len(rows) < batch_size:
+                return
+            last_item_id = rows[-1].id
 
     @staticmethod
-    async def get_maximum_page(category_id: int):
+    async def get_unsold_subcategories_by_category(category_id: int, cursor: str) -> KeysetPage:
+        """
+        One row per subcategory of the category that has unsold items:
+        (subcategory_id, name, price, available_quantity).
+        """
         async with get_db_session() as session:
-            subquery = select(Item.subcategory_id).join(Subcategory, Item.subcategory_id == Subcategory.id).where(
-                Subcategory.category_id == category_id, Item.is_sold == 0)
-            stmt = select(func.count(distinct(subquery.c.subcategory_id)))
-            maximum_page = await session_execute(stmt, session)
-            maximum_page = maximum_page.scalar_one()
-            if maximum_page % config.PAGE_ENTRIES == 0:
-                return maximum_page / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(maximum_page / config.PAGE_ENTRIES)
+            stmt = (select(Subcategory.id.label("subcategory_id"),
+                           Subcategory.name,
+                           Subcategory.price,
+                           func.count(Item.id).label("available_quantity"))
+                    .join(Item, Item.subcategory_id == Subcategory.id)
+                    .where(Subcategory.category_id == category_id, Item.is_sold == False)
+                    .group_by(Subcategory.name))
+            return await KeysetPaginator.paginate(session, stmt, (Subcategory.name,), Subcategory.id, cursor,
+                                                  lambda row: row.subcategory_id)
 
     @staticmethod
     async def set_items_not_new():
@@ -86,28 +90,32 @@ class ItemService:
     @staticmethod
     async def delete_unsold_with_category_id(category_id: int):
         async with get_db_session() as session:
-            stmt = delete(Item).where(Item.category_id == category_id, Item.is_sold == 0)
+            stmt = delete(Item).where(Item.category_id == category_id, Item.is_sold == False)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def delete_with_subcategory_id(subcategory_id):
         async with get_db_session() as session:
-            stmt = delete(Item).where(Item.subcategory_id == subcategory_id, Item.is_sold == 0)
+            stmt = delete(Item).where(Item.subcategory_id == subcategory_id, Item.is_sold == False)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def add_many(new_items: list[Item]):
         async with get_db_session() as session:
             session.add_all(new_items)
             await session_commit(session)
+            CatalogCache.update_stock(Counter(item.subcategory_id for item in new_items))
 
     @staticmethod
     async def add_single(item: Item) -> int:
         async with get_db_session() as session:
             session.add(item)
             await session_commit(session)
+            CatalogCache.update_stock({item.subcategory_id: 1})
             await session_refresh(session, item)
             return item.id
 
@@ -122,7 +130,7 @@ class ItemService:
     @staticmethod
     async def get_in_stock_items():
         async with get_db_session() as session:
-            stmt = select(Item).where(Item.is_sold == 0)
+            stmt = select(Item).where(Item.is_sold == False)
             items = await session_execute(stmt, session)
             items = items.scalars().all()
             return items
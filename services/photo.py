@@ -1,31 +1,110 @@
+import asyncio
+import io
+import logging
 from pathlib import Path
+from typing import Union
 
 from aiogram import Bot
-from sqlalchemy import select
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, InputMediaPhoto, FSInputFile, InlineKeyboardMarkup
+from sqlalchemy import select, insert
 
 from db import get_db_session, session_refresh, session_commit, session_execute
 from models.item import Item
 from models.photo import Photo
+from models.photoFileId import PhotoFileId
+from utils.photo_compressor import PhotoCompressor
+from utils.photo_store import PhotoStore
 
 
 class PhotoService:
+    # (photo id, bot id) -> file_id Telegram assigned to the photo after the first upload by that bot.
+    __file_ids: dict[tuple[int, int], str] = {}
+
     @staticmethod
-    async def add_single(photo_path: str) -> int:
+    async def get_or_create_one(sha256: str, size: int) -> int:
         async with get_db_session() as session:
-            with open(photo_path, 'rb') as f:
-                photo = Photo(
-                    data=f.read()
-                )
-                session.add(photo)
-                await session_commit(session)
-                await session_refresh(session, photo)
-                return photo.id
+            stmt = select(Photo.id).where(Photo.sha256 == sha256).limit(1)
+            photo_id = await session_execute(stmt, session)
+            photo_id = photo_id.scalar()
+            if photo_id is not None:
+                return photo_id
+            photo = Photo(sha256=sha256, size=size)
+            session.add(photo)
+            await session_commit(session)
+            await session_refresh(session, photo)
+            return photo.id
+
+    @staticmethod
+    async def add_from_bytes(data: bytes) -> int:
+        compressed = await asyncio.to_thread(PhotoCompressor.compress, data)
+        logging.info(f"Photo compressed from {len(data)} to {len(compressed)} bytes, "
+                     f"{len(data) - len(compressed)} bytes saved")
+        sha256, size = await asyncio.to_thread(PhotoStore.add_stream, io.BytesIO(compressed))
+        return await PhotoService.get_or_create_one(sha256, size)
+
+    @staticmethod
+    async def add_single(photo_path: str) -> int:
+        data = await asyncio.to_thread(Path(photo_path).read_bytes)
+        return await PhotoService.add_from_bytes(data)
 
     @staticmethod
     async def add_from_file_id(file_id: str, bot: Bot):
         file = await bot.get_file(file_id)
-        photo_path = f"photos/{file.file_unique_id}.jpg"
-        await bot.download_file(file.file_path, photo_path)
-        photo_id = await PhotoService.add_single(photo_path)
-        Path(photo_path).unlink(missing_ok=True)
+        downloaded_file = await bot.download_file(file.file_path)
+        photo_id = await PhotoService.add_from_bytes(downloaded_file.getvalue())
+        await PhotoService.set_file_id(photo_id, bot.id, file_id)
         return photo_id
+
+    @staticmethod
+    async def get_by_primary_key(photo_id: int) -> Photo:
+        async with get_db_session() as session:
+            stmt = select(Photo).where(Photo.id == photo_id)
+            photo = await session_execute(stmt, session)
+            return photo.scalar()
+
+    @staticmethod
+    async def get_file_id(photo_id: int, bot_id: int) -> Union[str, None]:
+        file_id = PhotoService.__file_ids.get((photo_id, bot_id))
+        if file_id is None:
+            async with get_db_session() as session:
+                stmt = select(PhotoFileId.file_id).where(PhotoFileId.photo_id == photo_id,
+                                                         PhotoFileId.bot_id == bot_id)
+                file_id = await session_execute(stmt, session)
+                file_id = file_id.scalar()
+            if file_id is not None:
+                PhotoService.__file_ids[(photo_id, bot_id)] = file_id
+        return file_id
+
+    @staticmethod
+    async def set_file_id(photo_id: int, bot_id: int, file_id: str):
+        async with get_db_session() as session:
+            stmt = insert(PhotoFileId).values(photo_id=photo_id, bot_id=bot_id, file_id=file_id)
+            stmt = stmt.prefix_with("OR REPLACE")
+            await session_execute(stmt, session)
+            await session_commit(session)
+        PhotoService.__file_ids[(photo_id, bot_id)] = file_id
+
+    @staticmethod
+    async def edit_message_photo(message: Message, photo_id: int, caption: str,
+                                 reply_markup: InlineKeyboardMarkup):
+        """
+        Shows the photo in the message, by file_id if this bot already uploaded it.
+        The file is uploaded only on the first use or if Telegram rejects the stored file_id.
+        """
+        bot_id = message.bot.id
+        file_id = await PhotoService.get_file_id(photo_id, bot_id)
+        if file_id is not None:
+            try:
+                await message.edit_media(InputMediaPhoto(media=file_id, caption=caption), reply_markup=reply_markup)
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    raise
+                logging.warning(f"Uploading photo {photo_id} again, its file_id was rejected: {e.message}")
+        photo = await PhotoService.get_by_primary_key(photo_id)
+        photo_file = FSInputFile(PhotoStore.get_path(photo.sha256), f"{photo.id}.jpg")
+        edited_message = await message.edit_media(InputMediaPhoto(media=photo_file, caption=caption),
+                                                  reply_markup=reply_markup)
+        if isinstance(edited_message, Message) and edited_message.photo:
+            await PhotoService.set_file_id(photo_id, bot_id, edited_message.photo[-1].file_id)
@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from typing import Union, Callable, Any, Sequence
+
+from sqlalchemy import select, Select
+
+import config
+from db import session_execute, get_db_session
+from models.item import Item
+
+
+@dataclass
+class Reservation:
+    subcategory_id: int
+    item_ids: list[int]
+    # Unit price shown on the confirmation, the checkout is rejected if the price changed since.
+    price: float
+    expires_at: float
+
+
+class ReservationService:
+    """
+    In-memory holds on unsold items, taken when a user reaches the purchase confirmation and kept for
+    RESERVATION_TTL seconds. A user has at most one hold, a new one replaces the previous.
+    Other users' reservations and checkouts skip held items. Expired holds are swept in bulk from a heap
+    of expiry times, by a background task and before every lookup.
+    Holds do not survive a restart, the checkout then picks items from the stock as before.
+    """
+    sweep_interval = 30
+    __reservations: dict[int, Reservation] = {}
+    # subcategory id -> ids of its held items
+    __held_item_ids: dict[int, set[int]] = {}
+    # (expires_at, telegram_id), entries of replaced or released holds are skipped when popped.
+    __expirations: list[tuple[float, int]] = []
+    __lock: Union[asyncio.Lock, None] = None
+    __sweeper: Union[asyncio.Task, None] = None
+
+    @staticmethod
+    async def reserve(telegram_id: int, subcategory_id: int, quantity: int, price: float) -> bool:
+        """
+        Holds quantity unsold items of the subcategory for the user, returns False if not enough are free.
+        price is the unit price the user is asked to confirm.
+        """
+        if ReservationService.__lock is None:
+            ReservationService.__lock = asyncio.Lock()
+            ReservationService.__sweeper = asyncio.create_task(ReservationService.__run_sweeper())
+        # Reservations are serialized, so two users can not pick the same free items.
+        async with ReservationService.__lock:
+            ReservationService.release(telegram_id)
+            held_item_ids = ReservationService.get_held_item_ids(subcategory_id)
+            async with get_db_session() as session:
+                stmt = ReservationService.select_free_items(Item.id, subcategory_id, quantity, held_item_ids)
+                item_ids = await session_execute(stmt, session)
+                item_ids = ReservationService.pick_free_items(item_ids.scalars().all(), held_item_ids, quantity)
+            if len(item_ids) < quantity:
+                return False
+            expires_at = time.monotonic() + config.RESERVATION_TTL
+            ReservationService.__reservations[telegram_id] = Reservation(subcategory_id, list(item_ids), price,
+                                                                         expires_at)
+            ReservationService.__held_item_ids.setdefault(subcategory_id, set()).update(item_ids)
+            heapq.heappush(ReservationService.__expirations, (expires_at, telegram_id))
+            return True
+
+    @staticmethod
+    def select_free_items(entity, subcategory_id: int, quantity: int, held_item_ids: set[int]) -> Select:
+        """
+        The first quantity + len(held_item_ids) unsold items of the subcategory, enough to leave quantity
+        items after pick_free_items removed the held ones. The held ids are not bound into the SQL,
+        with several bulk holds they would add thousands of variables to the statement.
+        """
+        return (select(entity)
+                .where(Item.subcategory_id == subcategory_id, Item.is_sold == False)
+                .order_by(Item.id)
+                .limit(quantity + len(held_item_ids)))
+
+    @staticmethod
+    def pick_free_items(items: Sequence[Any], held_item_ids: set[int], quantity: int,
+                        get_item_id: Callable[[Any], int] = lambda item_id: item_id) -> list:
+        return [item for item in items if get_item_id(item) not in held_item_ids][:quantity]
+
+    @staticmethod
+    def get_reserved_item_ids(telegram_id: int, subcategory_id: int, quantity: int) -> list[int]:
+        """
+        Items held by the user for exactly this purchase, an empty list if there is no such hold.
+        """
+        ReservationService.sweep()
+        reservation = ReservationService.__reservations.get(telegram_id)
+        if reservation is None or reservation.subcategory_id != subcategory_id or len(
+                reservation.item_ids) != quantity:
+            return []
+        return list(reservation.item_ids)
+
+    @staticmethod
+    def get_confirmed_price(telegram_id: int, subcategory_id: int, quantity: int) -> Union[float, None]:
+        """
+        Unit price the user confirmed for exactly this purchase, None if the hold expired or was released.
+        """
+        ReservationService.sweep()
+        reservation = ReservationService.__reservations.get(telegram_id)
+        if reservation is None or reservation.subcategory_id != subcategory_id or len(
+                reservation.item_ids) != quantity:
+            return None
+        return reservation.price
+
+    @staticmethod
+    def get_held_item_ids(subcategory_id: int) -> set[int]:
+        ReservationService.sweep()
+        return set(ReservationService.__held_item_ids.get(subcategory_id, ()))
+
+    @staticmethod
+    def release(telegram_id: int):
+        reservation = ReservationService.__reservations.pop(telegram_id, None)
+        if reservation is None:
+            return
+        held_item_ids = ReservationService.__held_item_ids.get(reservation.subcategory_id)
+        held_item_ids.difference_update(reservation.item_ids)
+        if len(held_item_ids) == 0:
+            del ReservationService.__held_item_ids[reservation.subcategory_id]
+
+    @staticmethod
+    def sweep():
+        now = time.monotonic()
+        expirations = ReservationService.__expirations
+        while expirations and expirations[0][0] <= now:
+            expires_at, telegram_id = heapq.heappop(expirations)
+            reservation = ReservationService.__reservations.get(telegram_id)
+            if reservation is not None and reservation.expires_at == expires_at:
+                ReservationService.release(telegram_id)
+
+    @staticmethod
+    def clear():
+        """
+        Drops every hold and forgets the sweeper, the next reservation starts a new one on the running event loop.
+        """
+        if ReservationService.__sweeper is not None:
+            ReservationService.__sweeper.cancel()
+        ReservationService.__reservations.clear()
+        ReservationService.__held_item_ids.clear()
+        ReservationService.__expirations.clear()
+        ReservationService.__lock = None
+        ReservationService.__sweeper = None
+
+    @staticmethod
+    async def __run_sweeper():
+        while True:
+            await asyncio.sleep(ReservationService.sweep_interval)
+            try:
+                ReservationService.sweep()
+            except Exception as e:
+                logging.error(f"Reservation sweep failed: {e}")
@@ -1,10 +1,10 @@
-import math
-from sqlalchemy import select, func, delete, update
-import config
+from sqlalchemy import select, delete, update
 from db import session_commit, session_execute, session_refresh, get_db_session
 from models.item import Item
 from models.photo import Photo
 from models.subcategory import Subcategory
+from utils.catalog_snapshot import CatalogCache
+from utils.keyset_pagination import KeysetPaginator, KeysetPage, PageCursor
 
 
 class SubcategoryService:
@@ -22,6 +22,7 @@ class SubcategoryService:
                                                image_id=image_id)
                 session.add(new_category_obj)
                 await session_commit(session)
+                CatalogCache.invalidate()
                 await session_refresh(session, new_category_obj)
                 return new_category_obj
             else:
@@ -31,44 +32,16 @@ class SubcategoryService:
                                                                                               category_id=category_id)
                 await session_execute(stmt, session)
                 await session_commit(session)
+                CatalogCache.invalidate()
                 await session_refresh(session, subcategory)
                 return subcategory
 
     @staticmethod
-    async def get_to_delete(page: int = 0) -> list[Subcategory]:
+    async def get_to_delete(cursor: str = PageCursor.FIRST) -> KeysetPage:
         async with get_db_session() as session:
-            stmt = select(Subcategory).where(Subcategory.is_hidden == 0).distinct().limit(config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES).group_by(Subcategory.name)
-            subcategories = await session_execute(stmt, session=session)
-            subcategories = subcategories.scalars().all()
-            return subcategories
-
-    @staticmethod
-    async def get_maximum_page():
-        async with get_db_session() as session:
-            stmt = select(func.count(Subcategory.id)).distinct()
-            subcategories = await session_execute(stmt, session)
-            subcategories_count = subcategories.scalar_one()
-            if subcategories_count % config.PAGE_ENTRIES == 0:
-                return subcategories_count / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(subcategories_count / config.PAGE_ENTRIES)
-
-    @staticmethod
-    async def get_maximum_page_to_delete():
-        async with get_db_session() as session:
-            unique_categories_subquery = (
-                select(Subcategory.id)
-                .filter(Subcategory.is_hidden == 0)
-                .distinct()
-            ).alias('unique_categories')
-            stmt = select(func.count()).select_from(unique_categories_subquery)
-            max_page = await session_execute(stmt, session)
-            max_page = max_page.scalar_one()
-            if max_page % config.PAGE_ENTRIES == 0:
-                return max_page / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(max_page / config.PAGE_ENTRIES)
+            stmt = select(Subcategory).where(Subcategory.is_hidden == False).group_by(Subcategory.name)
+            return await KeysetPaginator.paginate(session, stmt, (Subcategory.name,), Subcategory.id, cursor,
+                                                  lambda subcategory: subcategory.id, scalars=True)
 
     @staticmethod
     async def get_by_primary_key(subcategory_id: int) -> Subcategory:
@@ -88,25 +61,15 @@ class SubcategoryService:
                 stmt = delete(Subcategory).where(Subcategory.id == subcategory_id)
                 await session_execute(stmt, session)
                 await session_commit(session)
+                CatalogCache.invalidate()
 
     @staticmethod
-    async def get_by_category_id(page: int, category_id: int):
+    async def get_by_category_id(cursor: str, category_id: int) -> KeysetPage:
         async with get_db_session() as session:
             stmt = select(Subcategory).where(Subcategory.is_hidden == False,
-                                             Subcategory.category_id == category_id).limit(config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES).group_by(
-                Subcategory.name)
-            subcategories = await session_execute(stmt, session)
-            return subcategories.scalars().all()
-
-    @staticmethod
-    async def get_all(page: int):
-        async with get_db_session() as session:
-            stmt = select(Subcategory).where(Subcategory.is_hidden == False).limit(config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES).group_by(
-                Subcategory.name)
-            subcategories = await session_execute(stmt, session)
-            return subcategories.scalars().all()
+                                             Subcategory.category_id == category_id).group_by(Subcategory.name)
+            return await KeysetPaginator.paginate(session, stmt, (Subcategory.name,), Subcategory.id, cursor,
+                                                  lambda subcategory: subcategory.id, scalars=True)
 
     @staticmethod
     async def get_price_by_subcategory(subcategory_id: int) -> float:
@@ -121,6 +84,7 @@ class SubcategoryService:
             stmt = update(Subcategory).where(Subcategory.id == subcategory_id).values(is_hidden=True)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def update(sucategory_id: int, values_dict: dict):
@@ -128,6 +92,7 @@ class SubcategoryService:
             stmt = update(Subcategory).where(Subcategory.id == sucategory_id).values(**values_dict)
             await session_execute(stmt, session)
             await session_commit(session)
+            CatalogCache.invalidate()
 
     @staticmethod
     async def get_photo(subcategory_id: int) -> Photo:
@@ -1,11 +1,15 @@
 import datetime
-import math
 from typing import Union
 from sqlalchemy import select, update, func, or_
+from sqlalchemy.dialects.sqlite import insert
 import config
-from db import session_execute, session_commit, get_db_session
+from db import session_execute, session_commit, get_db_session, get_scope_identity_map, run_in_immediate_transaction
 from models.user import User
+from services.balance import BalanceService, BalanceChange
 from utils.CryptoAddressGenerator import CryptoAddressGenerator
+from utils.counts_cache import CountsCache
+from utils.keyset_pagination import KeysetPaginator, KeysetPage
+from utils.known_users import KnownUsers
 from utils.localizator import Localizator, BotEntity
 
 
@@ -13,41 +17,125 @@ class UserService:
 
     @staticmethod
     async def is_exist(telegram_id: int) -> bool:
+        if KnownUsers.contains(telegram_id):
+            return True
+        return await UserService.__is_registered(telegram_id)
+
+    @staticmethod
+    async def __is_registered(telegram_id: int) -> bool:
         async with get_db_session() as session:
-            stmt = select(User).where(User.telegram_id == telegram_id)
+            stmt = select(User.id).where(User.telegram_id == telegram_id)
             is_exist = await session_execute(stmt, session)
-            return is_exist.scalar() is not None
+            is_exist = is_exist.scalar() is not None
+        if is_exist:
+            KnownUsers.add(telegram_id)
+        return is_exist
 
     @staticmethod
-    async def create(telegram_id: int, telegram_username: str):
+    async def load_known_users(batch_size: int = 10000):
         async with get_db_session() as session:
+            users_count = await session_execute(select(func.count(User.id)), session)
+            KnownUsers.reset(users_count.scalar())
+            last_user_id = 0
+            while True:
+                stmt = (select(User.id, User.telegram_id)
+                        .where(User.id > last_user_id)
+                        .order_by(User.id)
+                        .limit(batch_size))
+                users = await session_execute(stmt, session)
+                users = users.all()
+                for user in users:
+                    KnownUsers.add(user.telegram_id)
+                if len(users) < batch_size:
+                    return
+                last_user_id = users[-1].id
+
+    @staticmethod
+    async def register(telegram_id: int, telegram_username: Union[str, None],
+                       language: str = config.BOT_LANGUAGE) -> bool:
+        """
+        Registers the user on /start, returns True for new users.
+        Known users get their username updated and receive messages again, the row is only written if one of
+        these changed. Only new users get a wallet, it is inserted with an upsert in case the user was
+        registered concurrently.
+        """
+        # A bloom filter may know users that are not registered, its answer is checked.
+        if KnownUsers.contains(telegram_id) and config.KNOWN_USERS_BLOOM is False:
+            is_new = False
+        else:
+            is_new = await UserService.__is_registered(telegram_id) is False
+        is_changed = or_(User.telegram_username.is_distinct_from(telegram_username),
+                         User.can_receive_messages.is_not(True))
+        if is_new:
             crypto_addr_gen = CryptoAddressGenerator()
             ltc_addr = crypto_addr_gen.get_addresses()['ltc']
-            new_user = User(
-                telegram_username=telegram_username,
-                telegram_id=telegram_id,
-                seed=crypto_addr_gen.mnemonic_str,
-                ltc_address=ltc_addr
-            )
-            session.add(new_user)
+            stmt = (insert(User)
+                    .values(telegram_username=telegram_username,
+                            telegram_id=telegram_id,
+                            seed=crypto_addr_gen.mnemonic_str,
+                            ltc_address=ltc_addr,
+                            language=language,
+                            can_receive_messages=True)
+                    .on_conflict_do_update(index_elements=[User.telegram_id],
+                                           set_={"telegram_username": telegram_username,
+                                                 "can_receive_messages": True},
+                                           where=is_changed))
+        else:
+            stmt = (update(User)
+                    .where(User.telegram_id == telegram_id, is_changed)
+                    .values(telegram_username=telegram_username, can_receive_messages=True)
+                    .execution_options(synchronize_session=False))
+        async with get_db_session() as session:
+            # Committed even when no row changed, the UPDATE has taken the write lock either way.
+            await session_execute(stmt, session)
             await session_commit(session)
+        identity_map = get_scope_identity_map()
+        if identity_map is not None:
+            identity_map.pop((User, telegram_id), None)
+        if is_new:
+            KnownUsers.add(telegram_id)
+            CountsCache.invalidate(CountsCache.USERS)
+            Localizator.set_user_language(telegram_id, language)
+        return is_new
 
     @staticmethod
-    async def update_username(telegram_id: int, telegram_username: str):
+    async def get_language(telegram_id: int) -> Union[str, None]:
+        """
+        Returns None for unregistered users and the default language for users registered before
+        per-user languages were introduced.
+        """
         async with get_db_session() as session:
-            user_from_db = await UserService.get_by_tgid(telegram_id)
-            if user_from_db and user_from_db.telegram_username != telegram_username:
-                stmt = update(User).where(User.telegram_id == telegram_id).values(telegram_username=telegram_username)
-                await session_execute(stmt, session)
-                await session_commit(session)
+            stmt = select(User.language).where(User.telegram_id == telegram_id)
+            user_language = await session_execute(stmt, session)
+            user_language = user_language.first()
+            if user_language is None:
+                return None
+            return user_language.language or config.BOT_LANGUAGE
+
+    @staticmethod
+    async def update_language(telegram_id: int, language: str):
+        async with get_db_session() as session:
+            stmt = update(User).where(User.telegram_id == telegram_id).values(language=language)
+            await session_execute(stmt, session)
+            await session_commit(session)
+        Localizator.set_user_language(telegram_id, language)
 
     @staticmethod
     async def get_by_tgid(telegram_id: int) -> User:
+        """
+        Loads the user once per update, repeated calls return the same instance until a balance changing write.
+        """
+        identity_map = get_scope_identity_map()
+        if identity_map is not None and (User, telegram_id) in identity_map:
+            return identity_map[(User, telegram_id)]
         async with get_db_session() as session:
-            stmt = select(User).where(User.telegram_id == telegram_id)
+            # The update's session may still hold the row as it was before a write made by another session.
+            stmt = select(User).where(User.telegram_id == telegram_id).execution_options(populate_existing=True)
             user_from_db = await session_execute(stmt, session)
             user_from_db = user_from_db.scalar()
-            return user_from_db
+        if identity_map is not None and user_from_db is not None:
+            identity_map[(User, telegram_id)] = user_from_db
+        return user_from_db
 
     @staticmethod
     async def can_refresh_balance(telegram_id: int) -> bool:
@@ -71,32 +159,17 @@ class UserService:
             await session_commit(session)
 
     @staticmethod
-    async def update_top_up_amount(telegram_id: int, deposit_amount: float):
-        async with get_db_session() as session:
-            stmt = select(User.top_up_amount).where(User.telegram_id == telegram_id)
-            old_top_up_amount = await session_execute(stmt, session)
-            old_top_up_amount = old_top_up_amount.scalar()
-            stmt = update(User).where(User.telegram_id == telegram_id).values(
-                top_up_amount=round(old_top_up_amount + deposit_amount, 2))
-            await session_execute(stmt, session)
-            await session_commit(session)
+    async def update_top_up_amount(telegram_id: int, deposit_amount: float,
+                                   change: BalanceChange = BalanceChange.DEPOSIT) -> bool:
+        return await BalanceService.apply_by_tgid(telegram_id, change, round(deposit_amount, 2))
 
     @staticmethod
-    async def is_buy_possible(telegram_id, total_price):
-        user = await UserService.get_by_tgid(telegram_id)
-        balance = user.top_up_amount - user.consume_records
-        return balance >= total_price
-
-    @staticmethod
-    async def update_consume_records(telegram_id: int, total_price: float):
-        async with get_db_session() as session:
-            get_old_consume_records_stmt = select(User.consume_records).where(User.telegram_id == telegram_id)
-            old_consume_records = await session_execute(get_old_consume_records_stmt, session)
-            old_consume_records = old_consume_records.scalar()
-            stmt = update(User).where(User.telegram_id == telegram_id).values(
-                consume_records=old_consume_records + total_price)
-            await session_execute(stmt, session)
-            await session_commit(session)
+    async def debit_by_admin(telegram_id: int, amount: float) -> bool:
+        """
+        Takes the amount off the balance as an admin debit, returns False if the user's balance is lower.
+        Purchases are debited by CheckoutService.
+        """
+        return await BalanceService.apply_by_tgid(telegram_id, BalanceChange.ADMIN_DEBIT, amount, require_funds=True)
 
     @staticmethod
     async def get_users_tg_ids_for_sending():
@@ -108,49 +181,33 @@ class UserService:
 
     @staticmethod
     async def get_all_users_count():
-        async with get_db_session() as session:
-            stmt = func.count(User.id)
-            users_count = await session_execute(stmt, session)
-            return users_count.scalar()
+        async def count_users():
+            async with get_db_session() as session:
+                stmt = func.count(User.id)
+                users_count = await session_execute(stmt, session)
+                return users_count.scalar()
 
-    @staticmethod
-    async def reduce_consume_records(user_id: int, total_price):
-        async with get_db_session() as session:
-            stmt = select(User.consume_records).where(User.id == user_id)
-            old_consume_records = await session_execute(stmt, session)
-            old_consume_records = old_consume_records.scalar()
-            stmt = update(User).where(User.id == user_id).values(consume_records=old_consume_records - total_price)
-            await session_execute(stmt, session)
-            await session_commit(session)
+        return await CountsCache.get(CountsCache.USERS, None, count_users)
 
     @staticmethod
-    async def get_new_users_by_timedelta(timedelta_int, page):
+    async def get_new_users_by_timedelta(timedelta_int, cursor: str) -> tuple[KeysetPage, int]:
         async with get_db_session() as session:
             current_time = datetime.datetime.now()
             one_day_interval = datetime.timedelta(days=int(timedelta_int))
             time_to_subtract = current_time - one_day_interval
-            stmt = select(User).where(User.registered_at >= time_to_subtract, User.telegram_username != None).limit(
-                config.PAGE_ENTRIES).offset(
-                page * config.PAGE_ENTRIES)
-            count_stmt = select(func.count(User.id)).where(User.registered_at >= time_to_subtract)
-            users = await session_execute(stmt, session)
-            users_count = await session_execute(count_stmt, session)
-            return users.scalars().all(), users_count.scalar_one()
+            stmt = select(User).where(User.registered_at >= time_to_subtract, User.telegram_username != None)
+            users = await KeysetPaginator.paginate(session, stmt, (User.id,), User.id, cursor, lambda user: user.id,
+                                                   scalars=True)
 
-    @staticmethod
-    async def get_max_page_for_users_by_timedelta(timedelta_int):
-        async with get_db_session() as session:
-            current_time = datetime.datetime.now()
-            one_day_interval = datetime.timedelta(days=int(timedelta_int))
-            time_to_subtract = current_time - one_day_interval
-            stmt = select(func.count(User.id)).where(User.registered_at >= time_to_subtract,
-                                                     User.telegram_username != None)
-            users = await session_execute(stmt, session)
-            users = users.scalar_one()
-            if users % config.PAGE_ENTRIES == 0:
-                return users / config.PAGE_ENTRIES - 1
-            else:
-                return math.trunc(users / config.PAGE_ENTRIES)
+            async def count_new_users():
+                count_stmt = select(func.count(User.id)).where(User.registered_at >= time_to_subtract)
+                users_count = await session_execute(count_stmt, session)
+                return users_count.scalar_one()
+
+            # Flipping through the pages of the list reuses the count computed for its first page.
+            users_count = await CountsCache.get(CountsCache.USERS, ("registered_within_days", int(timedelta_int)),
+                                                count_new_users)
+            return users, users_count
 
     @staticmethod
     async def update_receive_messages(telegram_id, new_value):
@@ -183,36 +240,28 @@ class UserService:
         if user is None:
             return Localizator.get_text(BotEntity.ADMIN, "credit_management_user_not_found")
         elif operation == "plus":
-            await UserService.update_top_up_amount(user.telegram_id, float(balance_value))
-            return Localizator.get_text(BotEntity.ADMIN, "credit_management_added_success").format(
-                amount=balance_value,
-                telegram_id=user.telegram_id,
-                currency_text=Localizator.get_currency_text())
-        elif operation == "minus":
-            await UserService.update_consume_records(user.telegram_id, float(balance_value))
-            return Localizator.get_text(BotEntity.ADMIN, "credit_management_reduced_success").format(
-                amount=balance_value,
-                telegram_id=user.telegram_id,
-                currency_text=Localizator.get_currency_text())
+            is_applied = await UserService.update_top_up_amount(user.telegram_id, float(balance_value),
+                                                                BalanceChange.ADMIN_CREDIT)
+            success_key = "credit_management_added_success"
+        else:
+            is_applied = await UserService.debit_by_admin(user.telegram_id, float(balance_value))
+            success_key = "credit_management_reduced_success"
+        if is_applied is False:
+            return Localizator.get_text(BotEntity.ADMIN, "credit_management_failed").format(
+                telegram_id=user.telegram_id)
+        return Localizator.get_text(BotEntity.ADMIN, success_key).format(
+            amount=balance_value,
+            telegram_id=user.telegram_id,
+            currency_text=Localizator.get_currency_text())
 
     @staticmethod
     async def update_crypto_balances(telegram_id: int, new_crypto_balances: dict):
-        async with get_db_session() as session:
-            get_old_values_stmt = select(User).where(User.telegram_id == telegram_id)
-            result = await session.execute(get_old_values_stmt)
-            user = result.scalar()
-            balance_fields_map = {
-                "ltc_deposit": "ltc_balance",
-            }
-            update_values = {}
-
-            for key, value in new_crypto_balances.items():
-                if key in balance_fields_map:
-                    field_name = balance_fields_map[key]
-                    current_balance = getattr(user, field_name)
-                    update_values[field_name] = current_balance + value
-
-            if update_values:
-                stmt = update(User).where(User.telegram_id == telegram_id).values(**update_values)
-                await session_execute(stmt, session)
-                await session_commit(session)
+        balance_fields_map = {
+            "ltc_deposit": User.ltc_balance,
+        }
+        # Added by the database, concurrent balance refreshes can not overwrite each other's deposits.
+        update_values = {balance_fields_map[key]: func.coalesce(balance_fields_map[key], 0) + value
+                         for key, value in new_crypto_balances.items() if key in balance_fields_map}
+        if update_values:
+            stmt = update(User).where(User.telegram_id == telegram_id).values(update_values)
+            await run_in_immediate_transaction(lambda session: session.execute(stmt))
@@ -0,0 +1,110 @@
+"""
+The bot's modules read their configuration on import. This sets a test configuration and moves into a scratch
+folder, which holds the test database, before any test module imports them.
+Run with DB_ENCRYPTION=true to test against sqlcipher (DB_ENCRYPTION_OFFLOAD=false for the blocking mode).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+
+repository_folder = Path(__file__).resolve().parent.parent
+test_environment = {
+    "WEBHOOK_PATH": "/webhook",
+    "WEBAPP_HOST": "localhost",
+    "WEBAPP_PORT": "5000",
+    "TOKEN": "123456:test",
+    "ADMIN_ID_LIST": "1",
+    "SUPPORT_LINK": "https://t.me/support",
+    "DB_NAME": "tests.db",
+    "DB_PASS": "tests",
+    "PAGE_ENTRIES": "8",
+    "BOT_LANGUAGE": "en",
+    "CURRENCY": "USD"
+}
+for name, value in test_environment.items():
+    os.environ.setdefault(name, value)
+# config.py opens a tunnel on import, the tests never receive webhooks.
+ngrok_executor = types.ModuleType("ngrok_executor")
+ngrok_executor.start_ngrok = lambda: "https://localhost"
+sys.modules["ngrok_executor"] = ngrok_executor
+sys.path.insert(0, str(repository_folder))
+working_folder = Path(tempfile.mkdtemp(prefix="aiogramshopbot_tests_"))
+(working_folder / "l10n").symlink_to(repository_folder / "l10n")
+os.chdir(working_folder)
+
+import config
+import db
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from services.reservation import ReservationService
+from utils.catalog_snapshot import CatalogCache
+from utils.counts_cache import CountsCache
+
+
+async def upgrade_database():
+    if isinstance(db.engine, AsyncEngine):
+        async with db.engine.connect() as connection:
+            await connection.run_sync(db.upgrade_database)
+    else:
+        await db.run_sync_db(db.upgrade_database_sync)
+
+
+@pytest.fixture
+def database():
+    """
+    An empty database with the current schema, every test gets a new one.
+    """
+    if not isinstance(db.engine, AsyncEngine):
+        # Pooled sqlcipher connections would keep the previous test's database file open.
+        db.engine.dispose()
+    for path in Path("data").glob(f"{config.DB_NAME}*"):
+        path.unlink()
+    # Tests run their own event loops, asyncio primitives created by an earlier test must not be reused.
+    db.immediate_transaction_lock = None
+    ReservationService.clear()
+    CatalogCache.invalidate()
+    CountsCache.invalidate(CountsCache.USERS)
+    asyncio.run(upgrade_database())
+    yield
+    ReservationService.clear()
+    CatalogCache.invalidate()
+
+
+async def seed_catalog(subcategories: int = 1, items_per_subcategory: int = 10, price: float = 1.0):
+    """
+    One category with subcategories 1..subcategories, each with items_per_subcategory unsold items.
+    """
+    async with db.get_db_session() as session:
+        await db.session_execute(text("INSERT INTO photos (id, sha256, size) VALUES (1, 'sha256', 0)"), session)
+        await db.session_execute(text("INSERT INTO categories (id, name, description, image_id, is_hidden) "
+                                      "VALUES (1, 'category', 'description', 1, 0)"), session)
+        for subcategory_id in range(1, subcategories + 1):
+            await db.session_execute(text(f"INSERT INTO subcategories (id, name, price, is_hidden, category_id, "
+                                          f"image_id) VALUES ({subcategory_id}, 'subcategory {subcategory_id}', "
+                                          f"{price}, 0, 1, 1)"), session)
+            await db.session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+                                          f"WHERE i < {items_per_subcategory}) "
+                                          f"INSERT INTO items (subcategory_id, private_data, is_sold, is_new) "
+                                          f"SELECT {subcategory_id}, 'data ' || i, 0, 1 FROM n"), session)
+        await db.session_commit(session)
+
+
+async def seed_users(users: int, balance: float):
+    """
+    Users with ids and telegram_ids 1..users, each with the balance and a matching ledger entry.
+    """
+    async with db.get_db_session() as session:
+        await db.session_execute(text(f"WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+                                      f"WHERE i < {users}) "
+                                      f"INSERT INTO users (id, telegram_id, telegram_username, ltc_address, seed, "
+                                      f"top_up_amount, consume_records, balance) "
+                                      f"SELECT i, i, 'user' || i, 'address' || i, 'seed' || i, {balance}, 0, "
+                                      f"{balance} FROM n"), session)
+        await db.session_execute(text(f"INSERT INTO balance_ledger (user_id, change, amount) "
+                                      f"SELECT id, 'deposit', balance FROM users"), session)
+        await db.session_commit(session)
@@ -0,0 +1,67 @@
+"""
+Balance changes made by admins and balance refreshes: a change that is not applied must be reported, and
+concurrent changes must not overwrite each other.
+"""
+import asyncio
+
+from sqlalchemy import text
+
+import db
+from conftest import seed_users
+from services.balance import BalanceService
+from services.user import UserService
+from utils.localizator import Localizator, BotEntity
+
+
+async def query(sql: str) -> list:
+    async with db.get_db_session() as session:
+        rows = await db.session_execute(text(sql), session)
+        return rows.all()
+
+
+def test_admin_debit_above_the_balance_is_reported(database):
+    async def run():
+        await seed_users(1, 5.0)
+        message = await UserService.balance_management({"operation": "minus", "user_entity": "user1",
+                                                        "balance_value": "7.5"})
+        assert message == Localizator.get_text(BotEntity.ADMIN, "credit_management_failed").format(telegram_id=1)
+        assert await query("SELECT balance, consume_records FROM users") == [(5.0, 0.0)]
+        assert await query("SELECT count(*) FROM balance_ledger WHERE change = 'admin_debit'") == [(0,)]
+
+    asyncio.run(run())
+
+
+def test_admin_credit_and_debit_are_applied(database):
+    async def run():
+        await seed_users(1, 5.0)
+        message = await UserService.balance_management({"operation": "plus", "user_entity": "1",
+                                                        "balance_value": "2.5"})
+        assert message.startswith("✅")
+        message = await UserService.balance_management({"operation": "minus", "user_entity": "user1",
+                                                        "balance_value": "7.5"})
+        assert message.startswith("✅")
+        assert await query("SELECT balance, top_up_amount, consume_records FROM users") == [(0.0, 7.5, 7.5)]
+        assert await query("SELECT change, amount FROM balance_ledger WHERE change LIKE 'admin%' ORDER BY id") == [
+            ("admin_credit", 2.5), ("admin_debit", -7.5)]
+        assert await BalanceService.reconcile() == []
+
+    asyncio.run(run())
+
+
+def test_balance_change_of_an_unknown_user_is_not_applied(database):
+    async def run():
+        await seed_users(1, 5.0)
+        assert await UserService.update_top_up_amount(2, 1.0) is False
+        assert await UserService.debit_by_admin(2, 1.0) is False
+        assert await query("SELECT count(*) FROM balance_ledger") == [(1,)]
+
+    asyncio.run(run())
+
+
+def test_concurrent_crypto_deposits_are_all_added(database):
+    async def run():
+        await seed_users(1, 0.0)
+        await asyncio.gather(*[UserService.update_crypto_balances(1, {"ltc_deposit": 0.5}) for _ in range(20)])
+        assert await query("SELECT ltc_balance FROM users") == [(10.0,)]
+
+    asyncio.run(run())
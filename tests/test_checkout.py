@@ -0,0 +1,88 @@
+"""
+Concurrency stress tests of CheckoutService.checkout: parallel buyers must never get more items than are in stock,
+the same item twice, or a negative balance.
+"""
+import asyncio
+from collections import Counter
+
+from sqlalchemy import text
+
+import db
+from conftest import seed_catalog, seed_users
+from services.balance import BalanceService
+from services.checkout import CheckoutService, CheckoutStatus
+
+
+async def query(sql: str) -> list:
+    async with db.get_db_session() as session:
+        rows = await db.session_execute(text(sql), session)
+        return rows.all()
+
+
+async def checkout_in_parallel(purchases: list[tuple[int, int]]) -> Counter:
+    """
+    Runs the (telegram_id, quantity) checkouts of subcategory 1 concurrently, counts the result statuses.
+    """
+    results = await asyncio.gather(*[CheckoutService.checkout(telegram_id, 1, quantity)
+                                     for telegram_id, quantity in purchases])
+    return Counter(result.status for result in results)
+
+
+def test_parallel_buyers_do_not_oversell(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=50, price=1.0)
+        await seed_users(100, 10.0)
+        statuses = await checkout_in_parallel([(telegram_id, 1) for telegram_id in range(1, 101)])
+        assert statuses == {CheckoutStatus.COMPLETED: 50, CheckoutStatus.OUT_OF_STOCK: 50}
+        assert await query("SELECT count(*) FROM items WHERE is_sold = 1") == [(50,)]
+        assert await query("SELECT count(*), count(DISTINCT item_id) FROM buyItem") == [(50, 50)]
+        assert await query("SELECT count(*), sum(quantity) FROM buys") == [(50, 50)]
+        assert await query("SELECT sum(balance) FROM users") == [(950.0,)]
+        assert await BalanceService.reconcile() == []
+
+    asyncio.run(run())
+
+
+def test_parallel_orders_of_several_items_do_not_oversell(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=100, price=1.0)
+        await seed_users(100, 10.0)
+        statuses = await checkout_in_parallel([(telegram_id, 3) for telegram_id in range(1, 101)])
+        # 33 orders of 3 items fit into the stock, the one item left is not enough for another order.
+        assert statuses == {CheckoutStatus.COMPLETED: 33, CheckoutStatus.OUT_OF_STOCK: 67}
+        assert await query("SELECT count(*) FROM items WHERE is_sold = 1") == [(99,)]
+        assert await query("SELECT count(*), count(DISTINCT item_id) FROM buyItem") == [(99, 99)]
+        assert await BalanceService.reconcile() == []
+
+    asyncio.run(run())
+
+
+def test_parallel_checkouts_of_one_user_do_not_overdraw(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=1000, price=1.0)
+        await seed_users(10, 3.0)
+        statuses = await checkout_in_parallel([(telegram_id, 1) for telegram_id in range(1, 11) for _ in range(10)])
+        assert statuses == {CheckoutStatus.COMPLETED: 30, CheckoutStatus.INSUFFICIENT_FUNDS: 70}
+        assert await query("SELECT min(balance), max(balance) FROM users") == [(0.0, 0.0)]
+        assert await query("SELECT count(*) FROM items WHERE is_sold = 1") == [(30,)]
+        assert await BalanceService.reconcile() == []
+
+    asyncio.run(run())
+
+
+def test_checkout_rejects_a_changed_price(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=10, price=1.0)
+        await seed_users(1, 10.0)
+        async with db.get_db_session() as session:
+            await db.session_execute(text("UPDATE subcategories SET price = 2.0 WHERE id = 1"), session)
+            await db.session_commit(session)
+        result = await CheckoutService.checkout(1, 1, 1, confirmed_price=1.0)
+        assert result.status == CheckoutStatus.PRICE_CHANGED
+        assert await query("SELECT count(*) FROM items WHERE is_sold = 1") == [(0,)]
+        assert await query("SELECT balance FROM users") == [(10.0,)]
+        result = await CheckoutService.checkout(1, 1, 1, confirmed_price=2.0)
+        assert result.status == CheckoutStatus.COMPLETED
+        assert result.total_price == 2.0
+
+    asyncio.run(run())
@@ -0,0 +1,132 @@
+"""
+Round trips of CompactCallbackData through the CallbackStateTable and through the binary encoded payload,
+and the rejection of expired and malformed callback data.
+"""
+import base64
+from typing import Union
+
+import pytest
+from aiogram.filters.callback_data import MAX_CALLBACK_LENGTH
+
+from utils.compact_callback import CompactCallbackData, CallbackStateTable
+
+
+class ExampleCallback(CompactCallbackData, prefix="example"):
+    level: int
+    confirmation: bool
+    name: str
+    price: float
+    argument: Union[str, int]
+
+
+class OtherCallback(CompactCallbackData, prefix="other"):
+    level: int
+
+
+examples = [
+    ExampleCallback(level=0, confirmation=False, name="", price=0.0, argument=""),
+    ExampleCallback(level=-1, confirmation=True, name="name", price=19.99, argument=-1),
+    ExampleCallback(level=-(2 ** 40), confirmation=False, name="ünïcödé", price=-0.5, argument="12"),
+    ExampleCallback(level=2 ** 40, confirmation=True, name="a" * 20, price=1e-07, argument=2 ** 20),
+]
+
+
+@pytest.fixture
+def evicted(monkeypatch):
+    """
+    Keeps no states in the table, like a bot restarted after the buttons were sent.
+    """
+    monkeypatch.setattr(CallbackStateTable, "max_entries", 0)
+
+
+def encode(data: bytes) -> str:
+    return "example:" + base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+@pytest.mark.parametrize("callback", examples)
+def test_round_trip_through_the_state_table(callback):
+    callback_data = callback.pack()
+    assert len(callback_data.encode()) <= MAX_CALLBACK_LENGTH
+    assert ExampleCallback.unpack(callback_data) is callback
+
+
+@pytest.mark.parametrize("callback", examples)
+def test_evicted_state_is_decoded_from_the_payload(callback, evicted):
+    unpacked = ExampleCallback.unpack(callback.pack())
+    assert unpacked is not callback
+    assert unpacked == callback
+    assert type(unpacked.argument) is type(callback.argument)
+
+
+def test_union_field_keeps_its_type(evicted):
+    as_int = ExampleCallback(level=1, confirmation=False, name="", price=1.0, argument=5)
+    as_str = as_int.model_copy(update={"argument": "5"})
+    assert as_int.pack() != as_str.pack()
+    assert ExampleCallback.unpack(as_int.pack()).argument == 5
+    assert ExampleCallback.unpack(as_str.pack()).argument == "5"
+
+
+def test_oversized_state_is_kept_behind_a_token():
+    callback = ExampleCallback(level=1, confirmation=False, name="a" * 200, price=1.0, argument="")
+    callback_data = callback.pack()
+    assert callback_data.startswith("example:~")
+    assert len(callback_data.encode()) <= MAX_CALLBACK_LENGTH
+    assert ExampleCallback.unpack(callback_data) is callback
+
+
+def test_tokens_do_not_repeat_across_restarts():
+    # A restarted bot counts its tokens from 1 again, the per-process nonce makes them differ anyway.
+    callback = ExampleCallback(level=1, confirmation=False, name="a" * 200, price=1.0, argument="")
+    callback_data = callback.pack()
+    assert callback_data not in (f"example:~{token:x}" for token in range(1, 1000))
+    with pytest.raises(ValueError):
+        ExampleCallback.unpack("example:~1")
+
+
+def test_expired_token_is_rejected(monkeypatch):
+    monkeypatch.setattr(CallbackStateTable, "ttl", -1)
+    callback = ExampleCallback(level=1, confirmation=False, name="a" * 200, price=1.0, argument="")
+    with pytest.raises(ValueError, match="expired"):
+        ExampleCallback.unpack(callback.pack())
+
+
+def test_expired_state_is_decoded_from_the_payload(monkeypatch):
+    monkeypatch.setattr(CallbackStateTable, "ttl", -1)
+    callback = examples[1]
+    unpacked = ExampleCallback.unpack(callback.pack())
+    assert unpacked is not callback
+    assert unpacked == callback
+
+
+def test_state_of_another_class_is_not_returned():
+    callback_data = OtherCallback(level=1).pack()
+    with pytest.raises(ValueError, match="prefix"):
+        ExampleCallback.unpack(callback_data)
+
+
+def test_hand_encoded_payload_is_decoded(evicted):
+    # The malformed payloads below are derived from this one: level=1, confirmation=False, name="", price=1.0
+    # and an empty str argument behind its type tag.
+    unpacked = ExampleCallback.unpack(encode(bytes([2, 0, 0, 3]) + b"1.0" + bytes([2, 0])))
+    assert unpacked == ExampleCallback(level=1, confirmation=False, name="", price=1.0, argument="")
+
+
+@pytest.mark.parametrize("callback_data", [
+    "example",
+    "example:",
+    "example:!!!",
+    "other:AAAA",
+    # Truncated: the string length says 4 bytes, 1 follows.
+    encode(bytes([2, 0, 4]) + b"n"),
+    # Bytes after the last field.
+    encode(bytes([2, 0, 0, 3]) + b"1.0" + bytes([2, 0, 7])),
+    # Unknown type tag of the Union field.
+    encode(bytes([2, 0, 0, 3]) + b"1.0" + bytes([9])),
+    # Invalid UTF-8 in a string.
+    encode(bytes([2, 0, 1, 0xff, 3]) + b"1.0" + bytes([0, 0])),
+    # Float field that is no number.
+    encode(bytes([2, 0, 0, 3]) + b"abc" + bytes([0, 0])),
+])
+def test_malformed_payload_is_rejected(callback_data, evicted):
+    with pytest.raises(ValueError):
+        ExampleCallback.unpack(callback_data)
@@ -0,0 +1,95 @@
+"""
+The session shared by one update: its reads share one snapshot, writes end it and release the write lock
+before the handler goes on, and a failing service call rolls back.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+import config
+import db
+from conftest import seed_catalog, seed_users
+from services.checkout import CheckoutService, CheckoutStatus
+from services.user import UserService
+
+pytestmark = pytest.mark.skipif(config.DB_JOURNAL_MODE.upper() != "WAL",
+                                reason="read snapshots are only kept with WAL")
+
+
+async def query(sql: str):
+    async with db.get_db_session() as session:
+        rows = await db.session_execute(text(sql), session)
+        return rows.scalar()
+
+
+async def execute_elsewhere(sql: str):
+    """
+    Runs and commits the statement on a session of its own, like a concurrently processed update.
+    """
+
+    async def execute():
+        async with db.get_db_session() as session:
+            await db.session_execute(text(sql), session)
+            await db.session_commit(session)
+
+    # Tasks spawned during an update do not share its session.
+    await asyncio.create_task(execute())
+
+
+def test_reads_of_an_update_share_a_snapshot(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=10)
+        async with db.db_session_scope():
+            assert await query("SELECT count(*) FROM items") == 10
+            await execute_elsewhere("DELETE FROM items WHERE id <= 5")
+            assert await query("SELECT count(*) FROM items") == 10
+        async with db.db_session_scope():
+            assert await query("SELECT count(*) FROM items") == 5
+
+    asyncio.run(run())
+
+
+def test_write_after_a_concurrent_commit_succeeds_and_releases_the_lock(database):
+    async def run():
+        await seed_users(2, 1.0)
+        async with db.db_session_scope():
+            assert await query("SELECT count(*) FROM users") == 2
+            await execute_elsewhere("UPDATE users SET balance = 2.0 WHERE id = 2")
+            # The read transaction predates the commit above, the write must not be made inside it.
+            await UserService.update_receive_messages(1, False)
+            assert await query("SELECT balance FROM users WHERE id = 2") == 2.0
+            # Another connection gets the write lock while the update is still being processed.
+            await asyncio.wait_for(execute_elsewhere("UPDATE users SET balance = 3.0 WHERE id = 2"), 1)
+        async with db.db_session_scope():
+            assert await query("SELECT can_receive_messages FROM users WHERE id = 1") == 0
+
+    asyncio.run(run())
+
+
+def test_reads_after_an_immediate_transaction_see_its_write(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=10, price=1.0)
+        await seed_users(1, 10.0)
+        async with db.db_session_scope():
+            assert (await UserService.get_by_tgid(1)).balance == 10.0
+            result = await CheckoutService.checkout(1, 1, 3)
+            assert result.status == CheckoutStatus.COMPLETED
+            assert (await UserService.get_by_tgid(1)).balance == 7.0
+            assert await query("SELECT count(*) FROM items WHERE is_sold = 1") == 3
+
+    asyncio.run(run())
+
+
+def test_failing_service_call_rolls_back(database):
+    async def run():
+        await seed_users(1, 1.0)
+        async with db.db_session_scope():
+            with pytest.raises(RuntimeError):
+                async with db.get_db_session() as session:
+                    await db.session_execute(text("UPDATE users SET balance = 5.0"), session)
+                    raise RuntimeError()
+            assert await query("SELECT balance FROM users") == 1.0
+            await asyncio.wait_for(execute_elsewhere("UPDATE users SET balance = 2.0"), 1)
+
+    asyncio.run(run())
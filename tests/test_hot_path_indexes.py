@@ -0,0 +1,96 @@
+"""
+The hot queries must keep using their indexes. The SQL the services actually send is captured
+and its EXPLAIN QUERY PLAN is checked on an in-memory database, both for a database created with
+the current schema and for an old database brought up to date by the migrations.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import db
+from conftest import seed_catalog, seed_users
+from services.buy import BuyService
+from services.checkout import CheckoutService
+from services.deposit import DepositService
+from services.item import ItemService
+from services.user import UserService
+from utils.catalog_snapshot import CatalogCache
+from utils.keyset_pagination import PageCursor
+
+hot_path_indexes = ["ix_items_unsold_subcategory_id", "ix_buys_buyer_id", "ix_buys_is_refunded",
+                    "ix_buyItem_buy_id", "ix_deposits_user_id", "ix_users_registered_at"]
+
+# (index, service call whose queries must use it)
+hot_queries = [
+    ("ix_items_unsold_subcategory_id", lambda: CatalogCache.get()),
+    ("ix_items_unsold_subcategory_id", lambda: ItemService.get_unsold_subcategories_by_category(1, PageCursor.FIRST)),
+    ("ix_items_unsold_subcategory_id", lambda: CheckoutService.checkout(1, 1, 1)),
+    ("ix_buys_buyer_id", lambda: BuyService.get_buys_by_buyer_id(1, PageCursor.FIRST)),
+    ("ix_buys_is_refunded", lambda: BuyService.get_not_refunded_buy_ids(PageCursor.FIRST)),
+    ("ix_buyItem_buy_id", lambda: ItemService.get_bought_data_size(1)),
+    ("ix_deposits_user_id", lambda: DepositService.get_by_user_id(1)),
+    ("ix_users_registered_at", lambda: UserService.get_new_users_by_timedelta(1, PageCursor.FIRST)),
+]
+
+
+def create_current_schema(connection):
+    db.upgrade_schema(connection)
+
+
+def create_migrated_schema(connection):
+    # A database of a version before the indexes: the tables without them, at schema version 0.
+    db.Base.metadata.create_all(connection)
+    for index in hot_path_indexes:
+        connection.execute(text(f'DROP INDEX "{index}"'))
+    connection.execute(text("PRAGMA user_version = 0"))
+    db.upgrade_schema(connection)
+
+
+@pytest.fixture(params=[create_current_schema, create_migrated_schema], ids=["current", "migrated"])
+def schema(request):
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        request.param(connection)
+    yield engine
+    engine.dispose()
+
+
+def capture_statements(call) -> list[tuple[str, tuple]]:
+    statements = []
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    sync_engine = db.engine.sync_engine if isinstance(db.engine, AsyncEngine) else db.engine
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        asyncio.run(call())
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def test_migrations_add_hot_path_indexes(schema):
+    with schema.connect() as connection:
+        indexes = dict(connection.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'index'")).all())
+    for index in hot_path_indexes:
+        assert index in indexes
+    assert indexes["ix_items_unsold_subcategory_id"].endswith("WHERE is_sold = 0")
+
+
+@pytest.mark.parametrize("index, call", hot_queries, ids=[f"{index}-{number}"
+                                                          for number, (index, _) in enumerate(hot_queries)])
+def test_hot_query_uses_index(database, schema, index, call):
+    asyncio.run(seed_catalog())
+    asyncio.run(seed_users(1, 100.0))
+    statements = capture_statements(call)
+    assert statements
+    plans = []
+    with schema.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plans.append(" | ".join(row[-1] for row in plan))
+    assert any(f"INDEX {index}" in plan for plan in plans), "\n".join(plans)
@@ -0,0 +1,108 @@
+"""
+KeysetPaginator over the database and over in-memory lists: the pages every cursor leads to,
+the flags of the first and the last page, and cursors of entries that were deleted since.
+The tests run with PAGE_ENTRIES = 8.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import select, delete
+
+import config
+import db
+from conftest import seed_users
+from models.balanceLedger import BalanceLedgerEntry
+from models.user import User
+from utils.keyset_pagination import KeysetPaginator, PageCursor
+
+
+async def paginate(cursor: str):
+    async with db.get_db_session() as session:
+        return await KeysetPaginator.paginate(session, select(User.id), (User.id,), User.id, cursor,
+                                              lambda row: row.id)
+
+
+def paginate_sorted(ids: list[int], cursor: str):
+    return KeysetPaginator.paginate_sorted(ids, cursor, lambda key: key, lambda key: key,
+                                           lambda key: key if key in ids else None)
+
+
+def describe(page) -> tuple[list[int], bool, bool]:
+    return [entry if isinstance(entry, int) else entry.id for entry in page.entries], page.has_previous, page.has_next
+
+
+@pytest.mark.parametrize("cursor, parsed", [
+    ("", (True, None)),
+    ("z", (False, None)),
+    ("a12", (True, 12)),
+    ("b12", (False, 12)),
+    ("a", (True, None)),
+    ("ax", (True, None)),
+    ("c12", (True, None)),
+])
+def test_cursor_parsing(cursor, parsed):
+    assert PageCursor.parse(cursor) == parsed
+
+
+# cursor -> (ids on the page, has_previous, has_next) of a list with the ids 1..20
+pages_of_20 = {
+    PageCursor.FIRST: (list(range(1, 9)), False, True),
+    PageCursor.after(8): (list(range(9, 17)), True, True),
+    PageCursor.after(16): (list(range(17, 21)), True, False),
+    PageCursor.LAST: (list(range(13, 21)), True, False),
+    PageCursor.before(13): (list(range(5, 13)), True, True),
+    # Fewer than a page before the cursor: a full first page instead.
+    PageCursor.before(5): (list(range(1, 9)), False, True),
+    # Nothing after the cursor: the last page.
+    PageCursor.after(20): (list(range(13, 21)), True, False),
+    PageCursor.before(9): (list(range(1, 9)), False, True),
+    PageCursor.after(12): (list(range(13, 21)), True, False),
+}
+
+
+@pytest.mark.parametrize("cursor", pages_of_20)
+def test_pages_of_the_database(database, cursor):
+    async def run():
+        await seed_users(20, 0.0)
+        assert describe(await paginate(cursor)) == pages_of_20[cursor]
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("cursor", pages_of_20)
+def test_pages_of_a_sorted_list(cursor):
+    assert describe(paginate_sorted(list(range(1, 21)), cursor)) == pages_of_20[cursor]
+
+
+@pytest.mark.parametrize("entries", [0, 1, config.PAGE_ENTRIES, config.PAGE_ENTRIES + 1, 2 * config.PAGE_ENTRIES])
+def test_page_boundaries(database, entries):
+    async def run():
+        if entries > 0:
+            await seed_users(entries, 0.0)
+        ids = list(range(1, entries + 1))
+        first_page = await paginate(PageCursor.FIRST)
+        assert describe(first_page) == (ids[:config.PAGE_ENTRIES], False, entries > config.PAGE_ENTRIES)
+        assert describe(await paginate(PageCursor.LAST)) == (ids[-config.PAGE_ENTRIES:], entries > config.PAGE_ENTRIES,
+                                                             False)
+        if first_page.has_next:
+            next_page = await paginate(PageCursor.after(first_page.last_key))
+            assert describe(next_page) == (ids[config.PAGE_ENTRIES:2 * config.PAGE_ENTRIES], True,
+                                           entries > 2 * config.PAGE_ENTRIES)
+            assert describe(await paginate(PageCursor.before(next_page.first_key))) == describe(first_page)
+        for cursor in (PageCursor.FIRST, PageCursor.LAST, PageCursor.after(1), PageCursor.before(entries)):
+            assert describe(await paginate(cursor)) == describe(paginate_sorted(ids, cursor))
+
+    asyncio.run(run())
+
+
+def test_cursor_of_a_deleted_entry_leads_to_the_first_page(database):
+    async def run():
+        await seed_users(20, 0.0)
+        async with db.get_db_session() as session:
+            await db.session_execute(delete(BalanceLedgerEntry).where(BalanceLedgerEntry.user_id == 8), session)
+            await db.session_execute(delete(User).where(User.id == 8), session)
+            await db.session_commit(session)
+        assert describe(await paginate(PageCursor.after(8))) == ([1, 2, 3, 4, 5, 6, 7, 9], False, True)
+        assert describe(await paginate(PageCursor.before(8))) == ([1, 2, 3, 4, 5, 6, 7, 9], False, True)
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+"""
+Tests of KnownUsers and its BloomFilter: registered users are answered from memory, unknown ones and bloom filter
+answers for registration are checked against the database.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+import config
+import db
+from conftest import seed_users
+from services.user import UserService
+from utils.known_users import BloomFilter, KnownUsers
+
+
+async def query(sql: str) -> list:
+    async with db.get_db_session() as session:
+        rows = await db.session_execute(text(sql), session)
+        return rows.all()
+
+
+@pytest.fixture(params=[False, True], ids=["set", "bloom"])
+def known_users(request, monkeypatch):
+    monkeypatch.setattr(config, "KNOWN_USERS_BLOOM", request.param)
+    KnownUsers.reset(0)
+    yield request.param
+    monkeypatch.undo()
+    KnownUsers.reset(0)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = BloomFilter(10000, 0.01)
+    for value in range(10000):
+        bloom_filter.add(value * 7919)
+    assert all(value * 7919 in bloom_filter for value in range(10000))
+    assert bloom_filter.size == 10000
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom_filter = BloomFilter(10000, 0.01)
+    for value in range(10000):
+        bloom_filter.add(value)
+    false_positives = sum(value in bloom_filter for value in range(10000, 110000))
+    # About 1000 are expected, a broken hash gives far more.
+    assert 0 < false_positives < 1500
+
+
+def test_bloom_filter_sizing():
+    bloom_filter = BloomFilter(1000000, 1e-6)
+    assert 28 <= bloom_filter.bits_count / bloom_filter.capacity <= 29
+    assert bloom_filter.hashes_count == 20
+    assert len(bloom_filter.bits) == (bloom_filter.bits_count + 7) // 8
+
+
+def test_known_users_add_and_contains(known_users):
+    assert KnownUsers.contains(42) is False
+    KnownUsers.add(42)
+    KnownUsers.add(42)
+    assert KnownUsers.contains(42) is True
+    assert KnownUsers.contains(43) is False
+
+
+def test_load_known_users_in_batches(database, known_users):
+    async def run():
+        await seed_users(25, 0.0)
+        await UserService.load_known_users(batch_size=10)
+        assert all(KnownUsers.contains(telegram_id) for telegram_id in range(1, 26))
+        assert KnownUsers.contains(26) is False
+
+    asyncio.run(run())
+
+
+def test_unknown_user_falls_back_to_database(database, known_users):
+    async def run():
+        await seed_users(2, 0.0)
+        assert KnownUsers.contains(1) is False
+        assert await UserService.is_exist(1) is True
+        # Remembered by the lookup, the next check does not query.
+        assert KnownUsers.contains(1) is True
+        assert await UserService.is_exist(3) is False
+        assert KnownUsers.contains(3) is False
+
+    asyncio.run(run())
+
+
+def test_register_checks_bloom_filter_answer(database, known_users):
+    async def run():
+        # Stands in for a false positive of the bloom filter, the user is not registered.
+        KnownUsers.add(7)
+        assert await UserService.is_exist(7) is True
+        is_new = await UserService.register(7, "user7")
+        if known_users:
+            assert is_new is True
+            assert await query("SELECT telegram_id, telegram_username FROM users") == [(7, "user7")]
+        else:
+            # A set has no false positives, its answer is trusted.
+            assert is_new is False
+            assert await query("SELECT telegram_id FROM users") == []
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+"""
+Tests of the user language cache: it is bounded, and unregistered users are cached too,
+so their updates do not query the database until they register.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from middlewares.localization import LocalizationMiddleware
+from services.user import UserService
+from utils.known_users import KnownUsers
+from utils.localizator import Localizator
+
+
+@pytest.fixture
+def user_languages():
+    Localizator._Localizator__user_languages.clear()
+    KnownUsers.reset(0)
+    yield
+    Localizator._Localizator__user_languages.clear()
+    KnownUsers.reset(0)
+
+
+@pytest.fixture
+def language_lookups(monkeypatch):
+    """
+    telegram_ids passed to UserService.get_language.
+    """
+    lookups = []
+    get_language = UserService.get_language
+
+    async def counted_get_language(telegram_id: int):
+        lookups.append(telegram_id)
+        return await get_language(telegram_id)
+
+    monkeypatch.setattr(UserService, "get_language", counted_get_language)
+    return lookups
+
+
+def telegram_user(telegram_id: int, language_code: str = "de") -> SimpleNamespace:
+    return SimpleNamespace(id=telegram_id, language_code=language_code)
+
+
+def test_least_recently_used_language_is_evicted(user_languages, monkeypatch):
+    monkeypatch.setattr(Localizator, "max_user_languages", 3)
+    for telegram_id in range(1, 4):
+        Localizator.set_user_language(telegram_id, "en")
+    assert Localizator.get_user_language(1) == "en"
+    Localizator.set_user_language(4, "de")
+    assert Localizator.get_user_language(2) is None
+    assert [Localizator.get_user_language(telegram_id) for telegram_id in (1, 3, 4)] == ["en", "en", "de"]
+
+
+def test_unregistered_user_is_looked_up_once(database, user_languages, language_lookups):
+    async def run():
+        for _ in range(3):
+            assert await LocalizationMiddleware.resolve_user_language(telegram_user(5)) == "de"
+        assert await LocalizationMiddleware.resolve_user_language(telegram_user(5, "en")) == "en"
+        assert language_lookups == [5]
+        assert Localizator.get_user_language(5) == Localizator.UNREGISTERED
+
+    asyncio.run(run())
+
+
+def test_registration_replaces_unregistered_entry(database, user_languages, language_lookups):
+    async def run():
+        assert await LocalizationMiddleware.resolve_user_language(telegram_user(5, "en")) == "en"
+        await UserService.register(5, "user5", "de")
+        assert await LocalizationMiddleware.resolve_user_language(telegram_user(5, "en")) == "de"
+        assert language_lookups == [5]
+
+    asyncio.run(run())
+
+
+def test_registered_user_language_is_cached(database, user_languages, language_lookups):
+    async def run():
+        await UserService.register(5, "user5", "de")
+        Localizator._Localizator__user_languages.clear()
+        for _ in range(3):
+            assert await LocalizationMiddleware.resolve_user_language(telegram_user(5, "en")) == "de"
+        assert language_lookups == [5]
+
+    asyncio.run(run())
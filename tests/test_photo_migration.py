@@ -0,0 +1,77 @@
+"""
+The migration moving photo blobs into the PhotoStore, on SQLite with ALTER TABLE DROP COLUMN (3.35+)
+and on older versions, which rebuild the photos table.
+"""
+import hashlib
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import db
+from utils.photo_store import PhotoStore
+
+blobs = [b"first photo", b"second photo", b"first photo"]
+
+
+@pytest.fixture(params=["3.45.1", "3.31.1"], ids=["drop-column", "rebuild"])
+def old_database(request, tmp_path, monkeypatch):
+    """
+    A database from before the PhotoStore: photo blobs in photos.data, categories and Telegram file_ids
+    referencing them, at the schema version before move_photos_to_store.
+    """
+    monkeypatch.setattr(PhotoStore, "photos_folder", tmp_path / "photos")
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+        # Overrides the built-in function, the migration takes the path of that SQLite version.
+        dbapi_connection.create_function("sqlite_version", 0, lambda: request.param)
+
+    with engine.begin() as connection:
+        db.Base.metadata.create_all(connection)
+        connection.execute(text("DROP TABLE photos"))
+        connection.execute(text("CREATE TABLE photos (id INTEGER NOT NULL PRIMARY KEY, data BLOB NOT NULL)"))
+        for photo_id, blob in enumerate(blobs, start=1):
+            connection.execute(text("INSERT INTO photos (id, data) VALUES (:id, :data)"),
+                               {"id": photo_id, "data": blob})
+            connection.execute(text(f"INSERT INTO categories (id, name, description, image_id, is_hidden) "
+                                    f"VALUES ({photo_id}, 'category {photo_id}', 'description', {photo_id}, 0)"))
+            connection.execute(text(f"INSERT INTO photo_file_ids (photo_id, bot_id, file_id) "
+                                    f"VALUES ({photo_id}, 1, 'file {photo_id}')"))
+        connection.execute(text(f"PRAGMA user_version = {db.migrations.index(db.move_photos_to_store)}"))
+    yield engine
+    engine.dispose()
+
+
+def test_blobs_are_moved_to_the_store(old_database):
+    with old_database.connect() as connection:
+        db.upgrade_database(connection)
+    with old_database.connect() as connection:
+        columns = [column.name for column in connection.execute(text("PRAGMA table_info(photos)"))]
+        assert columns == ["id", "sha256", "size"]
+        photos = connection.execute(text("SELECT id, sha256, size FROM photos ORDER BY id")).all()
+        for (photo_id, sha256, size), blob in zip(photos, blobs):
+            assert sha256 == hashlib.sha256(blob).hexdigest()
+            assert size == len(blob)
+            assert PhotoStore.get_path(sha256).read_bytes() == blob
+        assert len(list(PhotoStore.photos_folder.glob("*/*"))) == 2
+        # Rebuilding the table must not cascade to the file_ids or break the categories' references.
+        assert connection.execute(text("SELECT photo_id FROM photo_file_ids ORDER BY photo_id")).scalars().all() == [
+            1, 2, 3]
+        assert connection.execute(text("PRAGMA foreign_key_check")).all() == []
+        assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        assert connection.execute(text("PRAGMA user_version")).scalar() == len(db.migrations)
+
+
+def test_failed_migration_removes_the_added_files(old_database, monkeypatch):
+    def failing_migration(connection):
+        raise RuntimeError("failing migration")
+
+    monkeypatch.setattr(db, "migrations", [*db.migrations, failing_migration])
+    with old_database.connect() as connection:
+        with pytest.raises(RuntimeError, match="failing migration"):
+            db.upgrade_database(connection)
+    assert list(PhotoStore.photos_folder.glob("*/*")) == []
+    with old_database.connect() as connection:
+        assert connection.execute(text("PRAGMA foreign_keys")).scalar() == 1
@@ -0,0 +1,142 @@
+"""
+Holds taken by ReservationService between the purchase confirmation and the checkout: held items are skipped
+by other buyers until the hold is released or expires.
+"""
+import asyncio
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import config
+import db
+from conftest import seed_catalog, seed_users
+from services.checkout import CheckoutService, CheckoutStatus
+from services.reservation import ReservationService
+
+
+def test_reserve_holds_distinct_items(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=10)
+        assert await ReservationService.reserve(1, 1, 3, 1.0)
+        assert await ReservationService.reserve(2, 1, 3, 1.0)
+        first = ReservationService.get_reserved_item_ids(1, 1, 3)
+        second = ReservationService.get_reserved_item_ids(2, 1, 3)
+        assert len(first) == len(second) == 3
+        assert set(first).isdisjoint(second)
+        assert ReservationService.get_held_item_ids(1) == {*first, *second}
+        assert ReservationService.get_confirmed_price(1, 1, 3) == 1.0
+        # A hold only covers the purchase it was taken for.
+        assert ReservationService.get_reserved_item_ids(1, 1, 2) == []
+        assert ReservationService.get_confirmed_price(1, 2, 3) is None
+
+    asyncio.run(run())
+
+
+def test_new_hold_replaces_the_previous_one(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=4)
+        assert await ReservationService.reserve(1, 1, 3, 1.0)
+        assert await ReservationService.reserve(1, 1, 4, 1.0)
+        assert len(ReservationService.get_held_item_ids(1)) == 4
+
+    asyncio.run(run())
+
+
+def test_buyers_compete_for_the_last_items(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=3)
+        assert await ReservationService.reserve(1, 1, 2, 1.0)
+        assert await ReservationService.reserve(2, 1, 2, 1.0) is False
+        assert await ReservationService.reserve(2, 1, 1, 1.0)
+        assert await ReservationService.reserve(3, 1, 1, 1.0) is False
+        results = await asyncio.gather(*[ReservationService.reserve(telegram_id, 1, 1, 1.0)
+                                         for telegram_id in range(4, 14)])
+        assert results.count(True) == 0
+
+    asyncio.run(run())
+
+
+def test_parallel_reservations_do_not_share_items(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=5)
+        results = await asyncio.gather(*[ReservationService.reserve(telegram_id, 1, 1, 1.0)
+                                         for telegram_id in range(1, 11)])
+        assert results.count(True) == 5
+        assert len(ReservationService.get_held_item_ids(1)) == 5
+
+    asyncio.run(run())
+
+
+def test_release_frees_the_items(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=2)
+        assert await ReservationService.reserve(1, 1, 2, 1.0)
+        assert await ReservationService.reserve(2, 1, 1, 1.0) is False
+        ReservationService.release(1)
+        assert ReservationService.get_held_item_ids(1) == set()
+        assert ReservationService.get_confirmed_price(1, 1, 2) is None
+        assert await ReservationService.reserve(2, 1, 1, 1.0)
+
+    asyncio.run(run())
+
+
+def test_expired_holds_are_swept(database, monkeypatch):
+    async def run():
+        await seed_catalog(items_per_subcategory=2)
+        monkeypatch.setattr(config, "RESERVATION_TTL", 0)
+        assert await ReservationService.reserve(1, 1, 2, 1.0)
+        monkeypatch.setattr(config, "RESERVATION_TTL", 300)
+        ReservationService.sweep()
+        assert ReservationService.get_held_item_ids(1) == set()
+        assert ReservationService.get_confirmed_price(1, 1, 2) is None
+        assert await ReservationService.reserve(2, 1, 2, 1.0)
+        # The expired hold is gone, sweeping again must not release the new one.
+        ReservationService.sweep()
+        assert ReservationService.get_confirmed_price(2, 1, 2) == 1.0
+
+    asyncio.run(run())
+
+
+def test_checkout_skips_items_held_by_others(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=3)
+        await seed_users(2, 10.0)
+        assert await ReservationService.reserve(1, 1, 2, 1.0)
+        reserved_item_ids = ReservationService.get_reserved_item_ids(1, 1, 2)
+        result = await CheckoutService.checkout(2, 1, 2)
+        assert result.status == CheckoutStatus.OUT_OF_STOCK
+        result = await CheckoutService.checkout(1, 1, 2, confirmed_price=1.0)
+        assert result.status == CheckoutStatus.COMPLETED
+        assert sorted(item.id for item in result.items) == sorted(reserved_item_ids)
+        assert ReservationService.get_held_item_ids(1) == set()
+
+    asyncio.run(run())
+
+
+def test_held_item_ids_are_not_bound_into_the_sql(database):
+    async def run():
+        await seed_catalog(items_per_subcategory=2000)
+        await seed_users(1, 1000.0)
+        parameter_counts = []
+
+        def count_parameters(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "items" in statement:
+                parameter_counts.append(len(parameters))
+
+        sync_engine = db.engine.sync_engine if isinstance(db.engine, AsyncEngine) else db.engine
+        event.listen(sync_engine, "before_cursor_execute", count_parameters)
+        try:
+            for telegram_id in range(1, 4):
+                assert await ReservationService.reserve(telegram_id + 100, 1, 500, 1.0)
+            assert await ReservationService.reserve(1, 1, 500, 1.0)
+            assert len(ReservationService.get_held_item_ids(1)) == 2000
+            assert await ReservationService.reserve(2, 1, 1, 1.0) is False
+            ReservationService.release(1)
+            result = await CheckoutService.checkout(1, 1, 500)
+            assert result.status == CheckoutStatus.COMPLETED
+        finally:
+            event.remove(sync_engine, "before_cursor_execute", count_parameters)
+        # The checkout binds the ids of the items it claims, never those held by others.
+        assert max(parameter_counts) <= 500 + 3
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+"""
+Tests of UpdateDeduplicationMiddleware: repeated updates are dropped while they are remembered, entries are evicted
+once their window expired or the table is full.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import Update
+
+import middlewares.update_deduplication
+from middlewares.update_deduplication import UpdateDeduplicationMiddleware
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A monotonic clock the test moves forward by hand.
+    """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(middlewares.update_deduplication, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_repeated_update_is_duplicate(clock):
+    middleware = UpdateDeduplicationMiddleware()
+    assert middleware.is_duplicate(1, 10) is False
+    assert middleware.is_duplicate(1, 10) is True
+    assert middleware.is_duplicate(1, 11) is False
+    assert middleware.get_metrics() == {"hits": 1, "misses": 2, "tracked_updates": 2}
+
+
+def test_same_update_id_of_another_bot_is_not_duplicate(clock):
+    middleware = UpdateDeduplicationMiddleware()
+    assert middleware.is_duplicate(1, 10) is False
+    assert middleware.is_duplicate(2, 10) is False
+
+
+def test_update_is_forgotten_after_window(clock):
+    middleware = UpdateDeduplicationMiddleware()
+    middleware.is_duplicate(1, 10)
+    clock.now += middleware.ttl / 2
+    middleware.is_duplicate(1, 11)
+    clock.now += middleware.ttl / 2
+    # The window of update 10 ends now, it is still remembered.
+    assert middleware.is_duplicate(1, 10) is True
+    clock.now += 1
+    assert middleware.get_metrics()["tracked_updates"] == 2
+    assert middleware.is_duplicate(1, 10) is False
+    # Update 10 is remembered again with a new window, update 11 has not expired yet.
+    assert middleware.get_metrics()["tracked_updates"] == 2
+    assert middleware.is_duplicate(1, 11) is True
+    clock.now += middleware.ttl / 2
+    assert middleware.is_duplicate(1, 12) is False
+    assert middleware.get_metrics()["tracked_updates"] == 2
+
+
+def test_oldest_update_is_evicted_when_full(clock, monkeypatch):
+    monkeypatch.setattr(UpdateDeduplicationMiddleware, "max_entries", 3)
+    middleware = UpdateDeduplicationMiddleware()
+    for update_id in range(1, 5):
+        assert middleware.is_duplicate(1, update_id) is False
+    assert middleware.get_metrics()["tracked_updates"] == 3
+    assert middleware.is_duplicate(1, 4) is True
+    assert middleware.is_duplicate(1, 2) is True
+    assert middleware.is_duplicate(1, 1) is False
+
+
+def test_duplicate_update_does_not_reach_handler(clock):
+    middleware = UpdateDeduplicationMiddleware()
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+        return "handled"
+
+    async def run():
+        data = {"bot": SimpleNamespace(id=1)}
+        assert await middleware(handler, Update(update_id=10), data) == "handled"
+        assert await middleware(handler, Update(update_id=10), data) is None
+        assert await middleware(handler, Update(update_id=11), data) == "handled"
+
+    asyncio.run(run())
+    assert handled == [10, 11]
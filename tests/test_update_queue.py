@@ -0,0 +1,121 @@
+"""
+UpdateQueue: updates of one chat in arrival order, chats in parallel, refused updates once the queue is full,
+and metrics only on their own listener.
+"""
+import asyncio
+import json
+import socket
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from utils.update_queue import UpdateQueue
+
+bot = SimpleNamespace(id=1, session=SimpleNamespace(json_loads=json.loads, json_dumps=json.dumps))
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start(update_queue: UpdateQueue) -> web.Application:
+    app = web.Application()
+    update_queue.setup(app, "127.0.0.1", 0, "/metrics")
+    app.freeze()
+    await app.startup()
+    return app
+
+
+def test_updates_of_a_chat_are_processed_in_order():
+    async def run():
+        update_queue = UpdateQueue(workers=4, max_size=100)
+        app = await start(update_queue)
+        processed = []
+        running = set()
+        max_running = 0
+
+        def make_job(chat_id: int, number: int):
+            async def job():
+                nonlocal max_running
+                # Updates of one chat never overlap.
+                assert chat_id not in running
+                running.add(chat_id)
+                max_running = max(max_running, len(running))
+                await asyncio.sleep(0.001 * (number % 3))
+                processed.append((chat_id, number))
+                running.discard(chat_id)
+
+            return job
+
+        for number in range(20):
+            for chat_id in range(4):
+                assert update_queue.submit((1, chat_id), make_job(chat_id, number))
+        while len(processed) < 80:
+            await asyncio.sleep(0.01)
+        for chat_id in range(4):
+            assert [number for chat, number in processed if chat == chat_id] == list(range(20))
+        assert max_running > 1
+        metrics = update_queue.get_metrics()
+        assert (metrics["accepted"], metrics["queue_depth"], metrics["waiting_chats"]) == (80, 0, 0)
+        await app.shutdown()
+
+    asyncio.run(run())
+
+
+def test_full_queue_sheds_updates():
+    async def run():
+        update_queue = UpdateQueue(workers=1, max_size=2)
+        app = await start(update_queue)
+        release = asyncio.Event()
+        processed = []
+
+        async def feed_update(bot, update):
+            await release.wait()
+            processed.append(update["update_id"])
+
+        def request(update_id: int):
+            update = {"update_id": update_id, "message": {"chat": {"id": update_id}}}
+            return SimpleNamespace(json=lambda loads: asyncio.sleep(0, update))
+
+        responses = [await update_queue.accept(bot, request(update_id), feed_update) for update_id in range(1, 5)]
+        await asyncio.sleep(0)
+        # The first update is being processed, two wait, the fourth is refused and retried by Telegram.
+        assert [response.status for response in responses[:3]] == [200, 200, 200]
+        assert responses[3].status == 429
+        assert responses[3].headers["Retry-After"] == "1"
+        assert update_queue.get_metrics()["rejected"] == 1
+        release.set()
+        while len(processed) < 3:
+            await asyncio.sleep(0.01)
+        assert (await update_queue.accept(bot, request(5), feed_update)).status == 200
+        await app.shutdown()
+
+    asyncio.run(run())
+
+
+def test_metrics_are_served_on_their_own_listener():
+    async def run():
+        update_queue = UpdateQueue(workers=1, max_size=10)
+        webhook_app = web.Application()
+        webhook_port, metrics_port = get_free_port(), get_free_port()
+        update_queue.setup(webhook_app, "127.0.0.1", metrics_port, "/metrics")
+        update_queue.add_metrics_source("deduplication", lambda: {"dropped": 0})
+        runner = web.AppRunner(webhook_app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", webhook_port).start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{webhook_port}/metrics") as response:
+                    assert response.status == 404
+                async with session.get(f"http://127.0.0.1:{metrics_port}/metrics") as response:
+                    assert response.status == 200
+                    metrics = await response.json()
+            assert metrics["max_queue_depth"] == 10
+            assert metrics["deduplication"] == {"dropped": 0}
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+"""
+Tests of UserService.register: new users get a wallet, users registered before or concurrently are upserted,
+keeping their wallet and balance.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+import db
+from conftest import seed_users
+from services.user import UserService
+from utils.known_users import KnownUsers
+
+
+async def query(sql: str) -> list:
+    async with db.get_db_session() as session:
+        rows = await db.session_execute(text(sql), session)
+        return rows.all()
+
+
+async def execute(sql: str):
+    async with db.get_db_session() as session:
+        await db.session_execute(text(sql), session)
+        await db.session_commit(session)
+
+
+@pytest.fixture
+def known_users():
+    KnownUsers.reset(0)
+    yield
+    KnownUsers.reset(0)
+
+
+def test_new_user_gets_wallet(database, known_users):
+    async def run():
+        assert await UserService.register(5, "user5") is True
+        rows = await query("SELECT telegram_id, telegram_username, can_receive_messages, "
+                           "ltc_address IS NOT NULL, seed IS NOT NULL FROM users")
+        assert rows == [(5, "user5", 1, 1, 1)]
+        assert KnownUsers.contains(5) is True
+
+    asyncio.run(run())
+
+
+def test_existing_user_is_updated(database, known_users):
+    async def run():
+        await seed_users(1, 10.0)
+        await execute("UPDATE users SET can_receive_messages = 0")
+        assert await UserService.register(1, "renamed") is False
+        assert await query("SELECT telegram_username, can_receive_messages, ltc_address, seed, balance "
+                           "FROM users") == [("renamed", 1, "address1", "seed1", 10.0)]
+
+    asyncio.run(run())
+
+
+def test_concurrently_registered_user_is_upserted(database, known_users, monkeypatch):
+    async def is_registered(telegram_id: int) -> bool:
+        return False
+
+    async def run():
+        await seed_users(1, 10.0)
+        await execute("UPDATE users SET can_receive_messages = 0")
+        # The row was inserted after the registration check.
+        monkeypatch.setattr(UserService, "_UserService__is_registered", is_registered)
+        await UserService.register(1, "renamed")
+        assert await query("SELECT telegram_username, can_receive_messages, ltc_address, seed, balance "
+                           "FROM users") == [("renamed", 1, "address1", "seed1", 10.0)]
+
+    asyncio.run(run())
+
+
+def test_parallel_registrations_of_one_user(database, known_users):
+    async def run():
+        await asyncio.gather(*[UserService.register(5, "user5") for _ in range(10)])
+        assert await query("SELECT telegram_id, telegram_username FROM users") == [(5, "user5")]
+
+    asyncio.run(run())
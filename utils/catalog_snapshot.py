@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import NamedTuple, Union
+
+from sqlalchemy import select, func
+
+from db import session_execute, get_db_session
+from models.category import Category
+from models.item import Item
+from models.subcategory import Subcategory
+from utils.keyset_pagination import KeysetPaginator, KeysetPage
+
+
+@dataclass(frozen=True)
+class CategoryEntry:
+    id: int
+    name: str
+    description: str
+    image_id: int
+    is_hidden: bool
+
+
+@dataclass(frozen=True)
+class SubcategoryEntry:
+    id: int
+    name: str
+    price: float
+    category_id: int
+    image_id: int
+    is_hidden: bool
+
+
+class SubcategoryListing(NamedTuple):
+    # Same fields as the rows of ItemService.get_unsold_subcategories_by_category.
+    subcategory_id: int
+    name: str
+    price: float
+    available_quantity: int
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the category/subcategory tree and the unsold item count of every subcategory.
+    Listings are ordered and paginated the same way as the corresponding SQL queries.
+    """
+
+    def __init__(self, version: int, categories: dict[int, CategoryEntry],
+                 subcategories: dict[int, SubcategoryEntry], stock: dict[int, int]):
+        self.version = version
+        self.categories = MappingProxyType(categories)
+        self.subcategories = MappingProxyType(subcategories)
+        self.stock = MappingProxyType(stock)
+        self.__visible_categories = sorted((category for category in categories.values() if not category.is_hidden),
+                                           key=lambda category: category.name)
+        self.__subcategories_by_category: dict[int, list[SubcategoryEntry]] = {}
+        for subcategory in sorted(subcategories.values(), key=lambda subcategory: subcategory.id):
+            self.__subcategories_by_category.setdefault(subcategory.category_id, []).append(subcategory)
+
+    def with_stock_changes(self, version: int, stock_changes: dict[int, int]) -> "CatalogSnapshot":
+        stock = dict(self.stock)
+        for subcategory_id, quantity_change in stock_changes.items():
+            stock[subcategory_id] = max(stock.get(subcategory_id, 0) + quantity_change, 0)
+        return CatalogSnapshot(version, dict(self.categories), dict(self.subcategories), stock)
+
+    def get_category(self, category_id: int) -> Union[CategoryEntry, None]:
+        return self.categories.get(category_id)
+
+    def get_subcategory(self, subcategory_id: int) -> Union[SubcategoryEntry, None]:
+        return self.subcategories.get(subcategory_id)
+
+    def get_available_quantity(self, subcategory_id: int) -> int:
+        return self.stock.get(subcategory_id, 0)
+
+    def get_categories_with_items_count(self, cursor: str) -> KeysetPage:
+        """
+        Entries are (CategoryEntry, unsold items count) tuples.
+        """
+        categories = KeysetPaginator.paginate_sorted(self.__visible_categories, cursor,
+                                                     lambda category: category.id,
+                                                     lambda category: category.name,
+                                                     lambda category_id: getattr(self.get_category(category_id),
+                                                                                 "name", None))
+        categories.entries = [(category, sum(self.get_available_quantity(subcategory.id)
+                                             for subcategory in self.__subcategories_by_category.get(category.id,
+                                                                                                     [])))
+                              for category in categories.entries]
+        return categories
+
+    def get_unsold_subcategories_by_category(self, category_id: int, cursor: str) -> KeysetPage:
+        # Subcategories sharing a name are listed once, like the GROUP BY name of the SQL query.
+        subcategories_by_name: dict[str, list[SubcategoryEntry]] = {}
+        for subcategory in self.__subcategories_by_category.get(category_id, []):
+            if self.get_available_quantity(subcategory.id) > 0:
+                subcategories_by_name.setdefault(subcategory.name, []).append(subcategory)
+        listings = []
+        for name in sorted(subcategories_by_name):
+            subcategory = subcategories_by_name[name][0]
+            available_quantity = sum(self.get_available_quantity(same_name_subcategory.id)
+                                     for same_name_subcategory in subcategories_by_name[name])
+            listings.append(SubcategoryListing(subcategory.id, subcategory.name, subcategory.price,
+                                               available_quantity))
+        return KeysetPaginator.paginate_sorted(listings, cursor,
+                                               lambda listing: listing.subcategory_id,
+                                               lambda listing: listing.name,
+                                               lambda subcategory_id: getattr(self.get_subcategory(subcategory_id),
+                                                                              "name", None))
+
+
+class CatalogCache:
+    """
+    Process-wide CatalogSnapshot used by the browsing handlers.
+    Services call invalidate() after committing catalog changes and update_stock() after committing
+    item sales or additions. Every change bumps the version, so a snapshot loaded concurrently with a
+    change is served to its own caller but never cached.
+    """
+    __snapshot: Union[CatalogSnapshot, None] = None
+    __version = 0
+
+    @staticmethod
+    async def get() -> CatalogSnapshot:
+        snapshot = CatalogCache.__snapshot
+        if snapshot is None:
+            version = CatalogCache.__version
+            snapshot = await CatalogCache.__load(version)
+            if version == CatalogCache.__version:
+                CatalogCache.__snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def invalidate():
+        CatalogCache.__version += 1
+        CatalogCache.__snapshot = None
+
+    @staticmethod
+    def update_stock(stock_changes: dict[int, int]):
+        CatalogCache.__version += 1
+        if CatalogCache.__snapshot is not None:
+            CatalogCache.__snapshot = CatalogCache.__snapshot.with_stock_changes(CatalogCache.__version,
+                                                                                 stock_changes)
+
+    @staticmethod
+    async def __load(version: int) -> CatalogSnapshot:
+        async with get_db_session() as session:
+            categories = await session_execute(select(Category.id, Category.name, Category.description,
+                                                      Category.image_id, Category.is_hidden), session)
+            categories = {row.id: CategoryEntry(row.id, row.name, row.description, row.image_id,
+                                                bool(row.is_hidden))
+                          for row in categories}
+            subcategories = await session_execute(select(Subcategory.id, Subcategory.name, Subcategory.price,
+                                                         Subcategory.category_id, Subcategory.image_id,
+                                                         Subcategory.is_hidden), session)
+            subcategories = {row.id: SubcategoryEntry(row.id, row.name, row.price, row.category_id, row.image_id,
+                                                      bool(row.is_hidden))
+                             for row in subcategories}
+            stock = await session_execute(select(Item.subcategory_id, func.count(Item.id))
+                                          .where(Item.is_sold == False)
+                                          .group_by(Item.subcategory_id), session)
+            stock = {subcategory_id: items_count for subcategory_id, items_count in stock}
+            return CatalogSnapshot(version, categories, subcategories, stock)
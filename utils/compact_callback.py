@@ -0,0 +1,171 @@
+import base64
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, ClassVar, Type, TypeVar, Union
+
+from aiogram.filters.callback_data import CallbackData, MAX_CALLBACK_LENGTH
+
+T = TypeVar("T", bound="CompactCallbackData")
+
+
+class CallbackStateTable:
+    """
+    Bounded LRU table of recently packed callback states, keyed by their callback_data string.
+    Entries expire ttl seconds after they were packed.
+    """
+    max_entries = 50000
+    ttl = 24 * 60 * 60
+    __entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+    __last_token = 0
+    # Tokens are only valid in the process that issued them, the nonce keeps a "~<token>" button sent before
+    # a restart from resolving to the unrelated state that gets the same counter value afterwards.
+    __token_nonce = secrets.token_urlsafe(4)
+
+    @staticmethod
+    def put(callback_data: str, state: Any):
+        CallbackStateTable.__entries[callback_data] = (state, time.monotonic() + CallbackStateTable.ttl)
+        CallbackStateTable.__entries.move_to_end(callback_data)
+        while len(CallbackStateTable.__entries) > CallbackStateTable.max_entries:
+            CallbackStateTable.__entries.popitem(last=False)
+
+    @staticmethod
+    def get(callback_data: str) -> Union[Any, None]:
+        entry = CallbackStateTable.__entries.get(callback_data)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if expires_at < time.monotonic():
+            del CallbackStateTable.__entries[callback_data]
+            return None
+        CallbackStateTable.__entries.move_to_end(callback_data)
+        return state
+
+    @staticmethod
+    def new_token() -> str:
+        CallbackStateTable.__last_token += 1
+        return f"~{CallbackStateTable.__token_nonce}{CallbackStateTable.__last_token:x}"
+
+
+class CompactCallbackData(CallbackData, prefix="compact"):
+    """
+    CallbackData packed as "<prefix>:<base64url of the binary encoded fields>".
+    Every packed state is also kept in the CallbackStateTable, so a tap on a recently sent button
+    resolves to the typed instance without decoding anything. The encoded fields are the fallback
+    that keeps older buttons working after the state was evicted or the bot restarted.
+    A state too large for callback_data is only kept in the table, behind a short "~<token>".
+    Unpacked instances can be shared between updates, use model_copy to derive new ones.
+    Fields may be int, bool, str, float or a Union of these.
+    """
+
+    def pack(self) -> str:
+        payload = base64.urlsafe_b64encode(self.__encode()).rstrip(b"=").decode()
+        callback_data = f"{self.__prefix__}{self.__separator__}{payload}"
+        if len(callback_data.encode()) > MAX_CALLBACK_LENGTH:
+            callback_data = f"{self.__prefix__}{self.__separator__}{CallbackStateTable.new_token()}"
+        CallbackStateTable.put(callback_data, self)
+        return callback_data
+
+    @classmethod
+    def unpack(cls: Type[T], value: str) -> T:
+        state = CallbackStateTable.get(value)
+        if isinstance(state, cls):
+            return state
+        prefix, separator, payload = value.partition(cls.__separator__)
+        if prefix != cls.__prefix__ or separator == "":
+            raise ValueError(f"Bad prefix ({prefix!r} != {cls.__prefix__!r})")
+        if payload.startswith("~"):
+            raise ValueError(f"Callback state {payload!r} of {cls.__name__!r} expired")
+        try:
+            data = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+            values = cls.__decode(data)
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"Malformed callback data {value!r}") from e
+        return cls(**values)
+
+    # Types a field can be encoded as, the index is the type tag written before the values of Union fields.
+    __plain_types: ClassVar[tuple] = (int, bool, str, float)
+    __layouts: ClassVar[dict] = {}
+
+    @classmethod
+    def __get_layout(cls) -> list[tuple[str, Union[type, None]]]:
+        """
+        (field name, field type) pairs, the type is None for Union fields which carry a type tag.
+        """
+        layout = CompactCallbackData.__layouts.get(cls)
+        if layout is None:
+            layout = [(name, field.annotation if field.annotation in CompactCallbackData.__plain_types else None)
+                      for name, field in cls.model_fields.items()]
+            CompactCallbackData.__layouts[cls] = layout
+        return layout
+
+    def __encode(self) -> bytes:
+        buffer = bytearray()
+        write_varint = CompactCallbackData.__write_varint
+        for name, value_type in self.__get_layout():
+            value = getattr(self, name)
+            if value_type is None:
+                value_type = type(value)
+                if value_type not in CompactCallbackData.__plain_types:
+                    raise ValueError(f"Attribute {name}={value!r} of type {value_type.__name__!r} "
+                                     f"can not be packed to callback data")
+                buffer.append(CompactCallbackData.__plain_types.index(value_type))
+            if value_type is bool:
+                buffer.append(int(value))
+            elif value_type is int:
+                # Zigzag encoding keeps small negative values such as the -1 defaults short.
+                write_varint(buffer, value * 2 if value >= 0 else -value * 2 - 1)
+            else:
+                # Floats are stored as their shortest repr, usually smaller than 8 raw bytes.
+                encoded = (value if value_type is str else repr(value)).encode()
+                write_varint(buffer, len(encoded))
+                buffer += encoded
+        return bytes(buffer)
+
+    @classmethod
+    def __decode(cls, data: bytes) -> dict[str, Any]:
+        values = {}
+        position = 0
+        read_varint = CompactCallbackData.__read_varint
+        for name, value_type in cls.__get_layout():
+            if value_type is None:
+                value_type = CompactCallbackData.__plain_types[data[position]]
+                position += 1
+            if value_type is bool:
+                values[name] = data[position] == 1
+                position += 1
+                continue
+            number, position = read_varint(data, position)
+            if value_type is int:
+                values[name] = number >> 1 if number & 1 == 0 else -((number + 1) >> 1)
+                continue
+            end = position + number
+            if end > len(data):
+                raise IndexError("String runs past the end of the data")
+            value = data[position:end].decode()
+            values[name] = value if value_type is str else float(value)
+            position = end
+        if position != len(data):
+            raise ValueError("Unexpected data after the last field")
+        return values
+
+    @staticmethod
+    def __write_varint(buffer: bytearray, value: int):
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    @staticmethod
+    def __read_varint(data: bytes, position: int) -> tuple[int, int]:
+        byte = data[position]
+        if byte < 0x80:
+            return byte, position + 1
+        value = 0
+        shift = 0
+        while byte >= 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            position += 1
+            byte = data[position]
+        return value | (byte << shift), position + 1
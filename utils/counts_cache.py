@@ -0,0 +1,34 @@
+import time
+from typing import Awaitable, Callable, Hashable
+
+
+class CountsCache:
+    """
+    Results of COUNT queries shown next to paged lists, keyed by list kind and filter.
+    Services call invalidate(kind) after committing writes that change the counts of that kind.
+    Counts over a time window also go stale without any write, as rows age out of the window,
+    so every count is recomputed at least once per max_age seconds.
+    """
+    USERS = "users"
+
+    max_age = 60
+    __counts: dict[tuple[str, Hashable], tuple[int, float]] = {}
+    __versions: dict[str, int] = {}
+
+    @staticmethod
+    async def get(kind: str, count_filter: Hashable, count_function: Callable[[], Awaitable[int]]) -> int:
+        cached_count = CountsCache.__counts.get((kind, count_filter))
+        if cached_count is not None and time.monotonic() - cached_count[1] < CountsCache.max_age:
+            return cached_count[0]
+        version = CountsCache.__versions.get(kind, 0)
+        count = await count_function()
+        # A count that raced with a write may already be outdated, it is returned but not cached.
+        if version == CountsCache.__versions.get(kind, 0):
+            CountsCache.__counts[(kind, count_filter)] = (count, time.monotonic())
+        return count
+
+    @staticmethod
+    def invalidate(kind: str):
+        CountsCache.__versions[kind] = CountsCache.__versions.get(kind, 0) + 1
+        for key in [key for key in CountsCache.__counts if key[0] == kind]:
+            del CountsCache.__counts[key]
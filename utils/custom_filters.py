@@ -3,6 +3,7 @@ from aiogram.filters import BaseFilter
 
 from config import ADMIN_ID_LIST
 from services.user import UserService
+from utils.localizator import Localizator, BotEntity
 
 
 class AdminIdFilter(BaseFilter):
@@ -16,3 +17,16 @@ class IsUserExistFilter(BaseFilter):
     async def __call__(self, message: types.message):
         is_exist = await UserService.is_exist(message.from_user.id)
         return is_exist
+
+
+class LocalizedTextFilter(BaseFilter):
+    """
+    Matches reply keyboard buttons in any loaded language via Localizator's text -> key index,
+    so the cost of a check does not grow with the number of languages.
+    """
+
+    def __init__(self, entity: BotEntity, key: str):
+        self.entity_key = (entity, key)
+
+    async def __call__(self, message: types.message):
+        return message.text is not None and self.entity_key in Localizator.get_keys_by_text(message.text)
@@ -0,0 +1,125 @@
+import bisect
+from dataclasses import dataclass
+from typing import Callable, Sequence, Union
+
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import config
+from db import session_execute
+
+
+@dataclass
+class KeysetPage:
+    entries: list
+    first_key: Union[int, None]
+    last_key: Union[int, None]
+    has_previous: bool
+    has_next: bool
+
+
+class PageCursor:
+    """
+    Position of a page inside a list, packed into the callback data of the pagination buttons:
+    "" - the first page, "z" - the last page,
+    "a<key>" - the page after the entry with the key, "b<key>" - the page before it.
+    """
+    FIRST = ""
+    LAST = "z"
+
+    @staticmethod
+    def after(key: int) -> str:
+        return f"a{key}"
+
+    @staticmethod
+    def before(key: int) -> str:
+        return f"b{key}"
+
+    @staticmethod
+    def parse(cursor: str) -> tuple[bool, Union[int, None]]:
+        """
+        Returns whether the page is read forwards and the key it starts after (or ends before).
+        """
+        if cursor == PageCursor.LAST:
+            return False, None
+        if len(cursor) > 1 and cursor[0] in "ab" and cursor[1:].isdigit():
+            return cursor[0] == "a", int(cursor[1:])
+        return True, None
+
+
+class KeysetPaginator:
+    @staticmethod
+    async def paginate(session: Union[AsyncSession, Session], stmt: Select, order_by: Sequence, key_column,
+                       cursor: str, key_of: Callable, scalars: bool = False) -> KeysetPage:
+        """
+        Reads one page of stmt, ordered by the order_by columns, without OFFSET and without counting the list.
+        key_column identifies the entries whose keys end up in cursors, key_of extracts that key from an entry.
+        The order_by values must be unique within the list, the last column is usually the key itself.
+        """
+        is_forward, key = PageCursor.parse(cursor)
+        page_stmt = stmt
+        if key is not None:
+            boundary = await session_execute(select(*order_by).where(key_column == key).limit(1), session)
+            boundary = boundary.first()
+            if boundary is None:
+                # The entry was deleted since the keyboard was sent.
+                return await KeysetPaginator.paginate(session, stmt, order_by, key_column, PageCursor.FIRST,
+                                                      key_of, scalars)
+            if is_forward:
+                page_stmt = page_stmt.where(tuple_(*order_by) > tuple_(*boundary))
+            else:
+                page_stmt = page_stmt.where(tuple_(*order_by) < tuple_(*boundary))
+        if is_forward:
+            page_stmt = page_stmt.order_by(*order_by)
+        else:
+            page_stmt = page_stmt.order_by(*[column.desc() for column in order_by])
+        # One extra entry tells whether another page follows in the reading direction.
+        page_stmt = page_stmt.limit(config.PAGE_ENTRIES + 1)
+        entries = await session_execute(page_stmt, session)
+        entries = entries.scalars().all() if scalars else entries.all()
+        has_more = len(entries) > config.PAGE_ENTRIES
+        entries = list(entries[:config.PAGE_ENTRIES])
+        if is_forward:
+            if key is not None and len(entries) == 0:
+                return await KeysetPaginator.paginate(session, stmt, order_by, key_column, PageCursor.LAST,
+                                                      key_of, scalars)
+            has_previous, has_next = key is not None, has_more
+        else:
+            if key is not None and has_more is False and len(entries) < config.PAGE_ENTRIES:
+                # Entries were removed before the cursor, show a full first page instead of a short one.
+                return await KeysetPaginator.paginate(session, stmt, order_by, key_column, PageCursor.FIRST,
+                                                      key_of, scalars)
+            entries.reverse()
+            has_previous, has_next = has_more, key is not None
+        return KeysetPaginator.__make_page(entries, key_of, has_previous, has_next)
+
+    @staticmethod
+    def paginate_sorted(entries: Sequence, cursor: str, key_of: Callable, sort_key_of: Callable,
+                        boundary_of: Callable) -> KeysetPage:
+        """
+        The same cursors over an in-memory list sorted by sort_key_of.
+        boundary_of returns the sort key of the entry with the given key, or None if it does not exist,
+        the entry does not have to be in the list itself.
+        """
+        is_forward, key = PageCursor.parse(cursor)
+        boundary = boundary_of(key) if key is not None else None
+        if key is not None and boundary is None:
+            is_forward, key = True, None
+        sort_keys = [sort_key_of(entry) for entry in entries]
+        if is_forward:
+            start = bisect.bisect_right(sort_keys, boundary) if key is not None else 0
+            if start >= len(entries):
+                start = max(len(entries) - config.PAGE_ENTRIES, 0)
+        else:
+            end = bisect.bisect_left(sort_keys, boundary) if key is not None else len(entries)
+            start = max(end - config.PAGE_ENTRIES, 0)
+        page_entries = list(entries[start:start + config.PAGE_ENTRIES])
+        return KeysetPaginator.__make_page(page_entries, key_of, start > 0,
+                                           start + config.PAGE_ENTRIES < len(entries))
+
+    @staticmethod
+    def __make_page(entries: list, key_of: Callable, has_previous: bool, has_next: bool) -> KeysetPage:
+        first_key = key_of(entries[0]) if entries else None
+        last_key = key_of(entries[-1]) if entries else None
+        return KeysetPage(entries, first_key, last_key, has_previous and bool(entries), has_next and bool(entries))
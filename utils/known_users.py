@@ -0,0 +1,77 @@
+import logging
+import math
+from typing import Union
+
+import config
+
+
+class BloomFilter:
+    """
+    Set of ints that may answer True for values never added, with about false_positive_rate probability
+    while no more than capacity values were added. Takes about 29 bits per value at a rate of one in a million.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = capacity
+        self.size = 0
+        self.bits_count = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes_count = max(1, round(self.bits_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bits_count + 7) // 8)
+
+    @staticmethod
+    def __mix(value: int) -> int:
+        # splitmix64 finalizer, Python's hash() of an int is the int itself.
+        value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return value ^ (value >> 31)
+
+    def __positions(self, value: int):
+        # Double hashing, k positions derived from the two halves of one 64-bit hash.
+        mixed = self.__mix(value)
+        first_hash, second_hash = mixed & 0xFFFFFFFF, (mixed >> 32) | 1
+        for i in range(self.hashes_count):
+            yield (first_hash + i * second_hash) % self.bits_count
+
+    def add(self, value: int):
+        for position in self.__positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.size += 1
+
+    def __contains__(self, value: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(value))
+
+
+class KnownUsers:
+    """
+    telegram_ids of registered users, warmed up at startup and extended by every registration,
+    so checking whether a user is registered does not need a query. Users are never deleted.
+    With KNOWN_USERS_BLOOM the ids are kept in a BloomFilter instead of a set, which takes a fraction of the memory
+    for very large user bases, at the cost of letting about one in a million unregistered users pass as registered.
+    """
+    bloom_false_positive_rate = 1e-6
+    # Room for registrations after the warm up before the false positive rate degrades.
+    bloom_min_capacity = 1000000
+    __telegram_ids: Union[set[int], BloomFilter] = set()
+
+    @staticmethod
+    def reset(users_count: int):
+        if config.KNOWN_USERS_BLOOM:
+            capacity = max(users_count * 2, KnownUsers.bloom_min_capacity)
+            KnownUsers.__telegram_ids = BloomFilter(capacity, KnownUsers.bloom_false_positive_rate)
+        else:
+            KnownUsers.__telegram_ids = set()
+
+    @staticmethod
+    def add(telegram_id: int):
+        telegram_ids = KnownUsers.__telegram_ids
+        if isinstance(telegram_ids, BloomFilter):
+            if telegram_id in telegram_ids:
+                return
+            if telegram_ids.size == telegram_ids.capacity:
+                logging.warning("Known users bloom filter is full, it is resized on the next restart")
+        telegram_ids.add(telegram_id)
+
+    @staticmethod
+    def contains(telegram_id: int) -> bool:
+        return telegram_id in KnownUsers.__telegram_ids
@@ -1,5 +1,13 @@
 import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
 from enum import Enum
+from pathlib import Path
+from types import MappingProxyType
+from typing import Union
 
 import config
 
@@ -10,18 +18,135 @@ class BotEntity(Enum):
     COMMON = 3
 
 
+class LocalizationCatalog:
+    """
+    Parsed contents of a single l10n/<lang>.json file.
+    Every entity section is frozen into a read-only mapping, so lookups are plain dict reads.
+    """
+    entity_sections = {
+        BotEntity.USER: "user",
+        BotEntity.ADMIN: "admin",
+        BotEntity.COMMON: "common"
+    }
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.mtime = os.stat(filename).st_mtime_ns
+        with open(filename, "r", encoding="UTF-8") as f:
+            raw_catalog = json.loads(f.read())
+        self.sections = MappingProxyType({
+            entity: MappingProxyType(dict(raw_catalog[section_name]))
+            for entity, section_name in self.entity_sections.items()
+        })
+
+    def is_outdated(self) -> bool:
+        try:
+            return os.stat(self.filename).st_mtime_ns != self.mtime
+        except FileNotFoundError:
+            return False
+
+    def get_text(self, entity: BotEntity, key: str) -> Union[str, None]:
+        return self.sections[entity].get(key)
+
+
 class Localizator:
-    localization_filename = f"./l10n/{config.BOT_LANGUAGE}.json"
+    localization_folder = Path("./l10n")
+    default_language = config.BOT_LANGUAGE
+    # Language of the update being processed, set by middlewares.localization.LocalizationMiddleware.
+    current_language: ContextVar[str] = ContextVar("current_language", default=config.BOT_LANGUAGE)
+    # The file's mtime is checked at most once per interval (seconds) to pick up edits without a restart.
+    reload_check_interval = 1.0
+    __catalogs: dict[str, LocalizationCatalog] = {}
+    __last_reload_checks: dict[str, float] = {}
+    # Text of every entry of every loaded catalog -> (entity, key) pairs using that text.
+    __text_index: dict[str, frozenset[tuple[BotEntity, str]]] = {}
+    # Languages of recently active users, bounded LRU. Users that are not registered are cached as UNREGISTERED,
+    # so their updates do not look the language up again until they register.
+    UNREGISTERED = ""
+    max_user_languages = 100000
+    __user_languages: OrderedDict[int, str] = OrderedDict()
+
+    @staticmethod
+    def __load_catalog(language: str) -> LocalizationCatalog:
+        catalog = LocalizationCatalog(str(Localizator.localization_folder / f"{language}.json"))
+        Localizator.__catalogs[language] = catalog
+        Localizator.__rebuild_text_index()
+        return catalog
+
+    @staticmethod
+    def __rebuild_text_index():
+        text_index = {}
+        for catalog in Localizator.__catalogs.values():
+            for entity, section in catalog.sections.items():
+                for key, text in section.items():
+                    text_index.setdefault(text, set()).add((entity, key))
+        Localizator.__text_index = {text: frozenset(keys) for text, keys in text_index.items()}
+
+    @staticmethod
+    def get_catalog(language: str) -> LocalizationCatalog:
+        catalog = Localizator.__catalogs.get(language)
+        now = time.monotonic()
+        if catalog is None:
+            Localizator.__last_reload_checks[language] = now
+            return Localizator.__load_catalog(language)
+        if now - Localizator.__last_reload_checks[language] >= Localizator.reload_check_interval:
+            Localizator.__last_reload_checks[language] = now
+            if catalog.is_outdated():
+                try:
+                    catalog = Localizator.__load_catalog(language)
+                except (ValueError, KeyError) as e:
+                    # The file may be caught mid-write, keep serving the previous catalog until it is valid again.
+                    logging.warning(f"Failed to reload {catalog.filename}: {e}")
+        return catalog
+
+    @staticmethod
+    def get_text(entity: BotEntity, key: str, language: Union[str, None] = None) -> str:
+        if language is None:
+            language = Localizator.current_language.get()
+        text = Localizator.get_catalog(language).get_text(entity, key)
+        if text is None:
+            # Translations may lag behind the default language file, fall back to it for missing keys.
+            text = Localizator.get_catalog(Localizator.default_language).get_text(entity, key)
+            if text is None:
+                raise KeyError(key)
+        return text
+
+    @staticmethod
+    def get_keys_by_text(text: str) -> frozenset[tuple[BotEntity, str]]:
+        return Localizator.__text_index.get(text, frozenset())
+
+    @staticmethod
+    def get_available_languages() -> list[str]:
+        return sorted(path.stem for path in Localizator.localization_folder.glob("*.json"))
+
+    @staticmethod
+    def resolve_language(language_code: Union[str, None]) -> str:
+        """
+        Maps a Telegram language_code (e.g. "de" or "pt-br") onto a shipped l10n file,
+        falling back to the default language.
+        """
+        if language_code:
+            for language in (language_code.lower(), language_code.split("-")[0].lower()):
+                if (Localizator.localization_folder / f"{language}.json").exists():
+                    return language
+        return Localizator.default_language
+
+    @staticmethod
+    def get_user_language(telegram_id: int) -> Union[str, None]:
+        """
+        Returns None if the user's language is not cached, UNREGISTERED for users known to be unregistered.
+        """
+        language = Localizator.__user_languages.get(telegram_id)
+        if language is not None:
+            Localizator.__user_languages.move_to_end(telegram_id)
+        return language
 
     @staticmethod
-    def get_text(entity: BotEntity, key: str) -> str:
-        with open(Localizator.localization_filename, "r", encoding="UTF-8") as f:
-            if entity == BotEntity.ADMIN:
-                return json.loads(f.read())["admin"][key]
-            elif entity == BotEntity.USER:
-                return json.loads(f.read())["user"][key]
-            else:
-                return json.loads(f.read())["common"][key]
+    def set_user_language(telegram_id: int, language: str):
+        Localizator.__user_languages[telegram_id] = language
+        Localizator.__user_languages.move_to_end(telegram_id)
+        while len(Localizator.__user_languages) > Localizator.max_user_languages:
+            Localizator.__user_languages.popitem(last=False)
 
     @staticmethod
     def get_currency_symbol():
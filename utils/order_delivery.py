@@ -0,0 +1,113 @@
+import csv
+import html
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Union
+
+from aiogram.types import Message, FSInputFile, InlineKeyboardMarkup
+
+import config
+from services.item import ItemService
+from utils.localizator import Localizator, BotEntity
+
+
+class OrderDelivery:
+    """
+    Sends the items of a buy to the user in a format picked by the size of the order.
+    Orders that fit into ORDER_MESSAGES_LIMIT messages are rendered as HTML and split between items into
+    messages below Telegram's 4096 characters. Larger orders, or orders with a single item too long for a message,
+    are written batch by batch into a CSV file on disk, which is uploaded as a document.
+    Bought items never change, so the rendered messages and the file_id of an uploaded document are cached.
+    """
+    message_limit = 4096
+    # Rendered messages of recently viewed orders, keyed by (buy id, language).
+    max_cached_orders = 1000
+    __messages: OrderedDict[tuple[int, str], list[str]] = OrderedDict()
+    # (buy id, bot id) -> file_id of the order's document, file_ids are only valid for the bot that sent them.
+    __document_file_ids: dict[tuple[int, int], str] = {}
+
+    @staticmethod
+    async def deliver(message: Message, buy_id: int, reply_markup: Union[InlineKeyboardMarkup, None] = None,
+                      edit: bool = False):
+        """
+        Answers the message with the order, edit replaces the message's text with the first part if possible.
+        reply_markup is attached to the last message.
+        """
+        messages = await OrderDelivery.__get_messages(buy_id)
+        if messages is None:
+            await OrderDelivery.__send_document(message, buy_id, reply_markup, edit)
+            return
+        for number, text in enumerate(messages, start=1):
+            markup = reply_markup if number == len(messages) else None
+            if number == 1 and edit:
+                await message.edit_text(text=text, reply_markup=markup)
+            else:
+                await message.answer(text=text, reply_markup=markup)
+
+    @staticmethod
+    async def __get_messages(buy_id: int) -> Union[list[str], None]:
+        """
+        The order split into messages, None if it needs more than ORDER_MESSAGES_LIMIT of them.
+        """
+        cache_key = (buy_id, Localizator.current_language.get())
+        messages = OrderDelivery.__messages.get(cache_key)
+        if messages is not None:
+            OrderDelivery.__messages.move_to_end(cache_key)
+            return messages
+        items_count, data_length = await ItemService.get_bought_data_size(buy_id)
+        text_limit = OrderDelivery.message_limit - len("<b></b>")
+        if data_length > text_limit * config.ORDER_MESSAGES_LIMIT:
+            return None
+        messages = []
+        text = ""
+        count = 0
+        async for private_data in ItemService.iterate_bought_data(buy_id):
+            count += 1
+            item_text = Localizator.get_text(BotEntity.USER, "purchased_item").format(
+                count=count, private_data=html.escape(private_data))
+            if len(item_text) > text_limit:
+                return None
+            if len(text) + len(item_text) > text_limit:
+                messages.append(f"<b>{text}</b>")
+                if len(messages) == config.ORDER_MESSAGES_LIMIT:
+                    return None
+                text = ""
+            text += item_text
+        messages.append(f"<b>{text}</b>")
+        OrderDelivery.__messages[cache_key] = messages
+        while len(OrderDelivery.__messages) > OrderDelivery.max_cached_orders:
+            OrderDelivery.__messages.popitem(last=False)
+        return messages
+
+    @staticmethod
+    async def __send_document(message: Message, buy_id: int, reply_markup: Union[InlineKeyboardMarkup, None],
+                              edit: bool):
+        items_count, _ = await ItemService.get_bought_data_size(buy_id)
+        caption = Localizator.get_text(BotEntity.USER, "purchased_items_document").format(quantity=items_count)
+        if edit:
+            # A text message can not be edited into a document.
+            await message.delete()
+        cache_key = (buy_id, message.bot.id)
+        file_id = OrderDelivery.__document_file_ids.get(cache_key)
+        if file_id is not None:
+            await message.answer_document(file_id, caption=caption, reply_markup=reply_markup)
+            return
+        file_descriptor, path = tempfile.mkstemp(suffix=".csv")
+        try:
+            with open(file_descriptor, "w", encoding="UTF-8", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["#", "data"])
+                count = 0
+                async for private_data in ItemService.iterate_bought_data(buy_id):
+                    count += 1
+                    writer.writerow([count, private_data])
+            document = FSInputFile(path, filename=f"order_{buy_id}.csv")
+            sent_message = await message.answer_document(document, caption=caption, reply_markup=reply_markup)
+            OrderDelivery.__document_file_ids[cache_key] = sent_message.document.file_id
+        finally:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove the order file {path}: {e}")
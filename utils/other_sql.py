@@ -23,37 +23,54 @@ class RefundBuyDTO:
 
 class OtherSQLQuery:
     @staticmethod
-    async def get_refund_data(buy_ids: Union[list[dict], int]):
+    async def get_refund_data(buy_ids: Union[list[int], int]):
         if isinstance(buy_ids, list):
-            result_list = list()
-            for buy_id in buy_ids:
-                result_list.append(await OtherSQLQuery.get_refund_data_single(buy_id))
-            return result_list
+            return await OtherSQLQuery.get_refund_data_many(buy_ids)
         else:
             return await OtherSQLQuery.get_refund_data_single(buy_ids)
 
+    @staticmethod
+    def __select_refund_data():
+        return select(
+            User.telegram_username,
+            User.telegram_id,
+            User.id.label("user_id"),
+            Subcategory.name.label("subcategory"),
+            Buy.total_price,
+            Buy.quantity,
+            Buy.id.label("buy_id")
+        ).join(
+            BuyItem, BuyItem.buy_id == Buy.id
+        ).join(
+            User, User.id == Buy.buyer_id
+        ).join(
+            Item, Item.id == BuyItem.item_id
+        ).join(
+            Subcategory, Subcategory.id == Item.subcategory_id
+        )
+
     @staticmethod
     async def get_refund_data_single(buy_id: int):
         async with get_db_session() as session:
-            stmt = select(
-                User.telegram_username,
-                User.telegram_id,
-                User.id.label("user_id"),
-                Subcategory.name.label("subcategory"),
-                Buy.total_price,
-                Buy.quantity,
-                Buy.id.label("buy_id")
-            ).join(
-                BuyItem, BuyItem.buy_id == Buy.id
-            ).join(
-                User, User.id == Buy.buyer_id
-            ).join(
-                Item, Item.id == BuyItem.item_id
-            ).join(
-                Subcategory, Subcategory.id == Item.subcategory_id
-            ).where(
+            stmt = OtherSQLQuery.__select_refund_data().where(
                 BuyItem.buy_id == buy_id
             ).limit(1)
             buy_items = await session_execute(stmt, session)
             buy_items = buy_items.mappings().one()
             return RefundBuyDTO(**buy_items)
+
+    @staticmethod
+    async def get_refund_data_many(buy_ids: list[int]) -> list[RefundBuyDTO]:
+        """
+        Refund data of every buy in one query, in the order of buy_ids.
+        """
+        if len(buy_ids) == 0:
+            return []
+        async with get_db_session() as session:
+            # All items of a buy belong to one subcategory, one row per buy is enough.
+            stmt = OtherSQLQuery.__select_refund_data().where(
+                BuyItem.buy_id.in_(buy_ids)
+            ).group_by(Buy.id)
+            buy_items = await session_execute(stmt, session)
+            refund_data = {row["buy_id"]: RefundBuyDTO(**row) for row in buy_items.mappings()}
+            return [refund_data[buy_id] for buy_id in buy_ids if buy_id in refund_data]
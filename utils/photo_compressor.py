@@ -0,0 +1,29 @@
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import config
+
+
+class PhotoCompressor:
+    @staticmethod
+    def compress(data: bytes) -> bytes:
+        """
+        Downscales the image to PHOTO_MAX_DIMENSION and re-encodes it as JPEG.
+        CPU bound, run it in a worker thread. Returns the original bytes if they are not a readable
+        image or if re-encoding would not make them smaller.
+        """
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((config.PHOTO_MAX_DIMENSION, config.PHOTO_MAX_DIMENSION), Image.LANCZOS)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                compressed = io.BytesIO()
+                image.save(compressed, format="JPEG", quality=config.PHOTO_JPEG_QUALITY, optimize=True)
+        except (UnidentifiedImageError, OSError):
+            return data
+        compressed = compressed.getvalue()
+        if len(compressed) >= len(data):
+            return data
+        return compressed
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+
+class PhotoStore:
+    """
+    Content-addressed photo files: data/photos/<first 2 hex digits>/<sha256>.
+    Identical photos share one file, the database only keeps the hash and the size.
+    """
+    photos_folder = Path("data") / "photos"
+    chunk_size = 64 * 1024
+
+    @staticmethod
+    def get_path(sha256: str) -> Path:
+        return PhotoStore.photos_folder / sha256[:2] / sha256
+
+    @staticmethod
+    def create_temporary_file() -> Path:
+        # Created inside the store, so add_file can move it into place with a rename.
+        PhotoStore.photos_folder.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=PhotoStore.photos_folder, suffix=".tmp")
+        os.close(file_descriptor)
+        return Path(temporary_path)
+
+    @staticmethod
+    def add_file(temporary_path: Path) -> tuple[str, int]:
+        """
+        Moves a file created by create_temporary_file into the store, returns its sha256 and size.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        with open(temporary_path, "rb") as f:
+            for chunk in iter(lambda: f.read(PhotoStore.chunk_size), b""):
+                sha256.update(chunk)
+                size += len(chunk)
+        sha256 = sha256.hexdigest()
+        photo_path = PhotoStore.get_path(sha256)
+        if photo_path.exists():
+            temporary_path.unlink()
+        else:
+            photo_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporary_path, photo_path)
+        return sha256, size
+
+    @staticmethod
+    def add_stream(stream: BinaryIO) -> tuple[str, int]:
+        temporary_path = PhotoStore.create_temporary_file()
+        try:
+            with open(temporary_path, "wb") as f:
+                for chunk in iter(lambda: stream.read(PhotoStore.chunk_size), b""):
+                    f.write(chunk)
+            return PhotoStore.add_file(temporary_path)
+        except BaseException:
+            temporary_path.unlink(missing_ok=True)
+            raise
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Union
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, TokenBasedRequestHandler
+from aiohttp import web
+
+
+class UpdateQueue:
+    """
+    Bounded intake for webhook updates. Updates of one chat are processed one at a time in arrival order,
+    updates of different chats by up to `workers` tasks in parallel.
+    Every chat with pending updates has a lane, a lane is in the ready queue while no worker processes it,
+    so a slow handler only holds back its own chat.
+    When max_size updates are pending, new ones are refused and Telegram retries them later.
+    """
+    # Wait times of the most recent updates the metrics are computed over.
+    wait_time_window = 1000
+
+    def __init__(self, workers: int, max_size: int):
+        self.workers = workers
+        self.max_size = max_size
+        self.pending = 0
+        self.in_progress = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.__lanes: dict[Hashable, deque[tuple[float, Callable[[], Awaitable[Any]]]]] = {}
+        self.__wait_times: deque[float] = deque(maxlen=self.wait_time_window)
+        # Created on startup, on Python 3.9 a queue binds to the event loop current at its creation.
+        self.__ready_lanes: Union[asyncio.Queue, None] = None
+        self.__worker_tasks: list[asyncio.Task] = []
+        # name -> function returning metrics of another stage, served by the metrics endpoint as well
+        self.__metrics_sources: dict[str, Callable[[], dict[str, Any]]] = {}
+        self.__metrics_runner: Union[web.AppRunner, None] = None
+
+    def add_metrics_source(self, name: str, get_metrics: Callable[[], dict[str, Any]]):
+        self.__metrics_sources[name] = get_metrics
+
+    def setup(self, app: web.Application, metrics_host: str, metrics_port: int, metrics_path: str):
+        """
+        Starts the workers with the webhook app. The metrics are not served by the webhook app, which is
+        reachable from the internet, but by a listener of their own, disabled with metrics_port 0.
+        """
+        app.on_startup.append(self.__start)
+        app.on_shutdown.append(self.__stop)
+        if metrics_port:
+            metrics_app = web.Application()
+            metrics_app.router.add_route("GET", metrics_path, self.handle_metrics)
+            self.__metrics_runner = web.AppRunner(metrics_app)
+
+            async def start_metrics_site(app: web.Application):
+                await self.__metrics_runner.setup()
+                await web.TCPSite(self.__metrics_runner, metrics_host, metrics_port).start()
+
+            async def stop_metrics_site(app: web.Application):
+                await self.__metrics_runner.cleanup()
+
+            app.on_startup.append(start_metrics_site)
+            app.on_cleanup.append(stop_metrics_site)
+
+    def submit(self, lane_key: Hashable, job: Callable[[], Awaitable[Any]]) -> bool:
+        if self.pending >= self.max_size:
+            self.rejected += 1
+            return False
+        self.pending += 1
+        self.accepted += 1
+        lane = self.__lanes.get(lane_key)
+        if lane is None:
+            self.__lanes[lane_key] = deque([(time.monotonic(), job)])
+            self.__ready_lanes.put_nowait(lane_key)
+        else:
+            # The lane is queued or being processed already, its worker picks the job up in order.
+            lane.append((time.monotonic(), job))
+        return True
+
+    async def __start(self, app: web.Application):
+        if self.__ready_lanes is None:
+            self.__ready_lanes = asyncio.Queue()
+            self.__worker_tasks = [asyncio.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def __stop(self, app: web.Application):
+        for task in self.__worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.__worker_tasks, return_exceptions=True)
+
+    async def __work(self):
+        while True:
+            lane_key = await self.__ready_lanes.get()
+            lane = self.__lanes[lane_key]
+            enqueued_at, job = lane.popleft()
+            self.pending -= 1
+            self.in_progress += 1
+            self.__wait_times.append(time.monotonic() - enqueued_at)
+            try:
+                await job()
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"Update processing failed: {e}")
+            finally:
+                self.in_progress -= 1
+                if lane:
+                    self.__ready_lanes.put_nowait(lane_key)
+                else:
+                    del self.__lanes[lane_key]
+
+    def get_metrics(self) -> dict[str, Any]:
+        wait_times = sorted(self.__wait_times)
+        return {
+            "queue_depth": self.pending,
+            "max_queue_depth": self.max_size,
+            "in_progress": self.in_progress,
+            "workers": self.workers,
+            "waiting_chats": len(self.__lanes),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "wait_time_avg": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+            "wait_time_p95": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0.0,
+            "wait_time_max": wait_times[-1] if wait_times else 0.0
+        }
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        metrics = self.get_metrics()
+        for name, get_metrics in self.__metrics_sources.items():
+            metrics[name] = get_metrics()
+        return web.json_response(metrics)
+
+    @staticmethod
+    def get_lane_key(bot: Bot, update: Dict[str, Any]) -> Hashable:
+        """
+        (bot id, chat id) of the update, falls back to the sender and then to the update itself.
+        """
+        for name, event in update.items():
+            if not isinstance(event, dict):
+                continue
+            chat = event.get("chat") or (event.get("message") or {}).get("chat")
+            if chat is not None:
+                return bot.id, chat["id"]
+            user = event.get("from") or event.get("user")
+            if user is not None:
+                return bot.id, user["id"]
+        return bot.id, "update", update.get("update_id")
+
+    async def accept(self, bot: Bot, request: web.Request,
+                     feed_update: Callable[[Bot, Dict[str, Any]], Awaitable[Any]]) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not self.submit(self.get_lane_key(bot, update), lambda: feed_update(bot, update)):
+            return web.json_response({"ok": False, "description": "Too many pending updates"}, status=429,
+                                     headers={"Retry-After": "1"})
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    SimpleRequestHandler that acknowledges the webhook as soon as the update is queued.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, update_queue: UpdateQueue,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token,
+                         **data)
+        self.update_queue = update_queue
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        return await self.update_queue.accept(bot, request, self._background_feed_update)
+
+
+class QueuedTokenBasedRequestHandler(TokenBasedRequestHandler):
+    """
+    TokenBasedRequestHandler that acknowledges the webhook as soon as the update is queued.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, update_queue: UpdateQueue,
+                 bot_settings: Optional[Dict[str, Any]] = None, **data: Any):
+        super().__init__(dispatcher=dispatcher, handle_in_background=True, bot_settings=bot_settings, **data)
+        self.update_queue = update_queue
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        return await self.update_queue.accept(bot, request, self._background_feed_update)